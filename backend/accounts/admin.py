@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, ManagerActionLog, DailyTicketReport, Table, WorkplaceType
+from .models import CustomUser, ManagerActionLog, DailyTicketReport, HourlyQueueStats, Table, WorkplaceType
 from import_export.admin import ExportActionMixin
 
 
@@ -44,7 +44,7 @@ class CustomUserAdmin(ExportActionMixin, UserAdmin):
     allowed_queues_display.short_description = 'Доступные очереди'
 
     def called_tickets_count(self, obj):
-        return obj.manageractionlog_set.filter(action__startswith="Вызван талон").count()
+        return obj.manageractionlog_set.filter(action_type=ManagerActionLog.TICKET_CALLED).count()
 
     called_tickets_count.short_description = 'Вызвано талонов'
 
@@ -134,7 +134,7 @@ class WorkplaceTypeAdmin(admin.ModelAdmin):
 class ManagerActionLogAdmin(ExportActionMixin, admin.ModelAdmin):
     list_display = ['manager', 'action', 'timestamp', 'ticket_number', 'queue_type', 'manager_type',
                     'manager_workplace']
-    list_filter = ['manager__manager_type', 'queue_type', 'manager__workplace', 'timestamp']
+    list_filter = ['action_type', 'manager__manager_type', 'queue_type', 'manager__workplace', 'timestamp']
     search_fields = ['manager__username', 'action', 'ticket_number']
     date_hierarchy = 'timestamp'
     ordering = ['-timestamp']
@@ -183,6 +183,24 @@ class DailyTicketReportAdmin(ExportActionMixin, admin.ModelAdmin):
     queue_stats_display.short_description = 'Статистика по очередям'
 
 
+@admin.register(HourlyQueueStats)
+class HourlyQueueStatsAdmin(ExportActionMixin, admin.ModelAdmin):
+    list_display = ['hour', 'queue_type', 'manager', 'workplace', 'arrivals', 'calls', 'avg_wait_display']
+    list_filter = ['queue_type', 'workplace', 'manager']
+    date_hierarchy = 'hour'
+    ordering = ['-hour']
+
+    def avg_wait_display(self, obj):
+        if not obj.wait_count:
+            return "—"
+        return f"{obj.wait_seconds_sum / obj.wait_count / 60:.1f} мин"
+
+    avg_wait_display.short_description = 'Среднее ожидание'
+
+    def has_change_permission(self, request, obj=None):
+        return False  # Счетчики ведет приложение
+
+
 @admin.register(Table)
 class TableAdmin(admin.ModelAdmin):
     list_display = ('name', 'description')
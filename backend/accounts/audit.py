@@ -0,0 +1,190 @@
+"""Буферизованная запись журнала действий менеджеров (ManagerActionLog).
+
+log_action только ставит запись в очередь в памяти; фоновый поток пишет
+накопленное одним bulk_create, как только набралось AUDIT_LOG_BATCH_SIZE
+записей или прошло AUDIT_LOG_FLUSH_INTERVAL секунд с первой из них. Запрос
+менеджера не ждет INSERT в журнал.
+
+Очередь ограничена AUDIT_LOG_MAX_BUFFER записями: при переполнении запись
+сохраняется сразу в вызывающем потоке. При завершении процесса оставшееся
+дописывается (atexit). Время действия фиксируется при постановке в очередь.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .models import ManagerActionLog
+
+logger = logging.getLogger(__name__)
+
+# Метка в очереди от flush(): фоновый поток закрывает пачку, не дожидаясь интервала
+_FLUSH = object()
+
+
+class AuditWriter:
+    def __init__(self, batch_size, flush_interval, max_buffer):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._queue = queue.Queue(maxsize=max(1, max_buffer))
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'queued': 0,        # поставлено в очередь
+            'written': 0,       # записано фоновыми пачками
+            'batches': 0,
+            'sync_writes': 0,   # буфер полон (или выключен) - записано сразу
+            'dropped': 0,       # запись не удалось сохранить, потеряна
+            'max_delay_ms': 0,  # наибольшая задержка записи из очереди
+        }
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def log(self, **fields):
+        fields.setdefault('timestamp', timezone.now())
+        entry = ManagerActionLog(**fields)
+        if self.max_buffer > 0:
+            self._ensure_thread()
+            try:
+                self._queue.put_nowait((time.monotonic(), entry))
+            except queue.Full:
+                pass
+            else:
+                self._count(queued=1)
+                return
+        # Буфер полон: лучше задержать один запрос, чем потерять запись
+        entry.save()
+        self._count(sync_writes=1)
+
+    def flush(self):
+        """Записать все, что есть в очереди, и дождаться пачки в работе"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+        if self._thread is not None:
+            self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['buffered'] = self._queue.qsize()
+        return stats
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # Пачка открывается первой записью и закрывается по размеру, по времени или по flush()
+            first = self._queue.get()
+            if first is _FLUSH:
+                self._queue.task_done()
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _FLUSH:
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            try:
+                ManagerActionLog.objects.bulk_create([entry for _, entry in batch])
+                written = len(batch)
+            except Exception:
+                # Одна плохая запись (например, менеджер уже удален) не должна
+                # терять всю пачку - пишем по одной
+                logger.exception("Error writing %d audit log entries, retrying one by one", len(batch))
+                written = self._write_each(batch)
+            delay_ms = int((time.monotonic() - batch[0][0]) * 1000)
+            with self._stats_lock:
+                self._stats['written'] += written
+                self._stats['dropped'] += len(batch) - written
+                self._stats['batches'] += 1
+                self._stats['max_delay_ms'] = max(self._stats['max_delay_ms'], delay_ms)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write_each(self, batch):
+        written = 0
+        for _, entry in batch:
+            try:
+                entry.save()
+            except Exception:
+                logger.exception("Dropping audit log entry: %s", entry.action)
+                if threading.current_thread() is self._thread:
+                    connections.close_all()
+            else:
+                written += 1
+        return written
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditWriter(
+                    settings.AUDIT_LOG_BATCH_SIZE,
+                    settings.AUDIT_LOG_FLUSH_INTERVAL,
+                    settings.AUDIT_LOG_MAX_BUFFER,
+                )
+                atexit.register(_writer.flush)
+    return _writer
+
+
+def log_action(**fields):
+    """Поставить запись ManagerActionLog в очередь на запись"""
+    get_writer().log(**fields)
+
+
+def flush():
+    """Дописать очередь в БД (завершение процесса, проверки)"""
+    if _writer is not None:
+        _writer.flush()
+
+
+def stats():
+    """Счетчики записанных, отложенных и потерянных записей"""
+    if _writer is None:
+        return {}
+    return _writer.stats()
@@ -0,0 +1,49 @@
+"""Выражения для атомарных обновлений счетчиков в UPDATE"""
+import re
+
+from django.db.models import Expression, F, JSONField
+
+_KEY_RE = re.compile(r'^\w+$')
+
+
+class JSONKeyIncrement(Expression):
+    """field[key] + amount внутри JSON-объекта, вычисляется в БД.
+
+    Используется в update(), чтобы увеличить счетчик в JSONField без чтения
+    строки: UPDATE ... SET stats = <выражение>. Отсутствующий ключ (и NULL
+    вместо объекта) считается нулем.
+    """
+
+    output_field = JSONField()
+
+    def __init__(self, field, key, amount=1):
+        if not _KEY_RE.match(key):
+            raise ValueError(f'Unsupported JSON key: {key!r}')
+        super().__init__()
+        self.source = F(field) if isinstance(field, str) else field
+        self.key = key
+        self.amount = int(amount)
+
+    def get_source_expressions(self):
+        return [self.source]
+
+    def set_source_expressions(self, exprs):
+        (self.source,) = exprs
+
+    def as_sql(self, compiler, connection):
+        # SQLite (JSON1) и MySQL
+        field_sql, field_params = compiler.compile(self.source)
+        path = f'$."{self.key}"'
+        sql = (
+            f"JSON_SET(COALESCE({field_sql}, '{{}}'), %s, "
+            f"COALESCE(JSON_EXTRACT({field_sql}, %s), 0) + %s)"
+        )
+        return sql, (*field_params, path, *field_params, path, self.amount)
+
+    def as_postgresql(self, compiler, connection):
+        field_sql, field_params = compiler.compile(self.source)
+        sql = (
+            f"JSONB_SET(COALESCE({field_sql}, '{{}}'::jsonb), ARRAY[%s]::text[], "
+            f"TO_JSONB(COALESCE(({field_sql} ->> %s)::integer, 0) + %s))"
+        )
+        return sql, (*field_params, self.key, *field_params, self.key, self.amount)
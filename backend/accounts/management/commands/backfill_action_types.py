@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from accounts.models import ManagerActionLog
+
+
+class Command(BaseCommand):
+    help = 'Fill ManagerActionLog.action_type for existing rows from the action text, in id batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Rows per id range (one transaction each)')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = ManagerActionLog.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write('Action log is empty')
+            return
+
+        started = time.perf_counter()
+        updated = 0
+        # Диапазоны по первичному ключу: короткие транзакции, журнал не блокируется надолго
+        for low in range(bounds['first'], bounds['last'] + 1, batch_size):
+            with transaction.atomic():
+                updated += ManagerActionLog.objects.filter(
+                    id__gte=low,
+                    id__lt=low + batch_size,
+                    action__startswith=ManagerActionLog.TICKET_CALLED_PREFIX
+                ).exclude(
+                    action_type=ManagerActionLog.TICKET_CALLED
+                ).update(action_type=ManagerActionLog.TICKET_CALLED)
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Marked {updated} ticket calls in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from accounts.models import ManagerWorkplace
+from queue_qr.models import QueueTicket
+
+
+class Command(BaseCommand):
+    help = 'Fill ManagerWorkplace.current_ticket with the latest ticket served by each manager'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # Один GROUP BY по обслуженным талонам: менеджер -> последний талон
+        latest_ids = QueueTicket.objects.filter(
+            served=True,
+            serving_manager__isnull=False
+        ).values('serving_manager').annotate(latest_id=Max('id')).values_list('latest_id', flat=True)
+
+        # Время вызова не хранится - берется время выдачи талона
+        assignments = [
+            ManagerWorkplace(
+                manager_id=ticket.serving_manager_id,
+                current_ticket_id=ticket.id,
+                current_serving=ticket.number,
+                last_ticket=ticket.number,
+                updated_at=ticket.created_at,
+            )
+            for ticket in QueueTicket.objects.filter(id__in=list(latest_ids)).only(
+                'id', 'number', 'serving_manager_id', 'created_at'
+            )
+        ]
+
+        with transaction.atomic():
+            ManagerWorkplace.objects.bulk_create(
+                assignments,
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=['manager'],
+                update_fields=['current_ticket', 'current_serving', 'last_ticket', 'updated_at'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Stored current tickets for {len(assignments)} managers'))
@@ -0,0 +1,70 @@
+import time
+import uuid
+
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from accounts.models import CustomUser, ManagerActionLog
+from queue_qr.management.commands._bench import BenchCommand, report_latencies
+
+
+class Command(BenchCommand):
+    help = 'Seed a large action log (rolled back afterwards) and time call counting by text prefix vs action_type'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5_000_000, help='Log rows to seed')
+        parser.add_argument('--managers', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            managers = self.seed(options['rows'], options['managers'], options['batch_size'])
+
+            # До заполнения action_type: поиск по тексту
+            before = self.time_counts(managers, action__startswith=ManagerActionLog.TICKET_CALLED_PREFIX)
+
+            started = time.perf_counter()
+            call_command('backfill_action_types', batch_size=100_000, stdout=self.stdout)
+            self.stdout.write(f'Backfill took {time.perf_counter() - started:.1f}s')
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            after = self.time_counts(managers, action_type=ManagerActionLog.TICKET_CALLED)
+
+            report_latencies(self.stdout, 'count by action__startswith', before)
+            report_latencies(self.stdout, 'count by action_type', after)
+            self.stdout.write(str(
+                ManagerActionLog.objects.filter(manager=managers[0], action_type=ManagerActionLog.TICKET_CALLED).explain()
+            ))
+            # Ничего из засеянного не сохраняем
+            transaction.set_rollback(True)
+
+    def seed(self, rows, manager_count, batch_size):
+        started = time.perf_counter()
+        managers = [
+            CustomUser.objects.create(username=f'bench_{uuid.uuid4().hex[:8]}', role=CustomUser.MANAGER)
+            for _ in range(manager_count)
+        ]
+        for offset in range(0, rows, batch_size):
+            ManagerActionLog.objects.bulk_create([
+                ManagerActionLog(
+                    manager=managers[i % manager_count],
+                    # Примерно 70% записей - вызовы талонов, как в рабочем журнале
+                    action=f'Вызван талон: {i % 999 + 1} (Bench {i}) - BACHELOR_GRANT' if i % 10 < 7 else 'Вход в систему',
+                    ticket_number=i % 999 + 1 if i % 10 < 7 else None,
+                    queue_type='BACHELOR_GRANT' if i % 10 < 7 else None,
+                )
+                for i in range(offset, min(offset + batch_size, rows))
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f'Seeded {rows} log rows for {manager_count} managers in {time.perf_counter() - started:.1f}s')
+        return managers
+
+    def time_counts(self, managers, **filters):
+        latencies = []
+        for manager in managers:
+            started = time.perf_counter()
+            ManagerActionLog.objects.filter(manager=manager, **filters).count()
+            latencies.append(time.perf_counter() - started)
+        return latencies
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import CommandError
+
+from accounts import audit
+from accounts.models import ManagerActionLog
+from queue_qr.management.commands._bench import BenchCommand, report_latencies, temporary_manager
+
+
+class Command(BenchCommand):
+    help = 'Time writing action log entries directly vs through the buffered audit writer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        entries = options['entries']
+        with temporary_manager() as manager:
+            direct = self.run(entries, lambda **fields: ManagerActionLog.objects.create(**fields), manager)
+
+            buffered = self.run(entries, audit.log_action, manager)
+            started = time.perf_counter()
+            audit.flush()
+            drain = time.perf_counter() - started
+
+            logs = ManagerActionLog.objects.filter(manager=manager).count()
+
+        report_latencies(self.stdout, 'ManagerActionLog.objects.create', direct)
+        report_latencies(self.stdout, 'audit.log_action', buffered)
+        self.stdout.write(f'Final flush took {drain * 1000:.1f}ms')
+        self.stdout.write(f'Writer stats: {audit.stats()}')
+
+        if logs != entries * 2:
+            raise CommandError(f'Expected {entries * 2} log rows, got {logs}')
+
+    def run(self, entries, write, manager):
+        latencies = []
+        for i in range(entries):
+            started = time.perf_counter()
+            write(
+                manager=manager,
+                action=f'Вызван талон: {i % 999 + 1} (Bench {i}) - BENCH',
+                action_type=ManagerActionLog.TICKET_CALLED,
+                ticket_number=i % 999 + 1,
+                queue_type='BENCH',
+            )
+            latencies.append(time.perf_counter() - started)
+        return latencies
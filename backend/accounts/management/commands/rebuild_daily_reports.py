@@ -0,0 +1,58 @@
+from collections import Counter
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+from accounts.models import DailyTicketReport, ManagerActionLog
+
+
+class Command(BaseCommand):
+    help = 'Rebuild DailyTicketReport counters and per-type stats from ManagerActionLog ticket calls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD), default: all days')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        logs = ManagerActionLog.objects.filter(action_type=ManagerActionLog.TICKET_CALLED)
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Invalid date: {options['since']}")
+            logs = logs.filter(timestamp__date__gte=since)
+
+        # Один GROUP BY по журналу: (менеджер, день, тип очереди) -> количество
+        rows = logs.annotate(day=TruncDate('timestamp')).values(
+            'manager_id', 'day', 'queue_type'
+        ).annotate(calls=Count('id')).order_by()
+
+        totals = Counter()
+        stats = {}
+        for row in rows.iterator():
+            key = (row['manager_id'], row['day'])
+            totals[key] += row['calls']
+            day_stats = stats.setdefault(key, {})
+            if row['queue_type']:
+                day_stats[row['queue_type']] = day_stats.get(row['queue_type'], 0) + row['calls']
+
+        reports = [
+            DailyTicketReport(manager_id=manager_id, date=day, ticket_count=count, queue_type_stats=stats[(manager_id, day)])
+            for (manager_id, day), count in totals.items()
+        ]
+
+        with transaction.atomic():
+            DailyTicketReport.objects.bulk_create(
+                reports,
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=['manager', 'date'],
+                update_fields=['ticket_count', 'queue_type_stats'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(reports)} daily reports from {sum(totals.values())} ticket calls'
+        ))
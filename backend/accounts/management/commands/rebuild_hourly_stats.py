@@ -0,0 +1,63 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+
+from accounts.models import CustomUser, HourlyQueueStats, ManagerActionLog
+from queue_qr.models import QueueTicket
+
+
+class Command(BaseCommand):
+    help = 'Rebuild HourlyQueueStats arrivals and calls from tickets and the action log (wait times are kept)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD), default: all days')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        tickets = QueueTicket.objects.all()
+        logs = ManagerActionLog.objects.filter(action_type=ManagerActionLog.TICKET_CALLED, queue_type__isnull=False)
+        stats = HourlyQueueStats.objects.all()
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Invalid date: {options['since']}")
+            tickets = tickets.filter(created_at__date__gte=since)
+            logs = logs.filter(timestamp__date__gte=since)
+            stats = stats.filter(hour__date__gte=since)
+
+        # GROUP BY по часам: (час, тип) -> выдано талонов, (час, тип, менеджер) -> вызовов
+        counts = {}
+        for row in tickets.annotate(bucket=TruncHour('created_at')).values(
+                'bucket', 'queue_type__name').annotate(total=Count('id')).order_by().iterator():
+            counts[(row['bucket'], row['queue_type__name'], None)] = {'arrivals': row['total']}
+        for row in logs.annotate(bucket=TruncHour('timestamp')).values(
+                'bucket', 'queue_type', 'manager_id').annotate(total=Count('id')).order_by().iterator():
+            counts[(row['bucket'], row['queue_type'], row['manager_id'])] = {'calls': row['total']}
+
+        workplaces = dict(CustomUser.objects.filter(role=CustomUser.MANAGER).values_list('id', 'workplace_id'))
+
+        with transaction.atomic():
+            # Существующие строки обновляются (ожидание в них сохраняется), недостающие создаются
+            existing = {(row.hour, row.queue_type, row.manager_id): row for row in stats.select_for_update()}
+            to_update, to_create = [], []
+            for (hour, queue_type, manager_id), values in counts.items():
+                row = existing.get((hour, queue_type, manager_id))
+                if row is None:
+                    to_create.append(HourlyQueueStats(
+                        hour=hour, queue_type=queue_type, manager_id=manager_id,
+                        workplace_id=workplaces.get(manager_id) if manager_id else None, **values
+                    ))
+                else:
+                    for field, value in values.items():
+                        setattr(row, field, value)
+                    to_update.append(row)
+            HourlyQueueStats.objects.bulk_update(to_update, ['arrivals', 'calls'], batch_size=options['batch_size'])
+            HourlyQueueStats.objects.bulk_create(to_create, batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(counts)} hourly buckets ({len(to_create)} new, {len(to_update)} updated)'
+        ))
@@ -0,0 +1,124 @@
+# Generated by Django 4.2.6 on 2026-10-18 13:04
+
+import datetime
+import django.contrib.auth.models
+import django.contrib.auth.validators
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('username', models.CharField(error_messages={'unique': 'A user with that username already exists.'}, help_text='Required. 150 characters or fewer. Letters, digits and @/./+/-/_ only.', max_length=150, unique=True, validators=[django.contrib.auth.validators.UnicodeUsernameValidator()], verbose_name='username')),
+                ('first_name', models.CharField(blank=True, max_length=150, verbose_name='first name')),
+                ('last_name', models.CharField(blank=True, max_length=150, verbose_name='last name')),
+                ('email', models.EmailField(blank=True, max_length=254, verbose_name='email address')),
+                ('is_staff', models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status')),
+                ('is_active', models.BooleanField(default=True, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined')),
+                ('role', models.CharField(choices=[('ADMIN', 'Admin'), ('TERMINAL', 'Terminal'), ('MANAGER', 'Manager')], default='TERMINAL', max_length=10)),
+                ('manager_type', models.CharField(blank=True, choices=[('BACHELOR_GRANT', 'Бакалавр грант'), ('BACHELOR_PAID', 'Бакалавр платное'), ('MASTER', 'Магистратура'), ('PHD', 'PhD'), ('PLATONUS', 'Platonus'), ('COLLEGE_GRANT', 'Колледж грант')], max_length=20, null=True)),
+                ('queue_permissions', models.JSONField(blank=True, default=list)),
+            ],
+            options={
+                'verbose_name': 'user',
+                'verbose_name_plural': 'users',
+                'abstract': False,
+            },
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyTicketReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(default=datetime.date.today)),
+                ('ticket_count', models.PositiveIntegerField(default=0)),
+                ('queue_type_stats', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyQueueStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('queue_type', models.CharField(max_length=20)),
+                ('arrivals', models.PositiveIntegerField(default=0)),
+                ('calls', models.PositiveIntegerField(default=0)),
+                ('wait_count', models.PositiveIntegerField(default=0)),
+                ('wait_seconds_sum', models.PositiveBigIntegerField(default=0)),
+                ('wait_seconds_max', models.PositiveIntegerField(default=0)),
+                ('wait_histogram', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'verbose_name': 'Почасовая статистика',
+                'verbose_name_plural': 'Почасовая статистика',
+                'ordering': ['-hour'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ManagerActionLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.TextField()),
+                ('action_type', models.CharField(choices=[('TICKET_CALLED', 'Вызов талона'), ('OTHER', 'Другое')], default='OTHER', max_length=20)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('ticket_number', models.PositiveIntegerField(blank=True, null=True)),
+                ('queue_type', models.CharField(blank=True, max_length=20, null=True)),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ManagerWorkplace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_serving', models.IntegerField(default=0)),
+                ('last_ticket', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Table',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('description', models.TextField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkplaceType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('workplace_type', models.CharField(choices=[('TABLE', 'Стол'), ('ROOM', 'Кабинет')], max_length=10)),
+                ('number', models.IntegerField()),
+                ('location', models.CharField(blank=True, max_length=200)),
+                ('is_active', models.BooleanField(default=True)),
+                ('allowed_queue_types', models.JSONField(blank=True, default=list)),
+            ],
+            options={
+                'verbose_name': 'Тип рабочего места',
+                'verbose_name_plural': 'Типы рабочих мест',
+                'ordering': ['workplace_type', 'number'],
+            },
+        ),
+    ]
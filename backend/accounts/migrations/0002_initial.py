@@ -0,0 +1,84 @@
+# Generated by Django 4.2.6 on 2026-10-18 13:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('queue_qr', '0001_initial'),
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='managerworkplace',
+            name='current_ticket',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='queue_qr.queueticket'),
+        ),
+        migrations.AddField(
+            model_name='managerworkplace',
+            name='manager',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='manageractionlog',
+            name='manager',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='hourlyqueuestats',
+            name='manager',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='hourlyqueuestats',
+            name='workplace',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounts.workplacetype'),
+        ),
+        migrations.AddField(
+            model_name='dailyticketreport',
+            name='manager',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='groups',
+            field=models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='user_permissions',
+            field=models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='workplace',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounts.workplacetype'),
+        ),
+        migrations.AddIndex(
+            model_name='manageractionlog',
+            index=models.Index(fields=['manager', 'action_type', 'timestamp'], name='log_manager_type_time'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlyqueuestats',
+            index=models.Index(fields=['manager', 'hour'], name='hourly_stats_manager_hour'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyqueuestats',
+            constraint=models.UniqueConstraint(fields=('hour', 'queue_type', 'manager'), name='hourly_stats_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyqueuestats',
+            constraint=models.UniqueConstraint(condition=models.Q(('manager__isnull', True)), fields=('hour', 'queue_type'), name='hourly_stats_arrivals_unique'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyticketreport',
+            unique_together={('manager', 'date')},
+        ),
+    ]
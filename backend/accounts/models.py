@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 from datetime import date
 
 
@@ -101,7 +102,7 @@ class CustomUser(AbstractUser):
         """Подсчет вызванных талонов"""
         return ManagerActionLog.objects.filter(
             manager=self,
-            action__startswith="Вызван талон"
+            action_type=ManagerActionLog.TICKET_CALLED
         ).count()
 
     def today_tickets_count(self):
@@ -145,38 +146,59 @@ class ManagerWorkplace(models.Model):
     manager = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
     current_serving = models.IntegerField(default=0)
     last_ticket = models.IntegerField(default=0)
+    # Последний вызванный менеджером талон: табло "Все обслуживаемые талоны"
+    # читает эту таблицу (строка на менеджера), а не группирует талоны за день
+    current_ticket = models.ForeignKey('queue_qr.QueueTicket', on_delete=models.SET_NULL, null=True, blank=True,
+                                       related_name='+')
+    updated_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Workplace for {self.manager.username}"
 
+    @classmethod
+    def assign(cls, manager, ticket_id, ticket_number, at=None):
+        """Запомнить талон, вызванный менеджером (UPDATE, строка создается при первом вызове)"""
+        values = {
+            'current_ticket_id': ticket_id,
+            'current_serving': ticket_number,
+            'last_ticket': ticket_number,
+            'updated_at': at or timezone.now(),
+        }
+        rows = cls.objects.filter(manager=manager)
+        if not rows.update(**values):
+            cls.objects.bulk_create([cls(manager=manager, **values)], ignore_conflicts=True)
+            rows.update(**values)
+
 
 class ManagerActionLog(models.Model):
+    TICKET_CALLED = 'TICKET_CALLED'
+    OTHER = 'OTHER'
+
+    ACTION_TYPE_CHOICES = [
+        (TICKET_CALLED, 'Вызов талона'),
+        (OTHER, 'Другое'),
+    ]
+
+    # Начало текста action у вызовов талона (для записей без action_type)
+    TICKET_CALLED_PREFIX = "Вызван талон"
+
     manager = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     action = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Код действия для подсчетов по индексу вместо поиска по тексту action
+    action_type = models.CharField(max_length=20, choices=ACTION_TYPE_CHOICES, default=OTHER)
+    # Время действия, а не вставки: записи пишутся пачками (accounts.audit)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     ticket_number = models.PositiveIntegerField(null=True, blank=True)
     queue_type = models.CharField(max_length=20, blank=True, null=True)  # Новое поле
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Обновляем счетчик при вызове талона
-        if "Вызван талон" in self.action:
-            report, created = DailyTicketReport.objects.get_or_create(
-                manager=self.manager,
-                date=self.timestamp.date(),
-                defaults={'ticket_count': 0}
-            )
-            if created:
-                report.ticket_count = 1
-            else:
-                report.ticket_count += 1
-            report.save()
-
     def __str__(self):
         return f"{self.manager.username} - {self.action} - {self.timestamp}"
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['manager', 'action_type', 'timestamp'], name='log_manager_type_time'),
+        ]
 
 
 class DailyTicketReport(models.Model):
@@ -193,11 +215,154 @@ class DailyTicketReport(models.Model):
     def __str__(self):
         return f"{self.manager.username} - {self.date} - {self.ticket_count} tickets"
 
+    @classmethod
+    def count_ticket(cls, manager, queue_type, day=None):
+        """Учесть вызванный талон в отчете менеджера за день.
+
+        Счетчики увеличиваются в самом UPDATE (F() и JSONKeyIncrement), без
+        чтения строки, поэтому параллельные вызовы из разных воркеров не
+        теряют обновлений. Строка отчета создается только для первого талона
+        дня; INSERT с ignore_conflicts не падает, если ее уже создал другой запрос.
+        """
+        from .expressions import JSONKeyIncrement
+
+        reports = cls.objects.filter(manager=manager, date=day or date.today())
+        increments = {
+            'ticket_count': models.F('ticket_count') + 1,
+            'queue_type_stats': JSONKeyIncrement('queue_type_stats', queue_type),
+        }
+        if not reports.update(**increments):
+            cls.objects.bulk_create([cls(manager=manager, date=day or date.today())], ignore_conflicts=True)
+            reports.update(**increments)
+
     def add_ticket_for_queue_type(self, queue_type):
         """Добавить талон для определенного типа очереди"""
-        if not self.queue_type_stats:
-            self.queue_type_stats = {}
+        self.count_ticket(self.manager, queue_type, self.date)
+        self.refresh_from_db(fields=['ticket_count', 'queue_type_stats'])
+
+
+class HourlyQueueStats(models.Model):
+    """Почасовая сводка по типу очереди и менеджеру.
+
+    Строка без менеджера считает пришедшие талоны (join_queue), строки
+    менеджеров - их вызовы и ожидание вызванных талонов (от выдачи до
+    вызова). Счетчики увеличиваются в момент события одним UPDATE, как в
+    DailyTicketReport.count_ticket, поэтому отчеты за неделю и месяц
+    складывают часы, а не перебирают талоны и журнал.
+    """
+    # Верхние границы корзин гистограммы ожидания, секунды; дольше - корзина gt_<последняя>
+    WAIT_BUCKETS = [60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200]
+
+    hour = models.DateTimeField()
+    queue_type = models.CharField(max_length=20)
+    manager = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True)
+    # Рабочее место менеджера при первом вызове за час
+    workplace = models.ForeignKey(WorkplaceType, on_delete=models.SET_NULL, null=True, blank=True)
+    arrivals = models.PositiveIntegerField(default=0)
+    calls = models.PositiveIntegerField(default=0)
+    # Вызовы с известным временем ожидания (у восстановленных из журнала его нет)
+    wait_count = models.PositiveIntegerField(default=0)
+    wait_seconds_sum = models.PositiveBigIntegerField(default=0)
+    wait_seconds_max = models.PositiveIntegerField(default=0)
+    wait_histogram = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'queue_type', 'manager'], name='hourly_stats_unique'),
+            # NULL в уникальном индексе не совпадает с NULL - строке прихода нужен свой
+            models.UniqueConstraint(fields=['hour', 'queue_type'], condition=models.Q(manager__isnull=True),
+                                    name='hourly_stats_arrivals_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['manager', 'hour'], name='hourly_stats_manager_hour'),
+        ]
+        verbose_name = "Почасовая статистика"
+        verbose_name_plural = "Почасовая статистика"
+
+    def __str__(self):
+        who = self.manager.username if self.manager else 'приход'
+        return f"{self.hour:%Y-%m-%d %H}:00 - {self.queue_type} - {who}"
+
+    @staticmethod
+    def hour_of(moment=None):
+        return (moment or timezone.now()).replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def wait_bucket(cls, seconds):
+        for bound in cls.WAIT_BUCKETS:
+            if seconds <= bound:
+                return f'le_{bound}'
+        return f'gt_{cls.WAIT_BUCKETS[-1]}'
+
+    @classmethod
+    def _increment(cls, keys, create=None, **increments):
+        rows = cls.objects.filter(**keys)
+        if not rows.update(**increments):
+            cls.objects.bulk_create([cls(**keys, **(create or {}))], ignore_conflicts=True)
+            rows.update(**increments)
+
+    @classmethod
+    def record_arrival(cls, queue_type, at=None):
+        """Учесть выданный талон"""
+        cls._increment(
+            {'hour': cls.hour_of(at), 'queue_type': queue_type, 'manager': None},
+            arrivals=models.F('arrivals') + 1,
+        )
+
+    @classmethod
+    def record_call(cls, manager, queue_type, wait_seconds, at=None):
+        """Учесть вызов талона, прождавшего wait_seconds"""
+        from django.db.models.functions import Greatest
+
+        from .expressions import JSONKeyIncrement
+
+        wait = max(0, int(wait_seconds))
+        cls._increment(
+            {'hour': cls.hour_of(at), 'queue_type': queue_type, 'manager': manager},
+            {'workplace_id': manager.workplace_id},
+            calls=models.F('calls') + 1,
+            wait_count=models.F('wait_count') + 1,
+            wait_seconds_sum=models.F('wait_seconds_sum') + wait,
+            wait_seconds_max=Greatest('wait_seconds_max', models.Value(wait)),
+            wait_histogram=JSONKeyIncrement('wait_histogram', cls.wait_bucket(wait)),
+        )
+
+    @classmethod
+    def summarize(cls, rows):
+        """Сложить часы выборки: приход, вызовы и ожидание (среднее, максимум, p50/p90).
+
+        Перцентили оцениваются по сложенной гистограмме - это верхняя
+        граница корзины, в которую попал перцентиль.
+        """
+        totals = {'arrivals': 0, 'calls': 0, 'wait_count': 0, 'wait_seconds_sum': 0, 'wait_seconds_max': 0}
+        histogram = {}
+        for row in rows.values(*totals, 'wait_histogram'):
+            for field in ('arrivals', 'calls', 'wait_count', 'wait_seconds_sum'):
+                totals[field] += row[field]
+            totals['wait_seconds_max'] = max(totals['wait_seconds_max'], row['wait_seconds_max'])
+            for bucket, count in (row['wait_histogram'] or {}).items():
+                histogram[bucket] = histogram.get(bucket, 0) + count
+
+        wait_count = totals['wait_count']
+        return {
+            "arrivals": totals['arrivals'],
+            "calls": totals['calls'],
+            "avg_wait_seconds": round(totals['wait_seconds_sum'] / wait_count) if wait_count else None,
+            "max_wait_seconds": totals['wait_seconds_max'] if wait_count else None,
+            "p50_wait_seconds": cls._wait_percentile(histogram, 50, totals['wait_seconds_max']),
+            "p90_wait_seconds": cls._wait_percentile(histogram, 90, totals['wait_seconds_max']),
+        }
 
-        self.queue_type_stats[queue_type] = self.queue_type_stats.get(queue_type, 0) + 1
-        self.ticket_count += 1
-        self.save()
\ No newline at end of file
+    @classmethod
+    def _wait_percentile(cls, histogram, pct, max_wait):
+        total = sum(histogram.values())
+        if not total:
+            return None
+        target = total * pct / 100
+        seen = 0
+        for bound in cls.WAIT_BUCKETS:
+            seen += histogram.get(f'le_{bound}', 0)
+            if seen >= target:
+                return min(bound, max_wait)
+        return max_wait
@@ -1,3 +1,206 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from queue_qr.models import QueueTicket, QueueType
+
+from . import audit
+from .audit import AuditWriter
+from .models import CustomUser, DailyTicketReport, ManagerActionLog, ManagerWorkplace
+
+
+class DailyTicketReportTests(TestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create(username='manager', role=CustomUser.MANAGER)
+
+    def test_count_ticket_creates_and_increments(self):
+        DailyTicketReport.count_ticket(self.manager, 'MASTER')
+        DailyTicketReport.count_ticket(self.manager, 'MASTER')
+        DailyTicketReport.count_ticket(self.manager, 'PHD')
+
+        report = DailyTicketReport.objects.get(manager=self.manager)
+        self.assertEqual(report.ticket_count, 3)
+        self.assertEqual(report.queue_type_stats, {'MASTER': 2, 'PHD': 1})
+
+    def test_count_ticket_keeps_existing_stats(self):
+        report = DailyTicketReport.objects.create(manager=self.manager, queue_type_stats={'PHD': 5})
+
+        report.add_ticket_for_queue_type('PHD')
+
+        self.assertEqual(report.ticket_count, 1)
+        self.assertEqual(report.queue_type_stats, {'PHD': 6})
+
+    def test_rejects_unsafe_json_keys(self):
+        with self.assertRaises(ValueError):
+            DailyTicketReport.count_ticket(self.manager, 'PHD", "x": "1')
+
+
+class AuditWriterTests(TransactionTestCase):
+    """Записи журнала; фоновый поток пишет в БД сам, поэтому данные коммитятся"""
+
+    def setUp(self):
+        self.manager = CustomUser.objects.create(username='manager', role=CustomUser.MANAGER)
+
+    def idle_writer(self, **options):
+        """Писатель без фонового потока: записи лежат в очереди до flush()"""
+        writer = AuditWriter(**{'batch_size': 10, 'flush_interval': 60, 'max_buffer': 100, **options})
+        patcher = mock.patch.object(writer, '_ensure_thread')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return writer
+
+    def log(self, writer, count, manager=None):
+        for i in range(count):
+            writer.log(manager=manager or self.manager, action=f'Действие {i}')
+
+    def test_full_buffer_writes_synchronously(self):
+        writer = self.idle_writer(max_buffer=2)
+
+        self.log(writer, 3)
+
+        self.assertEqual(ManagerActionLog.objects.count(), 1)
+        stats = writer.stats()
+        self.assertEqual((stats['queued'], stats['sync_writes'], stats['buffered']), (2, 1, 2))
+
+        writer.flush()
+
+        self.assertEqual(ManagerActionLog.objects.count(), 3)
+        self.assertEqual(writer.stats()['written'], 2)
+
+    def test_disabled_buffer_writes_synchronously(self):
+        writer = self.idle_writer(max_buffer=0)
+
+        self.log(writer, 2)
+
+        self.assertEqual(ManagerActionLog.objects.count(), 2)
+        self.assertEqual(writer.stats()['sync_writes'], 2)
+
+    def test_failed_batch_is_retried_one_by_one(self):
+        writer = self.idle_writer()
+        removed = CustomUser.objects.create(username='removed', role=CustomUser.MANAGER)
+        self.log(writer, 2)
+        self.log(writer, 1, manager=removed)
+        self.log(writer, 2)
+        # Менеджер удален, пока записи ждали в очереди: пачка целиком не вставится
+        removed.delete()
+
+        with self.assertLogs('accounts.audit', 'ERROR'):
+            writer.flush()
+
+        self.assertEqual(ManagerActionLog.objects.filter(manager=self.manager).count(), 4)
+        stats = writer.stats()
+        self.assertEqual((stats['written'], stats['dropped'], stats['buffered']), (4, 1, 0))
+
+    def test_flush_closes_background_batch(self):
+        writer = AuditWriter(batch_size=100, flush_interval=60, max_buffer=100)
+        self.log(writer, 1)
+        # Фоновый поток взял первую запись и ждет остальные до конца интервала
+        deadline = time.monotonic() + 5
+        while writer.stats()['buffered'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.log(writer, 4)
+
+        started = time.monotonic()
+        writer.flush()
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(ManagerActionLog.objects.count(), 5)
+        stats = writer.stats()
+        self.assertEqual((stats['written'], stats['buffered']), (5, 0))
+
+    def test_writer_is_flushed_at_exit(self):
+        with mock.patch.object(audit, '_writer', None), mock.patch('atexit.register') as register:
+            writer = audit.get_writer()
+
+        register.assert_called_once_with(writer.flush)
+
+
+def run_command(name, **options):
+    out = StringIO()
+    call_command(name, stdout=out, **options)
+    return out.getvalue()
+
+
+class BackfillActionTypesTests(TestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create(username='manager', role=CustomUser.MANAGER)
+
+    def log_entries(self):
+        return list(ManagerActionLog.objects.order_by('id').values_list('action', 'action_type'))
+
+    def test_marks_ticket_calls_once(self):
+        # Записи до появления action_type: тип по умолчанию OTHER, вызов виден только по тексту
+        for action in ['Вызван талон: 5 (Иванов) - MASTER', 'Вход в систему', 'Вызван талон: 6 - PHD',
+                       'Вызван талон: 7 - PHD', 'Сброс очереди MASTER']:
+            ManagerActionLog.objects.create(manager=self.manager, action=action)
+        ManagerActionLog.objects.create(manager=self.manager, action='Вызван талон: 8 - PHD',
+                                        action_type=ManagerActionLog.TICKET_CALLED)
+
+        # Пачки по два id: диапазоны не должны терять записи на границах
+        self.assertIn('Marked 3 ticket calls', run_command('backfill_action_types', batch_size=2))
+
+        called, other = ManagerActionLog.TICKET_CALLED, ManagerActionLog.OTHER
+        expected = [
+            ('Вызван талон: 5 (Иванов) - MASTER', called),
+            ('Вход в систему', other),
+            ('Вызван талон: 6 - PHD', called),
+            ('Вызван талон: 7 - PHD', called),
+            ('Сброс очереди MASTER', other),
+            ('Вызван талон: 8 - PHD', called),
+        ]
+        self.assertEqual(self.log_entries(), expected)
+
+        self.assertIn('Marked 0 ticket calls', run_command('backfill_action_types', batch_size=2))
+        self.assertEqual(self.log_entries(), expected)
+
+    def test_empty_log(self):
+        self.assertIn('Action log is empty', run_command('backfill_action_types'))
+
+
+class BackfillCurrentAssignmentsTests(TestCase):
+    def setUp(self):
+        self.first = CustomUser.objects.create(username='first', role=CustomUser.MANAGER)
+        self.second = CustomUser.objects.create(username='second', role=CustomUser.MANAGER)
+        self.idle = CustomUser.objects.create(username='idle', role=CustomUser.MANAGER)
+        self.queue_type = QueueType.objects.create(name=QueueType.MASTER, min_ticket_number=1, max_ticket_number=99)
+
+    def create_ticket(self, number, served=True, manager=None):
+        return QueueTicket.objects.create(
+            queue_type=self.queue_type, number=number, full_name=f'Студент {number}', served=served,
+            serving_manager=manager
+        )
+
+    def assignments(self):
+        return {
+            workplace.manager_id: (workplace.current_ticket_id, workplace.current_serving, workplace.last_ticket,
+                                   workplace.updated_at)
+            for workplace in ManagerWorkplace.objects.all()
+        }
+
+    def test_stores_latest_served_ticket(self):
+        # Талоны, обслуженные до появления current_ticket: рабочие места о них не знают
+        self.create_ticket(1, manager=self.first)
+        latest_first = self.create_ticket(2, manager=self.first)
+        latest_second = self.create_ticket(3, manager=self.second)
+        self.create_ticket(4, served=False)
+        self.create_ticket(5)
+        ManagerWorkplace.objects.create(manager=self.first, current_serving=1, last_ticket=1,
+                                        updated_at=timezone.now() - timedelta(days=1))
+        ManagerWorkplace.objects.create(manager=self.idle)
+
+        self.assertIn('Stored current tickets for 2 managers', run_command('backfill_current_assignments'))
+
+        expected = {
+            self.first.pk: (latest_first.pk, 2, 2, latest_first.created_at),
+            self.second.pk: (latest_second.pk, 3, 3, latest_second.created_at),
+            self.idle.pk: (None, 0, 0, None),
+        }
+        self.assertEqual(self.assignments(), expected)
+
+        run_command('backfill_current_assignments', batch_size=1)
+        self.assertEqual(self.assignments(), expected)
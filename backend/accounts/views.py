@@ -51,29 +51,22 @@ def profile_view(request):
     }
 
     if user.role == "MANAGER":
-        from queue_qr.models import QueueTicket, QueueType
+        from queue_qr.models import QueueTicket
+        from queue_qr import registry, waiting_line
 
-        # Статистика по всем разрешенным типам очередей
+        # Статистика по всем разрешенным типам очередей (из очередей в памяти)
         allowed_types = user.get_allowed_queue_types()
         ticket_counts = {}
 
         for queue_type_name in allowed_types:
-            try:
-                queue_type = QueueType.objects.get(name=queue_type_name)
-                count = QueueTicket.objects.filter(
-                    queue_type=queue_type,
-                    served=False
-                ).count()
-                ticket_counts[queue_type_name] = count
-            except QueueType.DoesNotExist:
-                ticket_counts[queue_type_name] = 0
+            ticket_counts[queue_type_name] = waiting_line.count(queue_type_name)
 
         response_data["ticket_counts"] = ticket_counts
 
         # Последний вызванный талон этим менеджером
         last_called_ticket = QueueTicket.objects.filter(
             serving_manager=user
-        ).order_by('-id').first()
+        ).select_related('queue_type').order_by('-id').first()
 
         if last_called_ticket:
             response_data["last_called_ticket"] = {
@@ -86,24 +79,22 @@ def profile_view(request):
         # Следующие талоны во всех разрешенных очередях
         next_tickets = []
         for queue_type_name in allowed_types:
-            try:
-                queue_type = QueueType.objects.get(name=queue_type_name)
-                next_ticket = QueueTicket.objects.filter(
-                    queue_type=queue_type,
-                    served=False
-                ).order_by('created_at').first()
-
-                if next_ticket:
-                    next_tickets.append({
-                        "number": next_ticket.number,
-                        "full_name": next_ticket.full_name,
-                        "queue_type": queue_type_name,
-                        "queue_type_display": queue_type.get_name_display(),
-                        "created_at": next_ticket.created_at.isoformat()
-                    })
-            except QueueType.DoesNotExist:
+            next_ticket = waiting_line.head(queue_type_name)
+            if next_ticket is None:
                 continue
 
+            queue_type = registry.get(queue_type_name)
+            if queue_type is None:
+                continue
+
+            next_tickets.append({
+                "number": next_ticket['number'],
+                "full_name": next_ticket['full_name'],
+                "queue_type": queue_type_name,
+                "queue_type_display": queue_type.get_name_display(),
+                "created_at": next_ticket['created_at'].isoformat()
+            })
+
         response_data["next_tickets"] = next_tickets
 
     return Response(response_data, status=status.HTTP_200_OK)
@@ -120,7 +111,8 @@ def manager_stats(request):
         return Response({"error": "Only managers can access this endpoint"}, status=status.HTTP_403_FORBIDDEN)
 
     from datetime import date, timedelta
-    from .models import DailyTicketReport, ManagerActionLog
+    from django.utils import timezone
+    from .models import DailyTicketReport, HourlyQueueStats, ManagerActionLog
 
     today = date.today()
     week_ago = today - timedelta(days=7)
@@ -141,6 +133,14 @@ def manager_stats(request):
 
     week_tickets = sum(report.ticket_count for report in week_reports)
 
+    # Время ожидания вызванных талонов - из почасовой сводки, без перебора талонов
+    today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    manager_hours = HourlyQueueStats.objects.filter(manager=user)
+    wait_stats = {
+        "today": HourlyQueueStats.summarize(manager_hours.filter(hour__gte=today_start)),
+        "week": HourlyQueueStats.summarize(manager_hours.filter(hour__gte=today_start - timedelta(days=7))),
+    }
+
     # Последние действия
     recent_actions = ManagerActionLog.objects.filter(
         manager=user
@@ -159,36 +159,33 @@ def manager_stats(request):
     allowed_types = user.get_allowed_queue_types()
     current_queues = {}
 
-    for queue_type_name in allowed_types:
-        try:
-            from queue_qr.models import QueueType
-            queue_type = QueueType.objects.get(name=queue_type_name)
-
-            tickets = QueueTicket.objects.filter(
-                queue_type=queue_type,
-                served=False
-            ).order_by('created_at')[:5]  # Первые 5 талонов
-
-            queue_data = []
-            for ticket in tickets:
-                queue_data.append({
-                    "number": ticket.number,
-                    "full_name": ticket.full_name,
-                    "created_at": ticket.created_at.isoformat()
-                })
+    from queue_qr import registry, waiting_line
 
-            current_queues[queue_type_name] = {
-                "display_name": queue_type.get_name_display(),
-                "tickets": queue_data,
-                "total_count": QueueTicket.objects.filter(queue_type=queue_type, served=False).count()
-            }
-
-        except QueueType.DoesNotExist:
+    for queue_type_name in allowed_types:
+        queue_type = registry.get(queue_type_name)
+        if queue_type is None:
             current_queues[queue_type_name] = {
                 "display_name": queue_type_name,
                 "tickets": [],
                 "total_count": 0
             }
+            continue
+
+        tickets = waiting_line.tickets(queue_type_name, limit=5)  # Первые 5 талонов
+
+        queue_data = []
+        for ticket in tickets:
+            queue_data.append({
+                "number": ticket['number'],
+                "full_name": ticket['full_name'],
+                "created_at": ticket['created_at'].isoformat()
+            })
+
+        current_queues[queue_type_name] = {
+            "display_name": queue_type.get_name_display(),
+            "tickets": queue_data,
+            "total_count": waiting_line.count(queue_type_name)
+        }
 
     # Статистика по типам очередей за сегодня
     today_stats_by_type = {}
@@ -202,7 +199,8 @@ def manager_stats(request):
         "current_queues": current_queues,
         "allowed_queue_types": allowed_types,
         "workplace": user.workplace.name if user.workplace else None,
-        "today_stats_by_type": today_stats_by_type
+        "today_stats_by_type": today_stats_by_type,
+        "wait_stats": wait_stats
     }
 
     return Response(response_data, status=status.HTTP_200_OK)
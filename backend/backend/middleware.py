@@ -1,15 +1,29 @@
 import logging
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
 logger = logging.getLogger('backend')
 
 class ExceptionLoggingMiddleware:
+    # Поддержка async, чтобы async-представления под daphne не уходили в поток
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         response = self.get_response(request)
         return response
 
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return response
+
     def process_exception(self, request, exception):
         logger.exception("Unhandled exception caught by middleware")
         # Optionally, you can log additional request details here
@@ -134,6 +134,47 @@ SIMPLE_JWT = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Кэш Django: версия и снимки состояния очередей (queue_qr.snapshot).
+# В docker переопределяется на Redis, чтобы версия была общей для всех воркеров
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Окно объединения рассылок количества талонов (queue_qr.ticket_counts), секунды;
+# 0 - рассылать сразу
+TICKET_COUNT_BROADCAST_WINDOW = 0.15
+
+# Буферизованная запись журнала действий менеджеров (accounts.audit)
+AUDIT_LOG_BATCH_SIZE = 200
+AUDIT_LOG_FLUSH_INTERVAL = 0.5  # секунды с первой записи в пачке
+AUDIT_LOG_MAX_BUFFER = 10000  # при переполнении пишется сразу; 0 - без буфера
+
+# Оценка времени ожидания (queue_qr.eta)
+ETA_EWMA_ALPHA = 0.2  # вес нового образца в скользящем среднем
+ETA_DEFAULT_SERVICE_SECONDS = 300  # пока нет ни одного образца
+ETA_MAX_SERVICE_SECONDS = 1800  # промежутки между вызовами длиннее - перерыв, не обслуживание
+ETA_CAPACITY_TTL = 60  # как часто перечитывать активные рабочие места, секунды
+
+# Голосовые объявления о вызове талона
+ANNOUNCEMENT_WORKERS = 4
+ANNOUNCEMENT_CACHE_DIR = 'announcements'  # внутри MEDIA_ROOT
+ANNOUNCEMENT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+ANNOUNCEMENT_CACHE_MAX_FILES = 50000
+# Движки синтеза по порядку: первый, который может озвучить объявление
+ANNOUNCEMENT_TTS_BACKENDS = [
+    'queue_qr.tts.ConcatenativeBackend',
+    'queue_qr.tts.GTTSBackend',
+]
+ANNOUNCEMENT_CLIPS_DIR = os.path.join(BASE_DIR, 'announcement_clips')
+
+# Сборщик сгенерированного аудио в MEDIA_ROOT (queue_qr.media_gc)
+MEDIA_SWEEP_TTL_SECONDS = 7 * 24 * 3600  # с последнего использования
+MEDIA_SWEEP_MAX_BYTES = ANNOUNCEMENT_CACHE_MAX_BYTES
+MEDIA_SWEEP_BATCH_SIZE = 500
+MEDIA_SWEEP_INTERVAL_SECONDS = 600
+
 STATIC_URL = '/django-static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
@@ -26,6 +26,13 @@ CHANNEL_LAYERS = {
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://redis:6379/1',  # Docker service name
+    },
+}
+
 # No HTTPS required for local
 CSRF_COOKIE_SECURE = False
 SESSION_COOKIE_SECURE = False
\ No newline at end of file
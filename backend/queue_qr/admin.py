@@ -2,6 +2,8 @@
 
 from django.contrib import admin
 from .models import Queue, QueueTicket, ApiStatus, QueueType
+from . import fanout, snapshot, waiting_line
+from .views import ticket_positions_reset_event
 
 
 @admin.register(QueueType)
@@ -9,6 +11,12 @@ class QueueTypeAdmin(admin.ModelAdmin):
     list_display = ['name', 'get_name_display', 'min_ticket_number', 'max_ticket_number', 'active_tickets_count']
     search_fields = ['name']
     list_filter = ['name']
+    # Счетчик меняет только выдача талонов
+    readonly_fields = ['last_ticket_number']
+
+    # Не перезаписываются при сохранении формы: форма несет значения на момент
+    # открытия страницы, и откат счетчика и карты выдал бы номера ожидающих талонов
+    COUNTER_FIELDS = {'last_ticket_number', 'ticket_bitmap'}
 
     def get_name_display(self, obj):
         """Отображение человекочитаемого названия"""
@@ -23,6 +31,19 @@ class QueueTypeAdmin(admin.ModelAdmin):
 
     active_tickets_count.short_description = 'Активных талонов'
 
+    def save_model(self, request, obj, form, change):
+        if change:
+            obj.save(update_fields=[
+                field.name for field in obj._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ])
+        else:
+            super().save_model(request, obj, form, change)
+        # Диапазон изменился - битовую карту занятых номеров нужно перестроить
+        if change and {'min_ticket_number', 'max_ticket_number'} & set(form.changed_data):
+            obj.rebuild_ticket_bitmap()
+        snapshot.bump()
+
 
 @admin.register(Queue)
 class QueueAdmin(admin.ModelAdmin):
@@ -78,19 +99,48 @@ class QueueTicketAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('queue_type', 'serving_manager')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self._rebuild_ticket_bitmaps({obj.queue_type_id})
+
+    def delete_model(self, request, obj):
+        queue_type_id = obj.queue_type_id
+        super().delete_model(request, obj)
+        self._rebuild_ticket_bitmaps({queue_type_id})
+
+    def delete_queryset(self, request, queryset):
+        queue_type_ids = set(queryset.values_list('queue_type_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self._rebuild_ticket_bitmaps(queue_type_ids)
+
     # Дополнительные действия
     actions = ['mark_as_served', 'mark_as_unserved']
 
+    def _rebuild_ticket_bitmaps(self, queue_type_ids):
+        """Перестроить битовые карты номеров и очереди в памяти после ручных изменений талонов"""
+        queue_types = list(QueueType.objects.filter(id__in=queue_type_ids))
+        for queue_type in queue_types:
+            queue_type.rebuild_ticket_bitmap()
+            waiting_line.reload(queue_type.name)
+        snapshot.bump(queue_types=[queue_type.name for queue_type in queue_types])
+        # Порядок изменился не вызовом головы - личные каналы талонов перечитывают позицию
+        for queue_type in queue_types:
+            fanout.send_positions(queue_type.name, ticket_positions_reset_event())
+
     def mark_as_served(self, request, queryset):
         """Отметить как обслуженные"""
+        queue_type_ids = set(queryset.values_list('queue_type_id', flat=True))
         updated = queryset.update(served=True)
+        self._rebuild_ticket_bitmaps(queue_type_ids)
         self.message_user(request, f'Отмечено как обслуженные: {updated} талонов')
 
     mark_as_served.short_description = "Отметить как обслуженные"
 
     def mark_as_unserved(self, request, queryset):
         """Отметить как необслуженные"""
+        queue_type_ids = set(queryset.values_list('queue_type_id', flat=True))
         updated = queryset.update(served=False)
+        self._rebuild_ticket_bitmaps(queue_type_ids)
         self.message_user(request, f'Отмечено как необслуженные: {updated} талонов')
 
     mark_as_unserved.short_description = "Отметить как необслуженные"
@@ -0,0 +1,245 @@
+"""Голосовые объявления о вызове талона.
+
+Объявление синтезирует первый подходящий движок из ANNOUNCEMENT_TTS_BACKENDS
+(см. queue_qr.tts). Мгновенные офлайн движки работают прямо в запросе
+call_next, медленные (gTTS - это сетевой запрос) - в фоновом пуле потоков;
+когда файл готов, подписчикам очереди и дисплеям отправляется событие
+queue.ticket_audio_ready со ссылкой на аудио.
+
+Текст объявления полностью определяется номером талона и рабочим местом,
+поэтому готовые файлы хранятся в кэше по хэшу (текст, язык, голос) и
+повторно не синтезируются.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import fanout, media_gc, tts
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_cache = None
+_backends = None
+_lock = threading.Lock()
+
+
+class AudioCache:
+    """Кэш аудио объявлений в MEDIA_ROOT с вытеснением давно неиспользованных файлов.
+
+    Порядок использования хранится в памяти процесса и восстанавливается
+    по времени изменения файлов; при попадании время файла обновляется,
+    чтобы порядок пережил перезапуск.
+    """
+
+    def __init__(self, media_root, directory, max_bytes, max_files):
+        self.directory = directory
+        self.path = os.path.join(media_root, directory)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # ключ -> размер файла
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def key(text, lang, voice):
+        return hashlib.sha256(f'{voice}\n{lang}\n{text}'.encode('utf-8')).hexdigest()
+
+    def relative_name(self, key):
+        """Путь файла относительно MEDIA_ROOT (для MEDIA_URL)"""
+        return f'{self.directory}/{key}.mp3'
+
+    def _file_path(self, key):
+        return os.path.join(self.path, f'{key}.mp3')
+
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+        files = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('.mp3'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def get(self, key):
+        """Имя файла из кэша или None"""
+        path = self._file_path(key)
+        with self._lock:
+            try:
+                # Отмечаем использование и заодно проверяем файл: его мог
+                # удалить сборщик media_gc или создать другой воркер
+                os.utime(path)
+            except OSError:
+                self._discard(key)
+                self.misses += 1
+                return None
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                self._add(key, os.path.getsize(path))
+            self.hits += 1
+        return self.relative_name(key)
+
+    def put(self, key, data):
+        """Сохранить аудио в кэш и вернуть имя файла"""
+        fd, temp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self._file_path(key))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            self._add(key, os.path.getsize(self._file_path(key)))
+            self._evict()
+        return self.relative_name(key)
+
+    def _add(self, key, size):
+        self._discard(key)
+        self._entries[key] = size
+        self._total_bytes += size
+
+    def _discard(self, key):
+        self._total_bytes -= self._entries.pop(key, 0)
+
+    def _evict(self):
+        while self._entries and (self._total_bytes > self.max_bytes or len(self._entries) > self.max_files):
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._file_path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ANNOUNCEMENT_WORKERS,
+                thread_name_prefix='announcements'
+            )
+        return _executor
+
+
+def get_cache():
+    global _cache
+    with _lock:
+        if _cache is None:
+            # Процесс, который пишет аудио, сам и чистит MEDIA_ROOT
+            media_gc.start()
+            _cache = AudioCache(
+                settings.MEDIA_ROOT,
+                settings.ANNOUNCEMENT_CACHE_DIR,
+                settings.ANNOUNCEMENT_CACHE_MAX_BYTES,
+                settings.ANNOUNCEMENT_CACHE_MAX_FILES
+            )
+        return _cache
+
+
+def get_backends():
+    global _backends
+    with _lock:
+        if _backends is None:
+            _backends = [import_string(path)() for path in settings.ANNOUNCEMENT_TTS_BACKENDS]
+        return _backends
+
+
+def choose_backend(ticket_number, location):
+    """Первый движок, который может озвучить объявление"""
+    for backend in get_backends():
+        if backend.supports(ticket_number, location):
+            return backend
+    return None
+
+
+def _cache_key(backend, ticket_number, location):
+    return AudioCache.key(tts.announcement_text(ticket_number, location), tts.LANGUAGE, backend.name)
+
+
+def cached_audio(ticket_number, location):
+    """Имя готового файла объявления относительно MEDIA_ROOT или None"""
+    backend = choose_backend(ticket_number, location)
+    if backend is None:
+        return None
+    return get_cache().get(_cache_key(backend, ticket_number, location))
+
+
+def render(ticket_number, location, backend=None):
+    """Синтезировать объявление в кэш и вернуть имя файла относительно MEDIA_ROOT"""
+    backend = backend or choose_backend(ticket_number, location)
+    if backend is None:
+        raise tts.TTSError(f'Нет движка для "{tts.announcement_text(ticket_number, location)}"')
+    audio = backend.synthesize(ticket_number, location)
+    return get_cache().put(_cache_key(backend, ticket_number, location), audio)
+
+
+def instant_audio(ticket_number, location):
+    """Файл объявления, если его можно получить без ожидания: из кэша или мгновенным движком"""
+    backend = choose_backend(ticket_number, location)
+    if backend is None:
+        return None
+
+    audio_name = get_cache().get(_cache_key(backend, ticket_number, location))
+    if audio_name is None and backend.instant:
+        try:
+            audio_name = render(ticket_number, location, backend)
+        except Exception:
+            logger.exception(f"Error synthesizing announcement for ticket {ticket_number}")
+    return audio_name
+
+
+def announce(ticket_number, location, media_url, message):
+    """Поставить синтез объявления в очередь фонового пула.
+
+    media_url - абсолютный адрес MEDIA_URL, message - данные вызванного
+    талона, они уходят дисплеям вместе с audio_url. Возвращает Future задачи.
+    """
+    return get_executor().submit(_announce, ticket_number, location, media_url, dict(message), time.monotonic())
+
+
+def _announce(ticket_number, location, media_url, message, queued_at):
+    try:
+        audio_name = render(ticket_number, location)
+    except Exception:
+        logger.exception(f"Error synthesizing announcement for ticket {ticket_number}")
+        return None
+
+    message['audio_url'] = media_url + audio_name
+    fanout.broadcast(message['queue_type'], {
+        "type": "queue.ticket_audio_ready",
+        "message": message
+    }, displays=True)
+    # Задержка от вызова талона до готовности аудио
+    return time.monotonic() - queued_at
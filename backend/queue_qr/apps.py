@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class QueueQrConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'queue_qr'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,139 @@
+"""Асинхронные join_queue и call_next для daphne.
+
+DRF-представления синхронные: под ASGI каждый запрос уходит в поток, а
+каждая рассылка через async_to_sync возвращается в цикл событий. Здесь
+обычные async-представления Django: чтение через async ORM, выдача и вызов
+талона (транзакции) - одним переходом sync_to_async, рассылки - напрямую
+через await. Ответы те же, что у синхронных версий в queue_qr.views.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework.authtoken.models import Token
+
+from . import fanout, registry, snapshot
+from .models import QueueFullError
+from .serializers import JoinQueueSerializer
+from .views import (
+    announce_ticket, call_next_response_data, is_within_restricted_hours, issue_queue_ticket,
+    join_queue_response_data, new_ticket_event, serve_next_ticket, ticket_added_op,
+    ticket_called_event, ticket_called_op, ticket_positions_event,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def csrf_exempt(view):
+    # django.views.decorators.csrf.csrf_exempt в Django 4.2 оборачивает
+    # представление синхронной функцией, поэтому только ставим атрибут
+    view.csrf_exempt = True
+    return view
+
+
+def _json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def authenticate_token(request):
+    """Пользователь по заголовку "Authorization: Token <key>" (как TokenAuthentication) или None"""
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword != 'Token' or not key.strip():
+        return None
+    try:
+        # Рабочее место нужно для прав и места обслуживания - загружаем сразу
+        token = await Token.objects.select_related('user__workplace').aget(key=key.strip())
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+
+@csrf_exempt
+async def join_queue(request):
+    if request.method != 'POST':
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+    if is_within_restricted_hours():
+        return JsonResponse({"message": "НЕ РАБОЧЕЕ ВРЕМЯ"}, status=200)
+
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+
+    serializer = JoinQueueSerializer(data=data)
+    # validate_type проверяет тип по реестру, который может перечитаться из БД
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse({"errors": serializer.errors}, status=400)
+
+    queue_type = await sync_to_async(registry.get)(serializer.validated_data['type'])
+    if queue_type is None:
+        return JsonResponse({"error": "Queue type not found"}, status=400)
+
+    try:
+        try:
+            ticket, version = await sync_to_async(issue_queue_ticket)(
+                queue_type, serializer.validated_data['full_name']
+            )
+        except QueueFullError as e:
+            return JsonResponse({"error": str(e)}, status=409)
+
+        await snapshot.apublish(version, [ticket_added_op(ticket)])
+        await fanout.abroadcast(queue_type.name, new_ticket_event(ticket))
+
+        # Позиция и ETA могут потребовать перечитать очередь и рабочие места из БД
+        response_data = await sync_to_async(join_queue_response_data)(ticket)
+        response_data['token'] = str(response_data['token'])
+        return JsonResponse(response_data, status=201)
+    except Exception as e:
+        logger.error(f"Error creating queue ticket: {str(e)}")
+        return JsonResponse({"error": "An error occurred while joining the queue"}, status=500)
+
+
+@csrf_exempt
+async def call_next(request):
+    if request.method != 'POST':
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+
+    user = await authenticate_token(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+    queue_type_name = data.get('type')
+
+    # Проверяем, может ли менеджер обслуживать этот тип очереди
+    if not user.can_serve_queue_type(queue_type_name):
+        return JsonResponse({
+            "error": f"У вас нет разрешения на обслуживание очереди '{queue_type_name}'. "
+                     f"Разрешенные типы: {', '.join(user.get_allowed_queue_types())}"
+        }, status=403)
+
+    queue_type = await sync_to_async(registry.get)(queue_type_name)
+    if queue_type is None:
+        return JsonResponse({"error": "Queue type not found"}, status=400)
+
+    try:
+        media_url = request.build_absolute_uri(settings.MEDIA_URL)
+        called = await sync_to_async(serve_next_ticket)(user, queue_type, media_url)
+        if called is None:
+            return JsonResponse({"message": "Queue is empty."}, status=200)
+        ticket_message, audio_url, version = called
+
+        await snapshot.apublish(version, [ticket_called_op(ticket_message)])
+        await fanout.abroadcast(queue_type_name, ticket_called_event(ticket_message, audio_url), displays=True)
+        await fanout.asend_positions(queue_type_name, ticket_positions_event(ticket_message, audio_url))
+
+        if audio_url is None:
+            announce_ticket(ticket_message, media_url)
+
+        return JsonResponse(call_next_response_data(ticket_message, audio_url), status=200)
+    except Exception as e:
+        logger.error(f"Error in call_next: {str(e)}")
+        return JsonResponse({"error": "An error occurred"}, status=500)
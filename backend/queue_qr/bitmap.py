@@ -0,0 +1,61 @@
+class TicketBitmap:
+    """Битовая карта занятых номеров талонов в диапазоне [min_number, max_number].
+
+    Бит i соответствует номеру min_number + i. Карта хранится как одно целое
+    Python, поэтому поиск свободного номера - это несколько побитовых операций
+    над машинными словами, а не перебор номеров.
+    """
+
+    def __init__(self, min_number, max_number, data=b''):
+        self.min_number = min_number
+        self.max_number = max_number
+        self.size = max(max_number - min_number + 1, 0)
+        self._mask = (1 << self.size) - 1
+        self.bits = int.from_bytes(data or b'', 'little') & self._mask
+
+    @classmethod
+    def from_numbers(cls, min_number, max_number, numbers):
+        """Построить карту по списку занятых номеров (номера вне диапазона игнорируются)"""
+        bitmap = cls(min_number, max_number)
+        for number in numbers:
+            if min_number <= number <= max_number:
+                bitmap.bits |= 1 << (number - min_number)
+        return bitmap
+
+    @classmethod
+    def byte_length(cls, min_number, max_number):
+        return (max(max_number - min_number + 1, 0) + 7) // 8
+
+    def to_bytes(self):
+        return self.bits.to_bytes(self.byte_length(self.min_number, self.max_number), 'little')
+
+    def is_taken(self, number):
+        return bool(self.bits >> (number - self.min_number) & 1)
+
+    def take(self, number):
+        self.bits |= 1 << (number - self.min_number)
+
+    def release(self, number):
+        if self.min_number <= number <= self.max_number:
+            self.bits &= ~(1 << (number - self.min_number))
+
+    def taken_count(self):
+        return bin(self.bits).count('1')
+
+    def next_free(self, after):
+        """Следующий свободный номер после after (по кругу) или None, если диапазон заполнен"""
+        free = ~self.bits & self._mask
+        if not free:
+            return None
+
+        start = after - self.min_number + 1
+        if start < 0 or start >= self.size:
+            start = 0
+
+        tail = free >> start
+        if tail:
+            offset = start + (tail & -tail).bit_length() - 1
+        else:
+            # После after свободных нет - берем первый свободный с начала диапазона
+            offset = (free & -free).bit_length() - 1
+        return self.min_number + offset
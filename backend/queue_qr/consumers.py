@@ -1,45 +1,70 @@
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 import json
 import logging
 
+from . import eta, fanout, frames, registry, waiting_line
+
 logger = logging.getLogger(__name__)
 
 
 class QueueConsumer(AsyncWebsocketConsumer):
+    """Обновления очередей.
+
+    ws/queues/<type>/ и действие subscribe_queue подписывают на события
+    одного типа, ws/queues/ и subscribe_queue с "all" - на все типы
+    (см. queue_qr.fanout).
+
+    В общей теме после подключения клиент получает снимок состояния (state_snapshot,
+    данные как у GET /queues/) с порядковым номером seq, затем изменения
+    state_delta с номерами seq + 1, seq + 2, ... Операции изменений
+    идемпотентны: ticket_added (талон в конец списка ожидающих), ticket_called
+    (талон убирается из ожидающих и становится текущим у менеджера),
+    queue_reset (очередь очищена), resync (перечитать снимок). Если номер
+    пропущен, клиент отправляет {"action": "resync"} и получает новый снимок.
+    """
+
     async def connect(self):
-        # Добавляем в общую группу для получения всех обновлений очередей
-        await self.channel_layer.group_add(
-            "queues",
-            self.channel_name
-        )
+        self.subscribed_groups = set()
 
-        # Если указан конкретный тип очереди, добавляем и в эту группу
+        # ws/queues/<type>/ - только события этого типа, ws/queues/ - все типы
         self.queue_type = self.scope['url_route']['kwargs'].get('queue_type')
         if self.queue_type:
-            await self.channel_layer.group_add(
-                f"queue_{self.queue_type}",
-                self.channel_name
-            )
+            if not await database_sync_to_async(registry.exists)(self.queue_type):
+                await self.close()
+                return
+            await self.subscribe(fanout.type_group(self.queue_type))
+        else:
+            await self.subscribe(fanout.ALL_GROUP)
 
         await self.accept()
         logger.info(f"WebSocket connected for queue_type: {self.queue_type}")
 
-    async def disconnect(self, close_code):
-        # Удаляем из общей группы
-        await self.channel_layer.group_discard(
-            "queues",
-            self.channel_name
-        )
+        # Поток состояния идет в общей теме
+        if fanout.ALL_GROUP in self.subscribed_groups:
+            await self.send_state_snapshot()
 
-        # Удаляем из группы конкретной очереди если была подключена
-        if hasattr(self, 'queue_type') and self.queue_type:
-            await self.channel_layer.group_discard(
-                f"queue_{self.queue_type}",
-                self.channel_name
-            )
+    async def disconnect(self, close_code):
+        for group in getattr(self, 'subscribed_groups', ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
 
         logger.info(f"WebSocket disconnected for queue_type: {getattr(self, 'queue_type', 'all')}")
 
+    async def subscribe(self, group):
+        """Подписка на тему. Общая тема и темы типов взаимоисключающие,
+        чтобы одно событие не приходило соединению дважды"""
+        if group == fanout.ALL_GROUP:
+            leave = self.subscribed_groups - {group}
+        else:
+            leave = self.subscribed_groups & {fanout.ALL_GROUP}
+
+        for old_group in leave:
+            await self.channel_layer.group_discard(old_group, self.channel_name)
+            self.subscribed_groups.discard(old_group)
+
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.subscribed_groups.add(group)
+
     async def receive(self, text_data):
         """Обработка входящих сообщений от клиента"""
         try:
@@ -52,80 +77,80 @@ class QueueConsumer(AsyncWebsocketConsumer):
                     'timestamp': data.get('timestamp')
                 }))
             elif action == 'subscribe_queue':
-                # Подписка на конкретную очередь
+                # Подписка на конкретную очередь или на все ("all")
                 queue_type = data.get('queue_type')
+                if queue_type and queue_type != 'all' and not await database_sync_to_async(registry.exists)(queue_type):
+                    await self.send(text_data=json.dumps({
+                        'type': 'error',
+                        'message': f"Unknown queue type: {queue_type}"
+                    }))
+                    return
+                if queue_type == 'all':
+                    await self.subscribe(fanout.ALL_GROUP)
+                elif queue_type:
+                    await self.subscribe(fanout.type_group(queue_type))
                 if queue_type:
-                    await self.channel_layer.group_add(
-                        f"queue_{queue_type}",
-                        self.channel_name
-                    )
                     await self.send(text_data=json.dumps({
                         'type': 'subscribed',
                         'queue_type': queue_type
                     }))
+                    if queue_type == 'all':
+                        await self.send_state_snapshot()
+            elif action == 'resync':
+                # Клиент пропустил изменения потока состояния
+                await self.send_state_snapshot()
         except json.JSONDecodeError:
             logger.error(f"Invalid JSON received: {text_data}")
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
 
-    async def send_queue_update(self, event):
-        """Отправка общих обновлений очереди"""
+    async def send_state_snapshot(self):
+        """Отправка полного снимка состояния очередей"""
+        from . import snapshot
+        from .views import queues_snapshot_source
+
+        version, payload = await database_sync_to_async(
+            lambda: snapshot.get_snapshot(*queues_snapshot_source())
+        )()
+
         await self.send(text_data=json.dumps({
-            'type': 'queue_update',
-            'data': event["text"]
+            'type': 'state_snapshot',
+            'seq': version,
+            'data': payload
         }))
 
+    async def send_frame(self, event):
+        """Готовый кадр от queue_qr.fanout - пересылаем без повторной сериализации"""
+        await self.send(text_data=event['text'])
+
+    # Обработчики событий, отправленных в группы без готового кадра
+    async def queue_state_delta(self, event):
+        """Изменение состояния очередей с порядковым номером"""
+        await self.send(text_data=frames.encode(frames.QUEUE, event))
+
+    async def send_queue_update(self, event):
+        """Отправка общих обновлений очереди"""
+        await self.send(text_data=frames.encode(frames.QUEUE, event))
+
     async def queue_ticket_called(self, event):
         """Обработка вызова талона с ФИО"""
-        message_data = event['message']
+        await self.send(text_data=frames.encode(frames.QUEUE, event))
 
-        # Формируем данные для отправки клиенту
-        response_data = {
-            'type': 'ticket_called',
-            'data': {
-                'queue_type': message_data.get('queue_type'),
-                'ticket_id': message_data.get('ticket_id'),
-                'ticket_number': message_data.get('ticket_number'),
-                'full_name': message_data.get('full_name'),  # Добавляем ФИО
-                'manager_username': message_data.get('manager_username'),
-                'audio_url': message_data.get('audio_url'),
-                'timestamp': message_data.get('timestamp')
-            }
-        }
-
-        await self.send(text_data=json.dumps(response_data))
-        logger.info(
-            f"Sent ticket_called for {message_data.get('full_name')} (ticket #{message_data.get('ticket_number')})")
+    async def queue_ticket_audio_ready(self, event):
+        """Аудио объявления о вызове талона готово"""
+        await self.send(text_data=frames.encode(frames.QUEUE, event))
 
     async def queue_ticket_count_update(self, event):
         """Обновление счетчиков талонов в очередях"""
-        await self.send(text_data=json.dumps({
-            'type': 'ticket_count_update',
-            'data': event['message']
-        }))
+        await self.send(text_data=frames.encode(frames.QUEUE, event))
 
     async def queue_status_update(self, event):
         """Обновление статуса очереди (открыта/закрыта/пауза)"""
-        await self.send(text_data=json.dumps({
-            'type': 'queue_status_update',
-            'data': event['message']
-        }))
+        await self.send(text_data=frames.encode(frames.QUEUE, event))
 
     async def new_ticket_created(self, event):
         """Уведомление о создании нового талона"""
-        message_data = event['message']
-
-        response_data = {
-            'type': 'new_ticket',
-            'data': {
-                'queue_type': message_data.get('queue_type'),
-                'ticket_number': message_data.get('ticket_number'),
-                'full_name': message_data.get('full_name'),  # Добавляем ФИО
-                'timestamp': message_data.get('timestamp')
-            }
-        }
-
-        await self.send(text_data=json.dumps(response_data))
+        await self.send(text_data=frames.encode(frames.QUEUE, event))
 
 
 class CallNextConsumer(AsyncWebsocketConsumer):
@@ -243,16 +268,26 @@ class DisplayConsumer(AsyncWebsocketConsumer):
     """Consumer для дисплеев в зонах ожидания"""
 
     async def connect(self):
+        # ws/displays/<type>/ - дисплей одной очереди, ws/displays/ - всех
+        queue_type = self.scope['url_route']['kwargs'].get('queue_type')
+        if queue_type and not await database_sync_to_async(registry.exists)(queue_type):
+            self.group = None
+            await self.close()
+            return
+        self.group = fanout.display_group(queue_type) if queue_type else fanout.ALL_DISPLAYS_GROUP
+
         await self.channel_layer.group_add(
-            "displays",
+            self.group,
             self.channel_name
         )
         await self.accept()
         logger.info("Display connected")
 
     async def disconnect(self, close_code):
+        if self.group is None:
+            return
         await self.channel_layer.group_discard(
-            "displays",
+            self.group,
             self.channel_name
         )
         logger.info("Display disconnected")
@@ -261,42 +296,163 @@ class DisplayConsumer(AsyncWebsocketConsumer):
         """Дисплеи обычно только получают данные"""
         pass
 
+    async def send_frame(self, event):
+        """Готовый кадр от queue_qr.fanout - пересылаем без повторной сериализации"""
+        await self.send(text_data=event['text'])
+
     async def queue_ticket_called(self, event):
         """Отображение вызванного талона на дисплее"""
-        message_data = event['message']
+        await self.send(text_data=frames.encode(frames.DISPLAY, event))
 
-        display_data = {
-            'type': 'display_ticket_called',
-            'data': {
-                'queue_type': message_data.get('queue_type'),
-                'ticket_number': message_data.get('ticket_number'),
-                'full_name': message_data.get('full_name'),
-                'manager_location': self.get_manager_location(message_data.get('manager_username')),
-                'audio_url': message_data.get('audio_url'),
-                'timestamp': message_data.get('timestamp')
+    async def queue_ticket_audio_ready(self, event):
+        """Аудио объявления готово - дисплей его проигрывает"""
+        await self.send(text_data=frames.encode(frames.DISPLAY, event))
+
+    async def queue_status_update(self, event):
+        """Обновление статуса очереди на дисплее"""
+        await self.send(text_data=frames.encode(frames.DISPLAY, event))
+
+
+class TicketConsumer(AsyncWebsocketConsumer):
+    """Личный канал талона: ws/tickets/<token>/.
+
+    Отправляет только данные своего талона: позицию и ETA (ticket_position),
+    вызов с рабочим местом (ticket_called) и уход из очереди без вызова
+    (ticket_not_waiting). Позиция при подключении берется из дерева Фенвика
+    очереди (queue_qr.waiting_line), затем сдвигается событиями вызова из
+    группы positions_<TYPE>, а после сброса (reset_queue, правки талонов в
+    админке, пропуск уже обслуженных талонов) перечитывается; кадр
+    отправляется, только если позиция изменилась. После вызова своего талона канал сообщает еще о следующем
+    вызове в очереди - клиент отмечает, что талон пропущен.
+    """
+
+    async def connect(self):
+        self.ticket = await database_sync_to_async(self.load_ticket)(self.scope['url_route']['kwargs']['token'])
+        if self.ticket is None:
+            await self.close()
+            return
+
+        self.group = fanout.positions_group(self.ticket['queue_type'])
+        self.ahead = None
+        self.called = False
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+        if self.ticket['called'] is not None:
+            self.called = True
+            await self.send_called(self.ticket['called'])
+        else:
+            await self.refresh_position()
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'ticket', None) is not None:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            logger.error(f"Invalid JSON received: {text_data}")
+            return
+
+        if data.get('action') == 'ping':
+            await self.send(text_data=json.dumps({'type': 'pong', 'timestamp': data.get('timestamp')}))
+        elif data.get('action') == 'refresh' and not self.called:
+            self.ahead = None
+            await self.refresh_position()
+
+    @staticmethod
+    def load_ticket(token):
+        from django.core.exceptions import ValidationError
+        from .models import QueueTicket
+
+        try:
+            ticket = QueueTicket.objects.select_related(
+                'queue_type', 'serving_manager__workplace'
+            ).filter(token=token).first()
+        except ValidationError:
+            return None
+        if ticket is None:
+            return None
+
+        called = None
+        if ticket.served and ticket.serving_manager is not None:
+            called = {
+                'ticket_id': ticket.id,
+                'ticket_number': ticket.number,
+                'queue_type_display': ticket.queue_type.get_name_display(),
+                'manager_username': ticket.serving_manager.username,
+                'manager_location': ticket.serving_manager.get_manager_location(),
             }
+        return {
+            'id': ticket.id,
+            'number': ticket.number,
+            'queue_type': ticket.queue_type.name,
+            'called': called,
         }
 
-        await self.send(text_data=json.dumps(display_data))
+    def lookup_position(self):
+        ahead = waiting_line.ahead_of(self.ticket['queue_type'], self.ticket['id'])
+        return ahead, eta.seconds_per_ticket(self.ticket['queue_type'])
 
-    def get_manager_location(self, username):
-        """Определение местоположения менеджера по username"""
-        if not username:
-            return "Стол"
+    async def refresh_position(self):
+        ahead, per_ticket = await database_sync_to_async(self.lookup_position)()
+        await self.update_position(ahead, per_ticket)
 
-        username_lower = username.lower()
+    async def update_position(self, ahead, per_ticket):
+        if ahead is None:
+            await self.send(text_data=json.dumps({
+                'type': 'ticket_not_waiting',
+                'data': {'ticket_id': self.ticket['id'], 'ticket_number': self.ticket['number']}
+            }))
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+            return
 
-        if username_lower in ['auditoria111', 'aauditoria111']:
-            return "Аудитория 111"
-        elif username_lower in ['auditoria303', 'auditoria305', 'auditoria306']:
-            return f"Аудитория {username_lower[-3:]}"
-        else:
-            stol_number = username_lower[-1] if username_lower else "1"
-            return f"Стол {stol_number}"
+        if ahead == self.ahead:
+            return
+        self.ahead = ahead
+        await self.send(text_data=json.dumps({
+            'type': 'ticket_position',
+            'data': {
+                'ticket_id': self.ticket['id'],
+                'ticket_number': self.ticket['number'],
+                'queue_type': self.ticket['queue_type'],
+                'position': ahead + 1,
+                'ahead': ahead,
+                'eta_seconds': eta.estimate_from_rate(ahead, per_ticket),
+            }
+        }))
 
-    async def queue_status_update(self, event):
-        """Обновление статуса очереди на дисплее"""
+    async def send_called(self, called):
         await self.send(text_data=json.dumps({
-            'type': 'display_queue_status',
-            'data': event['message']
-        }))
\ No newline at end of file
+            'type': 'ticket_called',
+            'data': {
+                'ticket_id': called['ticket_id'],
+                'ticket_number': called['ticket_number'],
+                'queue_type_display': called.get('queue_type_display'),
+                'manager_username': called.get('manager_username'),
+                'manager_location': called.get('manager_location'),
+                'audio_url': called.get('audio_url'),
+            }
+        }))
+
+    async def ticket_positions(self, event):
+        """Вызов или сброс в очереди талона (см. queue_qr.views.ticket_positions_event)"""
+        called = event.get('called')
+        if called is None:
+            if not self.called:
+                await self.refresh_position()
+            return
+
+        if self.called:
+            # Следующий вызов после нашего: клиент отмечает талон пропущенным
+            await self.send_called(called)
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+        elif called['ticket_id'] == self.ticket['id']:
+            self.called = True
+            self.ahead = None
+            await self.send_called(called)
+        elif self.ahead is None or event.get('reset'):
+            await self.refresh_position()
+        elif self.ahead > event['removed_ahead']:
+            await self.update_position(self.ahead - 1, event['eta_seconds_per_ticket'])
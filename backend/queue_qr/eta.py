@@ -0,0 +1,121 @@
+"""Оценка времени ожидания талонов.
+
+Для каждого типа очереди ведется скользящее среднее (EWMA) времени
+обслуживания одного талона одним рабочим местом. Образец - промежуток
+между двумя вызовами одного менеджера: столько занял предыдущий талон.
+Промежутки длиннее ETA_MAX_SERVICE_SECONDS (перерыв, первый вызов дня)
+не учитываются. Среднее хранится в кэше Django, поэтому его обновляют и
+читают все процессы.
+
+Пропускная способность типа - сумма долей активных рабочих мест, которые
+его обслуживают (WorkplaceType.allowed_queue_types): место с тремя типами
+отдает каждому треть. Время на один талон очереди = среднее обслуживание /
+пропускная способность, а ETA талона = (талонов впереди + 1) * время на
+талон. При join и call меняется только одно число на тип, ETA всех
+ожидающих следуют из их позиции без пересчета.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+SERVICE_KEY = 'eta_service:{}'
+LAST_CALL_KEY = 'eta_last_call:{}'
+
+_capacity_lock = threading.Lock()
+_capacity = None
+_capacity_loaded_at = 0.0
+
+
+def record_call(manager, queue_type_name, called_at):
+    """Менеджер вызвал талон: предыдущий его талон обслуживался до этого момента"""
+    key = LAST_CALL_KEY.format(manager.pk)
+    previous = cache.get(key)
+    cache.set(key, (called_at.timestamp(), queue_type_name), timeout=settings.ETA_MAX_SERVICE_SECONDS)
+    if previous is None:
+        return
+
+    previous_at, previous_type = previous
+    interval = called_at.timestamp() - previous_at
+    if 0 < interval <= settings.ETA_MAX_SERVICE_SECONDS:
+        observe_service(previous_type, interval)
+
+
+def observe_service(queue_type_name, seconds):
+    """Учесть время обслуживания одного талона.
+
+    Чтение и запись в кэше не атомарны: одновременный образец из другого
+    процесса может потеряться, для скользящего среднего это допустимо.
+    """
+    key = SERVICE_KEY.format(queue_type_name)
+    state = cache.get(key)
+    if state is None:
+        state = {'seconds': float(seconds), 'samples': 1}
+    else:
+        alpha = settings.ETA_EWMA_ALPHA
+        state = {
+            'seconds': alpha * seconds + (1 - alpha) * state['seconds'],
+            'samples': state['samples'] + 1,
+        }
+    cache.set(key, state, timeout=None)
+
+
+def service_seconds(queue_type_name):
+    """Среднее время обслуживания талона типа одним рабочим местом"""
+    state = cache.get(SERVICE_KEY.format(queue_type_name))
+    if state is None:
+        return float(settings.ETA_DEFAULT_SERVICE_SECONDS)
+    return state['seconds']
+
+
+def capacity(queue_type_name):
+    """Сколько рабочих мест (с учетом долей) обслуживает тип очереди"""
+    global _capacity, _capacity_loaded_at
+    with _capacity_lock:
+        if _capacity is None or time.monotonic() - _capacity_loaded_at > settings.ETA_CAPACITY_TTL:
+            _capacity = _load_capacity()
+            _capacity_loaded_at = time.monotonic()
+        return _capacity.get(queue_type_name, 0.0)
+
+
+def _load_capacity():
+    from accounts.models import CustomUser, WorkplaceType
+
+    # Активное место - включенное и с назначенным менеджером
+    workplaces = WorkplaceType.objects.filter(
+        is_active=True,
+        customuser__role=CustomUser.MANAGER
+    ).distinct().values_list('id', 'allowed_queue_types')
+
+    result = {}
+    for _, allowed in workplaces:
+        allowed = set(allowed or [])
+        for queue_type_name in allowed:
+            result[queue_type_name] = result.get(queue_type_name, 0.0) + 1 / len(allowed)
+    return result
+
+
+def seconds_per_ticket(queue_type_name):
+    """Через сколько секунд в среднем очередь типа продвигается на один талон.
+
+    None - тип сейчас никто не обслуживает, оценки нет.
+    """
+    desks = capacity(queue_type_name)
+    if desks <= 0:
+        return None
+    return service_seconds(queue_type_name) / desks
+
+
+def estimate(queue_type_name, ahead, per_ticket=None):
+    """ETA в секундах для талона, перед которым ahead талонов (None - без оценки)"""
+    if per_ticket is None:
+        per_ticket = seconds_per_ticket(queue_type_name)
+    return estimate_from_rate(ahead, per_ticket)
+
+
+def estimate_from_rate(ahead, per_ticket):
+    """ETA по уже известному времени на талон, без кэша и БД (для async-кода)"""
+    if per_ticket is None:
+        return None
+    return round((ahead + 1) * per_ticket)
@@ -0,0 +1,115 @@
+"""Рассылка событий очередей подписчикам по темам.
+
+Каждый тип очереди - отдельная тема: группа queue_<TYPE> для QueueConsumer
+и display_<TYPE> для DisplayConsumer. Подписчики всех типов сидят в
+группах "queues" и "displays". Соединение состоит либо в общей группе,
+либо в группах типов, поэтому событие доходит до него один раз, а
+стоимость рассылки зависит от числа заинтересованных подписчиков, а не
+от всех соединений.
+
+События уходят готовыми JSON-кадрами (queue_qr.frames): кадр кодируется
+один раз на аудиторию, а не в каждом соединении.
+
+Личные каналы талонов (TicketConsumer) сидят в группе positions_<TYPE> и
+получают одно событие на вызов: кадр у каждого талона свой, его строит
+сам консьюмер.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from . import frames
+
+ALL_GROUP = 'queues'
+ALL_DISPLAYS_GROUP = 'displays'
+
+
+def type_group(queue_type):
+    return f'queue_{queue_type}'
+
+
+def display_group(queue_type):
+    return f'display_{queue_type}'
+
+
+def positions_group(queue_type):
+    return f'positions_{queue_type}'
+
+
+def groups_for(queue_type, displays=False):
+    groups = [ALL_GROUP, type_group(queue_type)]
+    if displays:
+        groups += [ALL_DISPLAYS_GROUP, display_group(queue_type)]
+    return groups
+
+
+async def _group_send(channel_layer, messages):
+    for group, event in messages:
+        await channel_layer.group_send(group, event)
+
+
+def _send(messages):
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not messages:
+        return
+    async_to_sync(_group_send)(channel_layer, messages)
+
+
+async def _asend(messages):
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not messages:
+        return
+    await _group_send(channel_layer, messages)
+
+
+def _frame_messages(messages, audience):
+    encoded = {}
+    frame_messages = []
+    for group, event in messages:
+        if id(event) not in encoded:
+            encoded[id(event)] = frames.frame_event(frames.encode(audience, event))
+        frame_messages.append((group, encoded[id(event)]))
+    return frame_messages
+
+
+def _broadcast_messages(queue_type, event, displays):
+    queue_frame = frames.frame_event(frames.encode(frames.QUEUE, event))
+    messages = [(ALL_GROUP, queue_frame), (type_group(queue_type), queue_frame)]
+    if displays:
+        display_frame = frames.frame_event(frames.encode(frames.DISPLAY, event))
+        messages += [(ALL_DISPLAYS_GROUP, display_frame), (display_group(queue_type), display_frame)]
+    return messages
+
+
+def send_many(messages, audience=frames.QUEUE):
+    """Отправить пары (группа, событие) одним переходом в async.
+
+    Каждое событие один раз кодируется в кадр для аудитории, консьюмеры
+    пересылают его без сериализации.
+    """
+    _send(_frame_messages(messages, audience))
+
+
+async def asend_many(messages, audience=frames.QUEUE):
+    await _asend(_frame_messages(messages, audience))
+
+
+def broadcast(queue_type, event, displays=False):
+    """Отправить событие о типе очереди его подписчикам и подписчикам всех типов.
+
+    displays - отправить и дисплеям (у DisplayConsumer есть обработчики
+    только для вызова талона, аудио и статуса очереди).
+    """
+    _send(_broadcast_messages(queue_type, event, displays))
+
+
+async def abroadcast(queue_type, event, displays=False):
+    await _asend(_broadcast_messages(queue_type, event, displays))
+
+
+def send_positions(queue_type, event):
+    """Событие личным каналам ожидающих талонов типа (без готового кадра)"""
+    _send([(positions_group(queue_type), event)])
+
+
+async def asend_positions(queue_type, event):
+    await _asend([(positions_group(queue_type), event)])
@@ -0,0 +1,126 @@
+"""Кадры WebSocket для подписчиков очередей.
+
+Событие channel layer превращается в JSON-кадр один раз для каждой
+аудитории (QueueConsumer и DisplayConsumer получают разные поля), а не в
+каждом соединении. queue_qr.fanout отправляет готовый текст событием
+send.frame, и консьюмеры пересылают его как есть.
+"""
+import json
+
+QUEUE = 'queue'
+DISPLAY = 'display'
+
+
+def display_location(username):
+    """Определение местоположения менеджера по username"""
+    if not username:
+        return "Стол"
+
+    username_lower = username.lower()
+
+    if username_lower in ['auditoria111', 'aauditoria111']:
+        return "Аудитория 111"
+    elif username_lower in ['auditoria303', 'auditoria305', 'auditoria306']:
+        return f"Аудитория {username_lower[-3:]}"
+    else:
+        stol_number = username_lower[-1] if username_lower else "1"
+        return f"Стол {stol_number}"
+
+
+def _queue_ticket_called(event):
+    message_data = event['message']
+    return {
+        'type': 'ticket_called',
+        'data': {
+            'queue_type': message_data.get('queue_type'),
+            'ticket_id': message_data.get('ticket_id'),
+            'ticket_number': message_data.get('ticket_number'),
+            'full_name': message_data.get('full_name'),
+            'manager_username': message_data.get('manager_username'),
+            'audio_url': message_data.get('audio_url'),
+            'timestamp': message_data.get('timestamp')
+        }
+    }
+
+
+def _queue_ticket_audio_ready(event):
+    message_data = event['message']
+    return {
+        'type': 'ticket_audio_ready',
+        'data': {
+            'queue_type': message_data.get('queue_type'),
+            'ticket_id': message_data.get('ticket_id'),
+            'ticket_number': message_data.get('ticket_number'),
+            'manager_username': message_data.get('manager_username'),
+            'audio_url': message_data.get('audio_url')
+        }
+    }
+
+
+def _new_ticket_created(event):
+    message_data = event['message']
+    return {
+        'type': 'new_ticket',
+        'data': {
+            'queue_type': message_data.get('queue_type'),
+            'ticket_number': message_data.get('ticket_number'),
+            'full_name': message_data.get('full_name'),
+            'timestamp': message_data.get('timestamp')
+        }
+    }
+
+
+def _display_ticket_called(event):
+    message_data = event['message']
+    return {
+        'type': 'display_ticket_called',
+        'data': {
+            'queue_type': message_data.get('queue_type'),
+            'ticket_number': message_data.get('ticket_number'),
+            'full_name': message_data.get('full_name'),
+            'manager_location': display_location(message_data.get('manager_username')),
+            'audio_url': message_data.get('audio_url'),
+            'timestamp': message_data.get('timestamp')
+        }
+    }
+
+
+def _display_ticket_audio_ready(event):
+    message_data = event['message']
+    return {
+        'type': 'display_ticket_audio_ready',
+        'data': {
+            'queue_type': message_data.get('queue_type'),
+            'ticket_number': message_data.get('ticket_number'),
+            'audio_url': message_data.get('audio_url')
+        }
+    }
+
+
+# Тип события channel layer -> построитель кадра
+SHAPES = {
+    QUEUE: {
+        'queue_state_delta': lambda event: {'type': 'state_delta', 'seq': event['seq'], 'ops': event['ops']},
+        'send_queue_update': lambda event: {'type': 'queue_update', 'data': event['text']},
+        'queue_ticket_called': _queue_ticket_called,
+        'queue_ticket_audio_ready': _queue_ticket_audio_ready,
+        'queue_ticket_count_update': lambda event: {'type': 'ticket_count_update', 'data': event['message']},
+        'queue_status_update': lambda event: {'type': 'queue_status_update', 'data': event['message']},
+        'new_ticket_created': _new_ticket_created,
+    },
+    DISPLAY: {
+        'queue_ticket_called': _display_ticket_called,
+        'queue_ticket_audio_ready': _display_ticket_audio_ready,
+        'queue_status_update': lambda event: {'type': 'display_queue_status', 'data': event['message']},
+    },
+}
+
+
+def encode(audience, event):
+    """JSON-кадр события для аудитории"""
+    return json.dumps(SHAPES[audience][event['type'].replace('.', '_')](event))
+
+
+def frame_event(text):
+    """Событие channel layer с готовым кадром"""
+    return {'type': 'send.frame', 'text': text}
@@ -0,0 +1,162 @@
+"""Общие помощники для команд bench_*"""
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.test import override_settings
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from queue_qr.models import QueueType
+
+
+def require_test_database():
+    """Замеры создают BENCH_* типы, талоны и менеджеров - только в тестовой БД"""
+    if connection.settings_dict['NAME'] != connection.creation._get_test_db_name():
+        raise CommandError(
+            f"Refusing to run against {connection.settings_dict['NAME']}: bench commands need a test database"
+        )
+
+
+@contextmanager
+def bench_database():
+    """Временная тестовая БД, кэш в памяти и слой каналов в памяти.
+
+    Рабочие данные, кэш (версии снимков, реестр типов) и группы каналов
+    не затрагиваются. SQLite-база создается файлом, а не в памяти, чтобы
+    потоки замеров работали со своими соединениями.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    original_name = test_settings.get('NAME')
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite' and not original_name:
+            test_settings['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={DEFAULT_DB_ALIAS})
+        try:
+            with override_settings(
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+            ):
+                require_test_database()
+                yield
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            test_settings['NAME'] = original_name
+
+
+class BenchCommand(BaseCommand):
+    """Команда-замер: handle() выполняется во временной тестовой БД"""
+
+    def execute(self, *args, **options):
+        with bench_database():
+            return super().execute(*args, **options)
+
+
+@contextmanager
+def temporary_queue_type(min_ticket_number=1, max_ticket_number=999):
+    """Временный тип очереди для замеров, удаляется вместе со своими талонами"""
+    require_test_database()
+    queue_type = QueueType.objects.create(
+        name=f'BENCH_{uuid.uuid4().hex[:8].upper()}',
+        min_ticket_number=min_ticket_number,
+        max_ticket_number=max_ticket_number,
+    )
+    try:
+        yield queue_type
+    finally:
+        queue_type.delete()
+
+
+@contextmanager
+def joinable_queue_type():
+    """Тип очереди, который принимает join_queue (имя из JoinQueueSerializer).
+
+    Если такого типа еще нет в БД, он создается на время замера; иначе
+    после замера удаляются созданные им талоны и восстанавливается счетчик.
+    """
+    from queue_qr import snapshot, waiting_line
+    from queue_qr.models import QueueTicket
+    from queue_qr.serializers import JoinQueueSerializer
+
+    require_test_database()
+    existing = set(QueueType.objects.values_list('name', flat=True))
+    for name in JoinQueueSerializer.VALID_QUEUE_TYPES:
+        if name not in existing:
+            queue_type = QueueType.objects.create(name=name, min_ticket_number=1, max_ticket_number=9999)
+            try:
+                yield queue_type
+            finally:
+                queue_type.delete()
+                waiting_line.reload(name)
+                snapshot.bump()
+            return
+
+    queue_type = QueueType.objects.get(name=JoinQueueSerializer.VALID_QUEUE_TYPES[0])
+    last_id = QueueTicket.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    try:
+        yield queue_type
+    finally:
+        QueueTicket.objects.filter(queue_type=queue_type, id__gt=last_id).delete()
+        QueueType.objects.filter(pk=queue_type.pk).update(last_ticket_number=queue_type.last_ticket_number)
+        queue_type.rebuild_ticket_bitmap()
+        waiting_line.reload(queue_type.name)
+        snapshot.bump()
+
+
+def percentile(values, pct):
+    """Перцентиль по отсортированной выборке (без numpy)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@contextmanager
+def temporary_manager(*queue_type_names):
+    """Временный менеджер с правом обслуживать указанные типы очередей"""
+    from accounts import audit
+    from accounts.models import CustomUser
+
+    require_test_database()
+    manager = CustomUser.objects.create(
+        username=f'bench_{uuid.uuid4().hex[:8]}',
+        role=CustomUser.MANAGER,
+        queue_permissions=list(queue_type_names),
+    )
+    try:
+        yield manager
+    finally:
+        # Журнал действий пишется в фоне - дописать его, пока менеджер есть в БД
+        audit.flush()
+        manager.delete()
+
+
+def seed_waiting_tickets(queue_type, count, batch_size=5000):
+    """Засеять count ожидающих талонов с номерами min_ticket_number.."""
+    from queue_qr.models import QueueTicket
+
+    QueueTicket.objects.bulk_create([
+        QueueTicket(queue_type=queue_type, number=queue_type.min_ticket_number + i, full_name=f'Bench {i}')
+        for i in range(count)
+    ], batch_size=batch_size)
+    queue_type.rebuild_ticket_bitmap()
+
+
+def report_latencies(stdout, label, latencies):
+    """Вывести p50/p99/среднее по замерам в секундах"""
+    if not latencies:
+        stdout.write(f'{label}: no samples')
+        return
+    stdout.write(
+        f'{label}: n={len(latencies)} '
+        f'p50={percentile(latencies, 50) * 1000:.2f}ms '
+        f'p99={percentile(latencies, 99) * 1000:.2f}ms '
+        f'mean={sum(latencies) / len(latencies) * 1000:.2f}ms'
+    )
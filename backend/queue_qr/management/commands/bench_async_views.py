@@ -0,0 +1,93 @@
+import asyncio
+import tempfile
+import time
+
+from django.core.management.base import CommandError
+from django.test import AsyncClient, override_settings
+from rest_framework.authtoken.models import Token
+
+from queue_qr import announcements, waiting_line
+from queue_qr.tts import TTSBackend
+
+from ._bench import (
+    BenchCommand, joinable_queue_type, report_latencies, seed_waiting_tickets,
+    temporary_manager, temporary_queue_type,
+)
+
+
+class SilentTTSBackend(TTSBackend):
+    """Мгновенный движок-заглушка: замеряется путь запроса, а не синтез"""
+
+    name = 'bench-silent'
+    instant = True
+
+    def synthesize(self, ticket_number, location):
+        return b''
+
+
+class Command(BenchCommand):
+    help = 'Load comparison of sync DRF and async join_queue / call_next through the ASGI handler'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight')
+
+    def handle(self, *args, **options):
+        requests = options['requests']
+        concurrency = options['concurrency']
+
+        announcements._cache = None
+        announcements._backends = None
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(
+                MEDIA_ROOT=media_root,
+                ANNOUNCEMENT_TTS_BACKENDS=[f'{__name__}.SilentTTSBackend'],
+                CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            ):
+                with joinable_queue_type() as queue_type:
+                    body = {'type': queue_type.name, 'full_name': 'Bench Join'}
+                    for label, path in (('sync join_queue', '/api/v2/queue/join-queue/'),
+                                        ('async join_queue', '/api/v2/queue/async/join-queue/')):
+                        self.load(label, path, body, {}, requests, concurrency, 201)
+
+                with temporary_queue_type(1, 2 * requests) as queue_type, \
+                        temporary_manager(queue_type.name) as manager:
+                    seed_waiting_tickets(queue_type, 2 * requests)
+                    waiting_line.reload(queue_type.name)
+                    token = Token.objects.create(user=manager)
+                    headers = {'Authorization': f'Token {token.key}'}
+                    body = {'type': queue_type.name}
+                    for label, path in (('sync call_next', '/api/v2/queue/call-next/'),
+                                        ('async call_next', '/api/v2/queue/async/call-next/')):
+                        self.load(label, path, body, headers, requests, concurrency, 200)
+                    waiting_line.clear(queue_type.name)
+        finally:
+            announcements._cache = None
+            announcements._backends = None
+
+    def load(self, label, path, body, headers, requests, concurrency, expected_status):
+        latencies, elapsed, statuses = asyncio.run(self.run(path, body, headers, requests, concurrency))
+
+        unexpected = [code for code in statuses if code != expected_status]
+        if unexpected:
+            raise CommandError(f'{label}: {len(unexpected)} responses with status {unexpected[0]}')
+
+        report_latencies(self.stdout, label, latencies)
+        self.stdout.write(f'  {requests / elapsed:.0f} requests/s with {concurrency} in flight')
+
+    async def run(self, path, body, headers, requests, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        statuses = []
+
+        async def one_request():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(path, body, content_type='application/json', headers=headers)
+                latencies.append(time.perf_counter() - started)
+                statuses.append(response.status_code)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(requests)))
+        return latencies, time.perf_counter() - started, statuses
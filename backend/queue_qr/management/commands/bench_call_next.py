@@ -0,0 +1,186 @@
+import tempfile
+import threading
+import time
+from concurrent.futures import wait
+
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from queue_qr import announcements, waiting_line
+from queue_qr.models import QueueTicket
+from queue_qr.tts import TTSBackend
+from queue_qr.views import call_next, claim_next_ticket
+
+from ._bench import BenchCommand, report_latencies, seed_waiting_tickets, temporary_manager, temporary_queue_type
+
+
+class SlowTTSBackend(TTSBackend):
+    """Заглушка медленного сетевого движка синтеза"""
+
+    name = 'bench-slow'
+    delay = 0.5
+
+    def synthesize(self, ticket_number, location):
+        time.sleep(self.delay)
+        return b''
+
+
+class Command(BenchCommand):
+    help = 'Benchmark call_next ticket claiming with a long waiting line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--waiting', type=int, default=10_000, help='Waiting tickets to seed')
+        parser.add_argument('--calls', type=int, default=1000, help='Number of calls to measure')
+        parser.add_argument('--threads', type=int, default=8, help='Parallel managers for the stress run')
+        parser.add_argument('--view-calls', type=int, default=200, help='Full call_next requests to measure')
+        parser.add_argument('--tts-delay', type=float, default=0.5, help='Seconds the stubbed TTS backend sleeps')
+
+    def handle(self, *args, **options):
+        waiting = options['waiting']
+        calls = min(options['calls'], waiting)
+
+        with temporary_queue_type(1, waiting) as queue_type, temporary_manager(queue_type.name) as manager:
+            seed_waiting_tickets(queue_type, waiting)
+            self.stdout.write(f'Seeded {waiting} waiting tickets')
+
+            # Прежний путь: поиск головы в БД и полный save()
+            latencies = []
+            for _ in range(calls):
+                started = time.perf_counter()
+                ticket = QueueTicket.objects.filter(
+                    queue_type=queue_type,
+                    served=False
+                ).order_by('created_at').first()
+                ticket.served = True
+                ticket.serving_manager = manager
+                ticket.save()
+                latencies.append(time.perf_counter() - started)
+            report_latencies(self.stdout, 'DB head + save()', latencies)
+
+            # Текущий путь: голова из очереди в памяти
+            QueueTicket.objects.filter(queue_type=queue_type).update(served=False, serving_manager=None)
+            queue_type.rebuild_ticket_bitmap()
+            waiting_line.reload(queue_type.name)
+
+            latencies = []
+            for _ in range(calls):
+                started = time.perf_counter()
+                claim_next_ticket(queue_type, manager)
+                latencies.append(time.perf_counter() - started)
+            report_latencies(self.stdout, 'claim_next_ticket', latencies)
+
+            # Параллельные менеджеры разбирают всю очередь
+            QueueTicket.objects.filter(queue_type=queue_type).update(served=False, serving_manager=None)
+            waiting_line.reload(queue_type.name)
+            self.stress(queue_type, manager, waiting, options['threads'])
+
+            # Полный запрос call_next с медленным TTS
+            QueueTicket.objects.filter(queue_type=queue_type).update(served=False, serving_manager=None)
+            waiting_line.reload(queue_type.name)
+            self.view_latency(queue_type, manager, min(options['view_calls'], waiting), options['tts_delay'])
+
+            waiting_line.clear(queue_type.name)
+
+    def view_latency(self, queue_type, manager, calls, tts_delay):
+        factory = APIRequestFactory()
+        futures = []
+
+        def tracking_announce(*args, **kwargs):
+            future = original_announce(*args, **kwargs)
+            futures.append(future)
+            return future
+
+        def request_call_next():
+            request = factory.post('/api/v2/queue/call-next/', {'type': queue_type.name}, format='json')
+            force_authenticate(request, user=manager)
+            started = time.perf_counter()
+            response = call_next(request)
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f'call_next returned {response.status_code}: {response.data}')
+            return elapsed
+
+        SlowTTSBackend.delay = tts_delay
+        original_announce = announcements.announce
+        announcements.announce = tracking_announce
+        # Кэш объявлений во временном каталоге, чтобы не засорять MEDIA_ROOT
+        announcements._cache = None
+        announcements._backends = None
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(
+                MEDIA_ROOT=media_root,
+                ANNOUNCEMENT_TTS_BACKENDS=[f'{__name__}.SlowTTSBackend'],
+                CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            ):
+                # Как было раньше: синтез внутри запроса
+                inline = []
+                for _ in range(calls // 2):
+                    started = time.perf_counter()
+                    request_call_next()
+                    SlowTTSBackend().synthesize(0, '')
+                    inline.append(time.perf_counter() - started)
+
+                wait(futures)
+                futures.clear()
+
+                background = [request_call_next() for _ in range(calls - calls // 2)]
+                wait(futures)
+        finally:
+            announcements.announce = original_announce
+            announcements._cache = None
+            announcements._backends = None
+
+        self.stdout.write(f'Stubbed TTS delay: {tts_delay * 1000:.0f}ms')
+        report_latencies(self.stdout, 'call_next with inline TTS', inline)
+        report_latencies(self.stdout, 'call_next with background TTS', background)
+        report_latencies(
+            self.stdout,
+            'audio ready after call',
+            [future.result() for future in futures if future.result() is not None]
+        )
+
+    def stress(self, queue_type, manager, waiting, threads):
+        claimed_ids = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        entry = claim_next_ticket(queue_type, manager)
+                    except Exception as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    if entry is None:
+                        return
+                    with lock:
+                        claimed_ids.append(entry['id'])
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        served = QueueTicket.objects.filter(queue_type=queue_type, served=True).count()
+        self.stdout.write(
+            f'{threads} managers claimed {len(claimed_ids)} tickets in {elapsed:.2f}s '
+            f'({len(claimed_ids) / elapsed:.0f} claims/s), {len(errors)} errors'
+        )
+
+        if errors:
+            raise CommandError(f'Claim failed: {errors[0]}')
+        if len(set(claimed_ids)) != len(claimed_ids):
+            raise CommandError(f'Duplicate claims: {len(claimed_ids) - len(set(claimed_ids))}')
+        if len(claimed_ids) != waiting or served != waiting:
+            raise CommandError(f'Claimed {len(claimed_ids)}, served {served}, expected {waiting}')
+
+        self.stdout.write(self.style.SUCCESS('Every ticket was claimed exactly once'))
@@ -0,0 +1,62 @@
+import asyncio
+import random
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from queue_qr import fanout
+from queue_qr.models import QueueType
+
+from ._bench import report_latencies
+
+
+class Command(BaseCommand):
+    help = 'Benchmark websocket fanout: one "queues" group vs per-type topics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=5000, help='Connected QueueConsumer clients')
+        parser.add_argument('--all-share', type=float, default=0.1,
+                            help='Share of clients subscribed to all types (boards); the rest pick one type')
+        parser.add_argument('--events', type=int, default=200, help='Events to broadcast')
+
+    def handle(self, *args, **options):
+        queue_types = [name for name, _ in QueueType.QUEUE_TYPE_CHOICES]
+        asyncio.run(self.run(queue_types, options['subscribers'], options['all_share'], options['events']))
+
+    async def run(self, queue_types, subscribers, all_share, events):
+        rng = random.Random(0)
+        # Подписчик: None - все типы, иначе тип очереди
+        topics = [None if rng.random() < all_share else rng.choice(queue_types) for _ in range(subscribers)]
+        event_types = [rng.choice(queue_types) for _ in range(events)]
+        self.stdout.write(
+            f'{subscribers} subscribers: {topics.count(None)} on all types, '
+            f'{subscribers - topics.count(None)} on one of {len(queue_types)} types; {events} events'
+        )
+
+        # Прежняя схема: все соединения в группе "queues"
+        layer = InMemoryChannelLayer(capacity=events + 1)
+        for _ in topics:
+            await layer.group_add(fanout.ALL_GROUP, await layer.new_channel())
+        await self.measure(layer, 'single "queues" group', [[fanout.ALL_GROUP]] * events)
+
+        # Темы по типам очередей
+        layer = InMemoryChannelLayer(capacity=events + 1)
+        for topic in topics:
+            group = fanout.ALL_GROUP if topic is None else fanout.type_group(topic)
+            await layer.group_add(group, await layer.new_channel())
+        await self.measure(layer, 'per-type topics', [fanout.groups_for(queue_type) for queue_type in event_types])
+
+    async def measure(self, layer, label, groups_per_event):
+        latencies = []
+        for groups in groups_per_event:
+            event = {'type': 'queue_ticket_count_update', 'message': {'ticket_counts': {}}}
+            started = time.perf_counter()
+            for group in groups:
+                await layer.group_send(group, event)
+            latencies.append(time.perf_counter() - started)
+
+        deliveries = sum(queue.qsize() for queue in layer.channels.values())
+        report_latencies(self.stdout, label, latencies)
+        self.stdout.write(f'  deliveries: {deliveries} total, {deliveries / len(groups_per_event):.0f} per event')
+        await layer.flush()
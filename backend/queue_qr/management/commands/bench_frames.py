@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from queue_qr import frames
+
+
+class Command(BaseCommand):
+    help = 'Benchmark fanout CPU: JSON encoding per connection vs one pre-encoded frame per audience'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000, help='Connections per audience')
+        parser.add_argument('--events', type=int, default=200, help='Events to fan out')
+
+    def handle(self, *args, **options):
+        connections = options['connections']
+        events = [self.sample_event(i) for i in range(options['events'])]
+
+        for audience in (frames.QUEUE, frames.DISPLAY):
+            # Прежний путь: каждый консьюмер строит словарь и вызывает json.dumps
+            started = time.process_time()
+            for event in events:
+                for _ in range(connections):
+                    frames.encode(audience, event)
+            per_connection = time.process_time() - started
+
+            # Кадр кодируется один раз, консьюмеры только берут готовый текст
+            started = time.process_time()
+            for event in events:
+                frame = frames.frame_event(frames.encode(audience, event))
+                for _ in range(connections):
+                    frame['text']
+            pre_encoded = time.process_time() - started
+
+            self.stdout.write(
+                f'{audience}: per-connection encode {per_connection / len(events) * 1000:.3f}ms CPU '
+                f'per event per {connections} connections, pre-encoded {pre_encoded / len(events) * 1000:.3f}ms '
+                f'({per_connection / max(pre_encoded, 1e-9):.0f}x)'
+            )
+
+    @staticmethod
+    def sample_event(i):
+        return {
+            'type': 'queue.ticket_called',
+            'message': {
+                'queue_type': 'BACHELOR_GRANT',
+                'queue_type_display': 'Бакалавр грант',
+                'ticket_id': 100000 + i,
+                'ticket_number': i % 500 + 1,
+                'full_name': 'Иванов Иван Иванович',
+                'manager_username': 'stol3',
+                'manager_location': 'Стол 3',
+                'audio_url': f'https://queue.iitu.edu.kz/media/announcements/{i:064x}.mp3',
+            }
+        }
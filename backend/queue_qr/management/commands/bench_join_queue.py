@@ -0,0 +1,66 @@
+import threading
+import time
+
+from django.core.management.base import CommandError
+from django.db import connection
+
+from ._bench import BenchCommand, temporary_queue_type
+
+
+class Command(BenchCommand):
+    help = 'Concurrency check for ticket allocation: parallel joins must get unique, contiguous numbers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--joins', type=int, default=2000, help='Total number of joins')
+        parser.add_argument('--threads', type=int, default=16, help='Number of parallel workers')
+
+    def handle(self, *args, **options):
+        joins = options['joins']
+        threads = options['threads']
+
+        with temporary_queue_type(1, joins) as queue_type:
+            numbers = []
+            errors = []
+            lock = threading.Lock()
+
+            def worker(count):
+                try:
+                    for i in range(count):
+                        try:
+                            ticket = queue_type.issue_ticket(f'Bench {i}')
+                        except Exception as e:
+                            with lock:
+                                errors.append(str(e))
+                            continue
+                        with lock:
+                            numbers.append(ticket.number)
+                finally:
+                    # У каждого потока свое соединение с БД
+                    connection.close()
+
+            per_thread, extra = divmod(joins, threads)
+            workers = [
+                threading.Thread(target=worker, args=(per_thread + (1 if i < extra else 0),))
+                for i in range(threads)
+            ]
+
+            started = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'{len(numbers)} joins in {elapsed:.2f}s ({len(numbers) / elapsed:.0f} joins/s), '
+            f'{threads} threads, {len(errors)} errors'
+        )
+
+        if errors:
+            raise CommandError(f'Join failed: {errors[0]}')
+        if len(set(numbers)) != len(numbers):
+            raise CommandError(f'Duplicate ticket numbers: {len(numbers) - len(set(numbers))}')
+        if sorted(numbers) != list(range(1, joins + 1)):
+            raise CommandError('Ticket numbers are not contiguous')
+
+        self.stdout.write(self.style.SUCCESS('Ticket numbers are unique and contiguous'))
@@ -0,0 +1,52 @@
+import random
+import time
+
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from queue_qr import waiting_line
+from queue_qr.models import QueueTicket
+
+from ._bench import BenchCommand, report_latencies, seed_waiting_tickets, temporary_queue_type
+
+
+class Command(BenchCommand):
+    help = 'Time ticket position lookups: COUNT over created_at vs the position endpoint (Fenwick rank)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=5000, help='Waiting tickets of one type')
+        parser.add_argument('--lookups', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with temporary_queue_type(1, options['tickets']) as queue_type:
+            seed_waiting_tickets(queue_type, options['tickets'])
+            waiting_line.reload(queue_type.name)
+            tickets = list(QueueTicket.objects.filter(queue_type=queue_type).order_by('created_at', 'id'))
+            sample = [rng.randrange(len(tickets)) for _ in range(options['lookups'])]
+
+            counts = []
+            for index in sample:
+                ticket = tickets[index]
+                started = time.perf_counter()
+                QueueTicket.objects.filter(
+                    queue_type=queue_type, served=False, created_at__lt=ticket.created_at
+                ).count()
+                counts.append(time.perf_counter() - started)
+
+            client = Client()
+            lookups = []
+            with CaptureQueriesContext(connection) as queries:
+                for index in sample:
+                    started = time.perf_counter()
+                    response = client.get(f'/api/v2/queue/position/{tickets[index].token}/')
+                    lookups.append(time.perf_counter() - started)
+                    if response.status_code != 200 or response.json()['ahead'] != index:
+                        raise CommandError(f'Wrong position for ticket #{index}: {response.content!r}')
+            waiting_line.clear(queue_type.name)
+
+        report_latencies(self.stdout, 'COUNT(created_at < x)', counts)
+        report_latencies(self.stdout, 'GET position/<token>/', lookups)
+        self.stdout.write(f'Endpoint ran {len(queries.captured_queries)} queries for {len(sample)} lookups')
@@ -0,0 +1,52 @@
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from queue_qr.tts import ConcatenativeBackend, GTTSBackend
+
+from ._bench import report_latencies
+
+
+class Command(BaseCommand):
+    help = 'Compare announcement synthesis engines (gTTS only with --gtts, it needs network)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=10_000, help='Offline engine syntheses to time')
+        parser.add_argument('--gtts', type=int, default=0, help='gTTS syntheses to time (network)')
+
+    def handle(self, *args, **options):
+        locations = ['Стол 1', 'Стол 8', 'Кабинет 305']
+        requests = [(random.randint(1, 999), random.choice(locations)) for _ in range(options['samples'])]
+
+        backend = ConcatenativeBackend()
+        if not all(backend.supports(number, location) for number, location in requests[:100]):
+            # Фрагменты не записаны - замеряем склейку на синтетических фрагментах того же размера
+            self.stdout.write(f'No clips in {settings.ANNOUNCEMENT_CLIPS_DIR}, using synthetic 6 KB clips')
+            with tempfile.TemporaryDirectory() as clips_dir:
+                for clip_name in ConcatenativeBackend.required_clips(locations):
+                    with open(os.path.join(clips_dir, f'{clip_name}.mp3'), 'wb') as f:
+                        f.write(os.urandom(6 * 1024))
+                backend = ConcatenativeBackend(clips_dir)
+
+        latencies = []
+        total_bytes = 0
+        for number, location in requests:
+            started = time.perf_counter()
+            audio = backend.synthesize(number, location)
+            latencies.append(time.perf_counter() - started)
+            total_bytes += len(audio)
+        report_latencies(self.stdout, 'concat (offline)', latencies)
+        self.stdout.write(f'  average announcement size: {total_bytes / len(requests) / 1024:.1f} KB')
+
+        if options['gtts']:
+            gtts_backend = GTTSBackend()
+            latencies = []
+            for number, location in requests[:options['gtts']]:
+                started = time.perf_counter()
+                gtts_backend.synthesize(number, location)
+                latencies.append(time.perf_counter() - started)
+            report_latencies(self.stdout, 'gtts (network)', latencies)
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.models import WorkplaceType
+from queue_qr import announcements
+from queue_qr.models import QueueType
+
+
+class Command(BaseCommand):
+    help = 'Pre-render announcement audio for every ticket number and active workplace that serves its queue type'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue-type', action='append', dest='queue_types',
+                            help='Only this queue type (can be repeated)')
+        parser.add_argument('--workers', type=int, default=settings.ANNOUNCEMENT_WORKERS,
+                            help='Parallel synthesis workers')
+        parser.add_argument('--dry-run', action='store_true', help='Only count missing announcements')
+
+    def handle(self, *args, **options):
+        queue_types = QueueType.objects.all()
+        if options['queue_types']:
+            queue_types = queue_types.filter(name__in=options['queue_types'])
+
+        workplaces = list(WorkplaceType.objects.filter(is_active=True))
+
+        combinations = []
+        for queue_type in queue_types:
+            locations = [workplace.name for workplace in workplaces
+                         if workplace.can_serve_queue_type(queue_type.name)]
+            for number in range(queue_type.min_ticket_number, queue_type.max_ticket_number + 1):
+                for location in locations:
+                    combinations.append((number, location))
+
+        missing = [
+            (number, location) for number, location in combinations
+            if announcements.cached_audio(number, location) is None
+        ]
+        self.stdout.write(f'Объявлений: {len(combinations)}, уже в кэше: {len(combinations) - len(missing)}, '
+                          f'нужно синтезировать: {len(missing)}')
+
+        if options['dry_run'] or not missing:
+            return
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(announcements.render, number, location) for number, location in missing]
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'Ошибка синтеза: {e}')
+                if done % 500 == 0:
+                    self.stdout.write(f'  {done}/{len(missing)}')
+
+        stats = announcements.get_cache().stats()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Готово: синтезировано {len(missing) - failed}, ошибок {failed}. '
+                f'Кэш: {stats["files"]} файлов, {stats["bytes"] / 1024 / 1024:.1f} МБ, '
+                f'вытеснено {stats["evictions"]}'
+            )
+        )
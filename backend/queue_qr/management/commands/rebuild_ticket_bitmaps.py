@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from queue_qr.models import QueueType
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the in-use ticket number bitmaps from unserved tickets and seed unset ticket counters'
+
+    def handle(self, *args, **options):
+        for queue_type in QueueType.objects.all():
+            bitmap = queue_type.rebuild_ticket_bitmap()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'{queue_type.get_name_display()}: занято {bitmap.taken_count()} из {bitmap.size} номеров'
+                )
+            )
@@ -0,0 +1,47 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import WorkplaceType
+from queue_qr.tts import ConcatenativeBackend, LANGUAGE
+
+
+class Command(BaseCommand):
+    help = 'Render the audio clips used by the offline concatenative announcement engine (needs gTTS and network)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', action='append', dest='locations', default=[],
+                            help='Extra location name to render besides active workplaces (can be repeated)')
+        parser.add_argument('--force', action='store_true', help='Re-render clips that already exist')
+
+    def handle(self, *args, **options):
+        try:
+            from gtts import gTTS
+        except ImportError:
+            raise CommandError('gTTS is not installed')
+
+        clips_dir = settings.ANNOUNCEMENT_CLIPS_DIR
+        os.makedirs(clips_dir, exist_ok=True)
+
+        locations = list(WorkplaceType.objects.filter(is_active=True).values_list('name', flat=True))
+        locations += options['locations']
+
+        rendered = 0
+        for clip_name, text in ConcatenativeBackend.required_clips(locations).items():
+            path = os.path.join(clips_dir, f'{clip_name}.mp3')
+            if os.path.exists(path) and os.path.getsize(path) and not options['force']:
+                continue
+            # Пишем во временный файл: при обрыве сети не остается пустого фрагмента
+            partial = f'{path}.part'
+            try:
+                gTTS(text, lang=LANGUAGE).save(partial)
+            except Exception as e:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                raise CommandError(f'Не удалось синтезировать фрагмент {clip_name} ("{text}"): {e}')
+            os.replace(partial, path)
+            rendered += 1
+            self.stdout.write(f'  {clip_name}: {text}')
+
+        self.stdout.write(self.style.SUCCESS(f'Фрагментов создано: {rendered} (каталог {clips_dir})'))
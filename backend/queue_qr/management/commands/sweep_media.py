@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from queue_qr import media_gc
+
+
+class Command(BaseCommand):
+    help = 'Delete generated announcement audio older than the TTL or above the total size cap'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=settings.MEDIA_SWEEP_TTL_SECONDS,
+                            help='Delete files unused for this many seconds')
+        parser.add_argument('--max-bytes', type=int, default=settings.MEDIA_SWEEP_MAX_BYTES,
+                            help='Total size cap for generated audio')
+
+    def handle(self, *args, **options):
+        sweeper = media_gc.build_sweeper()
+        sweeper.ttl_seconds = options['ttl']
+        sweeper.max_bytes = options['max_bytes']
+
+        result = sweeper.sweep()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Удалено файлов: {result["deleted_files"]} '
+                f'({result["deleted_bytes"] / 1024 / 1024:.1f} МБ; по TTL: {result["expired"]}, '
+                f'сверх лимита: {result["over_limit"]}). '
+                f'Осталось: {result["remaining_files"]} файлов, '
+                f'{result["remaining_bytes"] / 1024 / 1024:.1f} МБ'
+            )
+        )
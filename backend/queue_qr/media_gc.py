@@ -0,0 +1,149 @@
+"""Сборщик сгенерированного аудио в MEDIA_ROOT.
+
+Раньше файлы удалялись только по запросу фронтенда (delete_audio), и от
+закрытых дисплеев оставались тысячи MP3. Сборщик периодически удаляет
+сгенерированное аудио старше TTL (по времени последнего использования) и
+самые старые файлы сверх лимита общего размера.
+"""
+import fnmatch
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Файлы в корне MEDIA_ROOT, которые создавали прежние версии call_next
+LEGACY_AUDIO_PATTERN = 'ticket_*_*.mp3'
+
+_sweeper = None
+_lock = threading.Lock()
+
+
+class MediaSweeper:
+    def __init__(self, media_root, cache_dir, ttl_seconds, max_bytes, batch_size, batch_pause=0.05):
+        self.media_root = media_root
+        self.cache_path = os.path.join(media_root, cache_dir)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.runs = 0
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self._lock = threading.Lock()
+
+    def _generated_files(self):
+        """(mtime, путь, размер) всех сгенерированных аудио файлов"""
+        files = []
+        for directory, match in ((self.cache_path, '*.mp3'), (self.media_root, LEGACY_AUDIO_PATTERN)):
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and fnmatch.fnmatch(entry.name, match):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        files.append((stat.st_mtime, entry.path, stat.st_size))
+        return files
+
+    def sweep(self):
+        """Один проход сборщика. Возвращает статистику прохода"""
+        with self._lock:
+            now = time.time()
+            files = sorted(self._generated_files())
+
+            expired = [f for f in files if now - f[0] > self.ttl_seconds]
+            kept = [f for f in files if now - f[0] <= self.ttl_seconds]
+
+            # Сверх лимита размера удаляем самые старые из оставшихся
+            total_bytes = sum(size for _, _, size in kept)
+            over_limit = []
+            for item in kept:
+                if total_bytes <= self.max_bytes:
+                    break
+                over_limit.append(item)
+                total_bytes -= item[2]
+
+            to_delete = expired + over_limit
+            deleted_files = 0
+            deleted_bytes = 0
+            for start in range(0, len(to_delete), self.batch_size):
+                for _, path, size in to_delete[start:start + self.batch_size]:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    deleted_files += 1
+                    deleted_bytes += size
+                # Пауза между пачками, чтобы не забивать диск во время работы
+                if start + self.batch_size < len(to_delete):
+                    time.sleep(self.batch_pause)
+
+            self.runs += 1
+            self.deleted_files += deleted_files
+            self.deleted_bytes += deleted_bytes
+
+            result = {
+                'deleted_files': deleted_files,
+                'deleted_bytes': deleted_bytes,
+                'expired': len(expired),
+                'over_limit': len(over_limit),
+                'remaining_files': len(files) - deleted_files,
+                'remaining_bytes': sum(size for _, _, size in files) - deleted_bytes,
+            }
+
+        if deleted_files:
+            logger.info(f"Media sweep: deleted {deleted_files} files, {deleted_bytes} bytes")
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'deleted_files': self.deleted_files,
+                'deleted_bytes': self.deleted_bytes,
+            }
+
+    def run_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Media sweep failed")
+
+
+def build_sweeper():
+    """Сборщик с параметрами из настроек"""
+    return MediaSweeper(
+        settings.MEDIA_ROOT,
+        settings.ANNOUNCEMENT_CACHE_DIR,
+        settings.MEDIA_SWEEP_TTL_SECONDS,
+        settings.MEDIA_SWEEP_MAX_BYTES,
+        settings.MEDIA_SWEEP_BATCH_SIZE
+    )
+
+
+def start():
+    """Запустить фоновый сборщик в этом процессе (повторные вызовы ничего не делают)"""
+    global _sweeper
+    with _lock:
+        if _sweeper is None:
+            _sweeper = build_sweeper()
+            threading.Thread(
+                target=_sweeper.run_forever,
+                args=(settings.MEDIA_SWEEP_INTERVAL_SECONDS,),
+                name='media-sweeper',
+                daemon=True
+            ).start()
+        return _sweeper
+
+
+def stats():
+    """Статистика фонового сборщика этого процесса"""
+    return _sweeper.stats() if _sweeper is not None else None
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.6 on 2026-10-18 13:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.BooleanField(default=True)),
+                ('name', models.CharField(default='API_STATUS', max_length=200)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QueueType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(choices=[('BACHELOR_GRANT', 'Бакалавр грант'), ('BACHELOR_PAID', 'Бакалавр платное'), ('MASTER', 'Магистратура'), ('PHD', 'PhD'), ('PLATONUS', 'Platonus'), ('COLLEGE_GRANT', 'Колледж грант')], max_length=255, unique=True)),
+                ('min_ticket_number', models.IntegerField()),
+                ('max_ticket_number', models.IntegerField()),
+                ('last_ticket_number', models.IntegerField(default=0)),
+                ('ticket_bitmap', models.BinaryField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Тип очереди',
+                'verbose_name_plural': 'Типы очередей',
+            },
+        ),
+        migrations.CreateModel(
+            name='Queue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('BACHELOR', 'Bachelor'), ('MASTER', 'Master'), ('PHD', 'PhD'), ('COLLEGE', 'College')], max_length=10)),
+                ('current_number', models.IntegerField(default=0)),
+                ('currently_serving', models.IntegerField(default=0)),
+                ('manager', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='managed_queues', to=settings.AUTH_USER_MODEL)),
+                ('table', models.ForeignKey(default='1', on_delete=django.db.models.deletion.CASCADE, related_name='queues', to='accounts.table')),
+                ('workplace', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='accounts.managerworkplace')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QueueTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('number', models.PositiveIntegerField()),
+                ('full_name', models.CharField(max_length=255, verbose_name='ФИО')),
+                ('served', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('queue_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tickets', to='queue_qr.queuetype')),
+                ('serving_manager', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='serving_tickets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Талон',
+                'verbose_name_plural': 'Талоны',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(condition=models.Q(('served', False)), fields=['queue_type', 'created_at'], name='ticket_waiting_type_created'), models.Index(condition=models.Q(('served', True)), fields=['queue_type', 'created_at'], name='ticket_served_type_created')],
+            },
+        ),
+    ]
@@ -1,8 +1,28 @@
-from django.db import models
+from datetime import datetime, time, timedelta
+
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from accounts.models import ManagerWorkplace, Table, CustomUser
 import uuid
 
 from backend import settings
+from .bitmap import TicketBitmap
+
+
+class QueueFullError(Exception):
+    """Все номера диапазона типа очереди заняты ожидающими талонами"""
+
+
+def service_day_range(day=None):
+    """Границы рабочего дня [начало, конец) в текущем часовом поясе.
+
+    Фильтр created_at__gte/__lt по этим границам использует индексы,
+    в отличие от created_at__date, который оборачивает колонку в функцию.
+    """
+    day = day or timezone.localdate()
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
 
 
 class QueueType(models.Model):
@@ -29,22 +49,111 @@ class QueueType(models.Model):
     min_ticket_number = models.IntegerField()
     max_ticket_number = models.IntegerField()
 
+    # Последний выданный номер (счетчик для get_next_ticket_number)
+    last_ticket_number = models.IntegerField(default=0)
+    # Битовая карта номеров ожидающих талонов; NULL - перестроить из QueueTicket
+    ticket_bitmap = models.BinaryField(null=True, blank=True, editable=False)
+
     def __str__(self):
         return self.get_name_display()
 
+    def build_ticket_bitmap(self):
+        """Построить битовую карту по необслуженным талонам этого типа"""
+        numbers = QueueTicket.objects.filter(
+            queue_type=self,
+            served=False
+        ).values_list('number', flat=True)
+        return TicketBitmap.from_numbers(self.min_ticket_number, self.max_ticket_number, numbers)
+
+    def newest_ticket_number(self):
+        """Номер последнего созданного талона этого типа или None, если талонов нет"""
+        return QueueTicket.objects.filter(queue_type=self).order_by('-created_at', '-id').values_list(
+            'number', flat=True
+        ).first()
+
+    def _seed_last_ticket_number(self, last_number):
+        """Счетчик еще не заполнен (0 после миграции) - продолжить с последнего созданного талона.
+
+        До появления счетчика номер выдавался после последнего талона; без
+        этого выдача после деплоя началась бы снова с min_ticket_number.
+        """
+        if last_number >= self.min_ticket_number:
+            return last_number
+        newest = self.newest_ticket_number()
+        return last_number if newest is None else newest
+
+    def rebuild_ticket_bitmap(self):
+        """Перестроить и сохранить битовую карту (после ручных правок талонов)"""
+        with transaction.atomic():
+            # Блокировка строки, чтобы параллельная выдача номера не потерялась
+            QueueType.objects.filter(pk=self.pk).update(last_ticket_number=F('last_ticket_number'))
+            last_number = QueueType.objects.filter(pk=self.pk).values_list('last_ticket_number', flat=True).get()
+            bitmap = self.build_ticket_bitmap()
+            QueueType.objects.filter(pk=self.pk).update(
+                last_ticket_number=self._seed_last_ticket_number(last_number),
+                ticket_bitmap=bitmap.to_bytes()
+            )
+        return bitmap
+
+    def _lock_ticket_bitmap(self):
+        """Заблокировать строку типа очереди и прочитать счетчик и битовую карту.
+
+        UPDATE выполняется первым, чтобы сразу взять блокировку строки
+        (в SQLite - блокировку записи): тогда чтение-изменение-запись карты
+        не гоняется с другими воркерами. Вызывать внутри transaction.atomic().
+        """
+        QueueType.objects.filter(pk=self.pk).update(last_ticket_number=F('last_ticket_number'))
+        last_number, data = QueueType.objects.filter(pk=self.pk).values_list(
+            'last_ticket_number', 'ticket_bitmap'
+        ).get()
+
+        expected_length = TicketBitmap.byte_length(self.min_ticket_number, self.max_ticket_number)
+        if data is None or len(data) != expected_length:
+            return self.build_ticket_bitmap(), self._seed_last_ticket_number(last_number)
+        return TicketBitmap(self.min_ticket_number, self.max_ticket_number, bytes(data)), last_number
+
     def get_next_ticket_number(self):
-        """Получить следующий номер талона для этого типа очереди"""
-        last_ticket = QueueTicket.objects.filter(queue_type=self).order_by('-number').first()
-
-        if last_ticket:
-            next_number = last_ticket.number + 1
-            # Если превысили максимум, начинаем сначала
-            if next_number > self.max_ticket_number:
-                return self.min_ticket_number
-            return next_number
-        else:
-            # Первый талон
-            return self.min_ticket_number
+        """Атомарно выдать следующий свободный номер талона для этого типа очереди.
+
+        Номер ищется по битовой карте после последнего выданного (по кругу),
+        номера ожидающих талонов пропускаются. Строка типа очереди остается
+        заблокированной до конца транзакции, поэтому параллельные запросы
+        (в том числе из разных воркеров daphne) не получат одинаковый номер.
+        Вызывать внутри transaction.atomic() вместе с созданием талона.
+
+        call_next не трогает карту (чтобы не блокировать строку типа очереди
+        при каждом вызове), поэтому биты обслуженных талонов остаются занятыми
+        до перехода через конец диапазона - тогда карта перестраивается по
+        ожидающим талонам.
+        """
+        bitmap, last_number = self._lock_ticket_bitmap()
+
+        number = bitmap.next_free(last_number)
+        if number is None or number <= last_number:
+            bitmap = self.build_ticket_bitmap()
+            number = bitmap.next_free(last_number)
+        if number is None:
+            raise QueueFullError(
+                f"Все номера {self.min_ticket_number}-{self.max_ticket_number} "
+                f"очереди '{self.get_name_display()}' заняты"
+            )
+
+        bitmap.take(number)
+        QueueType.objects.filter(pk=self.pk).update(
+            last_ticket_number=number,
+            ticket_bitmap=bitmap.to_bytes()
+        )
+        return number
+
+    def issue_ticket(self, full_name):
+        """Выдать номер и создать талон в одной транзакции"""
+        with transaction.atomic():
+            number = self.get_next_ticket_number()
+            return QueueTicket.objects.create(
+                queue_type=self,
+                number=number,
+                full_name=full_name
+            )
 
     class Meta:
         verbose_name = "Тип очереди"
@@ -102,6 +211,16 @@ class QueueTicket(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Ожидающие/обслуженные талоны типа по порядку создания:
+            # get_queues, current_serving, call_next, profile_view.
+            # Частичные индексы: served=False компилируется в NOT "served",
+            # и SQLite не использует served как среднюю колонку составного индекса
+            models.Index(fields=['queue_type', 'created_at'], condition=Q(served=False),
+                         name='ticket_waiting_type_created'),
+            models.Index(fields=['queue_type', 'created_at'], condition=Q(served=True),
+                         name='ticket_served_type_created'),
+        ]
         verbose_name = "Талон"
         verbose_name_plural = "Талоны"
 
@@ -0,0 +1,68 @@
+"""Реестр типов очередей в памяти процесса.
+
+Типы очередей меняются редко (админка, create_queue_types), а читаются в
+каждом запросе: проверка типа в JoinQueueSerializer, join_queue, call_next,
+профиль менеджера, снимки get_queues. Реестр загружает все типы одним
+запросом и отдает их без БД, пока не изменится версия реестра в кэше
+Django: ее увеличивает сохранение или удаление QueueType (queue_qr.signals),
+и остальные процессы перечитывают реестр при следующем обращении.
+
+Отдаваемые экземпляры QueueType общие для потоков процесса - их нельзя
+изменять. Счетчик и битовая карта номеров читаются из БД при выдаче
+талона, поэтому устаревшие значения этих полей в реестре не мешают.
+"""
+import threading
+
+from django.core.cache import cache
+
+VERSION_KEY = 'queue_types_version'
+
+_lock = threading.Lock()
+_by_name = None
+_version = None
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def _types():
+    global _by_name, _version
+    version = _current_version()
+    with _lock:
+        if _by_name is None or version != _version:
+            from .models import QueueType
+
+            _by_name = {queue_type.name: queue_type for queue_type in QueueType.objects.order_by('id')}
+            _version = version
+        return _by_name
+
+
+def get(name):
+    """Тип очереди по имени или None"""
+    return _types().get(name)
+
+
+def exists(name):
+    return name in _types()
+
+
+def all():
+    """Все типы очередей в порядке создания"""
+    return list(_types().values())
+
+
+def invalidate():
+    """Типы очередей изменились (вызывать после коммита) - перечитать во всех процессах"""
+    global _by_name
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        cache.incr(VERSION_KEY)
+    with _lock:
+        _by_name = None
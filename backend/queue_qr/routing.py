@@ -16,4 +16,7 @@ websocket_urlpatterns = [
 
     # WebSocket для конкретного дисплея очереди
     re_path(r'ws/displays/(?P<queue_type>\w+)/$', consumers.DisplayConsumer.as_asgi()),
+
+    # Личный канал талона (позиция, ETA, вызов)
+    re_path(r'ws/tickets/(?P<token>[0-9a-fA-F-]+)/$', consumers.TicketConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from . import registry
 from .models import Queue, QueueTicket, QueueType
 
 
@@ -34,8 +35,8 @@ class JoinQueueSerializer(serializers.Serializer):
         return value.strip()
 
     def validate_type(self, value):
-        """Проверяем, что тип очереди существует в базе"""
-        if not QueueType.objects.filter(name=value).exists():
+        """Проверяем, что тип очереди существует (реестр типов, без запроса к БД)"""
+        if not registry.exists(value):
             raise serializers.ValidationError(f"Тип очереди '{value}' не найден")
         return value
 
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import registry
+from .models import QueueType
+
+
+@receiver(post_save, sender=QueueType)
+@receiver(post_delete, sender=QueueType)
+def queue_type_changed(sender, **kwargs):
+    # Другие процессы перечитают реестр только после коммита
+    transaction.on_commit(registry.invalidate)
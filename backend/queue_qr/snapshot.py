@@ -0,0 +1,129 @@
+"""Версионированные снимки состояния очередей.
+
+Любое изменение очередей (join_queue, call_next, reset_queue, правки в
+админке) увеличивает общую версию в кэше Django (Redis в docker).
+get_queues и current_serving отдают снимок, собранный для текущей версии:
+он хранится в памяти процесса и в кэше, поэтому между изменениями опросы
+дисплеев и телефонов не ходят в БД. Ключ снимка (с днем) и версия
+служат ETag для условных GET-запросов.
+
+Каждое увеличение версии публикуется в группу "queues" событием
+queue.state_delta: номер версии служит порядковым номером, а операции
+описывают изменение снимка get_queues (см. QueueConsumer).
+
+Рядом с версией в кэше записывается, какие типы очередей она изменила:
+другие процессы перечитывают из БД только эти очереди (waiting_line).
+"""
+import threading
+
+from django.core.cache import cache
+
+from . import fanout
+
+VERSION_KEY = 'queue_state_version'
+SNAPSHOT_KEY = 'queue_snapshot:{}'
+CHANGES_KEY = 'queue_state_changes:{}'
+CHANGES_TTL = 60 * 60
+# Отставание больше этого числа версий догоняется полной перезагрузкой
+CHANGES_MAX_GAP = 100
+
+_lock = threading.Lock()
+_local = {}
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump(*ops, queue_types=None):
+    """Состояние очередей изменилось (вызывать после коммита).
+
+    ops - операции для потока состояния; без них клиенты получат операцию
+    resync и перечитают снимок целиком. queue_types - измененные типы
+    очередей, по умолчанию берутся из ops. Возвращает новую версию.
+    """
+    if queue_types is None:
+        queue_types = [op.get('queue_type') for op in ops]
+    version = advance(*queue_types)
+    publish(version, ops)
+    return version
+
+
+def advance(*queue_types):
+    """Увеличить версию без публикации (публикует вызывающий, см. publish/apublish).
+
+    queue_types - типы очередей, ожидающие талоны которых изменились; без
+    них другие процессы перечитают все очереди.
+    """
+    from . import waiting_line
+
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.incr(VERSION_KEY)
+
+    if queue_types and None not in queue_types:
+        cache.set(CHANGES_KEY.format(version), sorted(set(queue_types)), timeout=CHANGES_TTL)
+    waiting_line.note_version(version)
+    return version
+
+
+def changed_queue_types(since, until):
+    """Типы очередей, измененные версиями (since, until], или None, если это неизвестно.
+
+    None - записи о части версий нет (изменение без типов, истек срок,
+    кэш очищен) или отставание слишком большое: нужна полная перезагрузка.
+    """
+    if since is None or not 0 < until - since <= CHANGES_MAX_GAP:
+        return None
+    keys = [CHANGES_KEY.format(version) for version in range(since + 1, until + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return None
+    return {queue_type for queue_types in changes.values() for queue_type in queue_types}
+
+
+def _delta_messages(version, ops):
+    # Поток состояния - часть общей темы: у тем типов свои номера не ведутся
+    return [(fanout.ALL_GROUP, {
+        "type": "queue.state_delta",
+        "seq": version,
+        "ops": list(ops) or [{'op': 'resync'}]
+    })]
+
+
+def publish(version, ops):
+    """Отправить подписчикам потока состояния изменение с порядковым номером version"""
+    fanout.send_many(_delta_messages(version, ops))
+
+
+async def apublish(version, ops):
+    await fanout.asend_many(_delta_messages(version, ops))
+
+
+def get_snapshot(kind, build):
+    """Снимок kind для текущей версии: из памяти, из кэша или собранный build()"""
+    version = get_version()
+
+    with _lock:
+        memo = _local.get(kind)
+    if memo is not None and memo[0] == version:
+        return version, memo[1]
+
+    key = SNAPSHOT_KEY.format(kind)
+    cached = cache.get(key)
+    if cached is not None and cached['version'] == version:
+        payload = cached['payload']
+    else:
+        # Если версия изменится во время сборки, следующий запрос просто соберет снимок заново
+        payload = build()
+        cache.set(key, {'version': version, 'payload': payload}, timeout=None)
+
+    with _lock:
+        _local[kind] = (version, payload)
+    return version, payload
@@ -1,3 +1,1547 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.admin.sites import AdminSite
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import (
+    AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts import audit
+from accounts.models import (
+    CustomUser, DailyTicketReport, HourlyQueueStats, ManagerActionLog, ManagerWorkplace, WorkplaceType,
+)
+
+from . import announcements, eta, fanout, media_gc, registry, snapshot, ticket_counts, waiting_line
+from .admin import QueueTicketAdmin, QueueTypeAdmin
+from .announcements import AudioCache
+from .bitmap import TicketBitmap
+from .models import QueueFullError, QueueTicket, QueueType, service_day_range
+from .routing import websocket_urlpatterns
+from .serializers import JoinQueueSerializer
+from .tts import ConcatenativeBackend, TTSBackend, TTSError
+from .views import (
+    claim_next_ticket, new_ticket_event, serve_next_ticket, ticket_called_event, ticket_positions_event,
+)
+from .waiting_line import WaitingLine
+
+# Управление транзакцией, а не запросы к данным
+TRANSACTION_SQL = re.compile(r'^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.I)
+
+
+class SilentTTSBackend(TTSBackend):
+    """Мгновенный движок без звука: тесты не зависят от gTTS и клипов"""
+
+    name = 'test-silent'
+    instant = True
+
+    def synthesize(self, ticket_number, location):
+        return b''
+
+
+class SlowTTSBackend(TTSBackend):
+    """Сетевой движок (как gTTS): синтез ждет release и запоминает, в каком потоке шел"""
+
+    name = 'test-slow'
+    calls = []
+    release = threading.Event()
+
+    def synthesize(self, ticket_number, location):
+        self.calls.append((ticket_number, threading.current_thread().name))
+        self.release.wait(5)
+        return b'audio'
+
+
+QUEUE_TEST_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'queue-tests'}},
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    'TICKET_COUNT_BROADCAST_WINDOW': 0,
+    # Журнал пишется сразу: фоновый поток не видит данных незакоммиченной транзакции теста
+    'AUDIT_LOG_MAX_BUFFER': 0,
+    'ANNOUNCEMENT_TTS_BACKENDS': ['queue_qr.tests.SilentTTSBackend'],
+    'ETA_CAPACITY_TTL': 0,
+}
+
+
+class QueueStateMixin:
+    """Тесты, которые проходят через состояние очередей в памяти процесса.
+
+    Перед каждым тестом сбрасываются кэш (версии снимков), снимки в памяти,
+    реестр типов, очереди в памяти, журнал действий и кэш объявлений: откат
+    транзакции теста их не затрагивает.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        cache.clear()
+        self.reset_process_state()
+        self.addCleanup(self.reset_process_state)
+
+    @staticmethod
+    def reset_process_state():
+        registry.invalidate()
+        with snapshot._lock:
+            snapshot._local.clear()
+        with waiting_line._lock:
+            waiting_line._lines.clear()
+            waiting_line._loaded = False
+        audit._writer = None
+        eta._capacity = None
+        announcements._cache = None
+        announcements._backends = None
+
+    def create_queue_type(self, name=QueueType.BACHELOR_GRANT, min_ticket_number=1, max_ticket_number=999):
+        queue_type = QueueType.objects.create(
+            name=name, min_ticket_number=min_ticket_number, max_ticket_number=max_ticket_number
+        )
+        # В тесте on_commit не срабатывает - сбрасываем реестр сами
+        registry.invalidate()
+        return queue_type
+
+    def create_manager(self, *queue_type_names, username='manager'):
+        return CustomUser.objects.create(
+            username=username, role=CustomUser.MANAGER, queue_permissions=list(queue_type_names)
+        )
+
+    def seed_waiting(self, queue_type, count):
+        tickets = [queue_type.issue_ticket(f'Waiting {i}') for i in range(count)]
+        waiting_line.reload(queue_type.name)
+        return tickets
+
+
+@override_settings(**QUEUE_TEST_SETTINGS)
+class QueueStateTestCase(QueueStateMixin, TestCase):
+    pass
+
+
+def make_entry(ticket_id, created_at):
+    return {
+        'id': ticket_id,
+        'number': ticket_id,
+        'full_name': f'Ticket {ticket_id}',
+        'token': str(uuid.uuid4()),
+        'created_at': created_at,
+    }
+
+
+class WaitingLineTests(SimpleTestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def entry(self, ticket_id, seconds=None):
+        return make_entry(ticket_id, self.now + timedelta(seconds=ticket_id if seconds is None else seconds))
+
+    def ids(self, line):
+        return [entry['id'] for entry in line.tickets()]
+
+    def test_late_append_keeps_creation_order(self):
+        line = WaitingLine()
+        for ticket_id in (1, 2, 4, 5):
+            line.append(self.entry(ticket_id))
+        # Талон 3 закоммичен раньше 4 и 5, но добавлен после них
+        line.append(self.entry(3))
+
+        self.assertEqual(self.ids(line), [1, 2, 3, 4, 5])
+        self.assertEqual([line.index(ticket_id) for ticket_id in (1, 2, 3, 4, 5)], [0, 1, 2, 3, 4])
+        self.assertEqual([line.pop_head()['id'] for _ in range(5)], [1, 2, 3, 4, 5])
+
+    def test_equal_created_at_orders_by_id(self):
+        line = WaitingLine()
+        line.append(self.entry(2, seconds=0))
+        line.append(self.entry(1, seconds=0))
+        self.assertEqual(self.ids(line), [1, 2])
+
+    def test_positions_after_head_calls_and_returns(self):
+        line = WaitingLine()
+        for ticket_id in range(1, 201):
+            line.append(self.entry(ticket_id))
+        for _ in range(50):
+            line.pop_head()
+        line.remove(100)
+        line.push_front(self.entry(50))
+
+        expected = [50] + [ticket_id for ticket_id in range(51, 201) if ticket_id != 100]
+        self.assertEqual(self.ids(line), expected)
+        self.assertEqual([line.index(ticket_id) for ticket_id in expected], list(range(len(expected))))
+        self.assertEqual(line.by_token(line.head()['token'])['id'], 50)
+
+
+@override_settings(**QUEUE_TEST_SETTINGS)
+class WaitingLineAccessorTests(SimpleTestCase):
+    QUEUE = 'TEST_LINE'
+
+    def setUp(self):
+        self._saved = (waiting_line._loaded, waiting_line._version, dict(waiting_line._lines))
+        waiting_line._loaded = True
+        waiting_line._version = waiting_line.snapshot.get_version()
+        waiting_line._lines.clear()
+
+    def tearDown(self):
+        waiting_line._loaded, waiting_line._version, lines = self._saved
+        waiting_line._lines.clear()
+        waiting_line._lines.update(lines)
+
+    def test_accessors_return_copies(self):
+        now = timezone.now()
+        with waiting_line._lock:
+            line = waiting_line._get_line(self.QUEUE)
+            for ticket_id in range(1, 4):
+                line.append(make_entry(ticket_id, now + timedelta(seconds=ticket_id)))
+
+        first = waiting_line.tickets(self.QUEUE, limit=2)
+        first[0]['number'] = 999
+        first.append({'id': 0})
+
+        self.assertEqual(waiting_line.count(self.QUEUE), 3)
+        self.assertEqual(waiting_line.head(self.QUEUE)['number'], 1)
+        self.assertEqual([entry['id'] for entry in waiting_line.tickets(self.QUEUE)], [1, 2, 3])
+
+    def test_reads_during_concurrent_calls(self):
+        now = timezone.now()
+        with waiting_line._lock:
+            line = waiting_line._get_line(self.QUEUE)
+            for ticket_id in range(1, 5001):
+                line.append(make_entry(ticket_id, now + timedelta(seconds=ticket_id)))
+
+        errors = []
+
+        def reader():
+            try:
+                while waiting_line.count(self.QUEUE):
+                    waiting_line.tickets(self.QUEUE, limit=5)
+                    waiting_line.tickets(self.QUEUE)
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        while waiting_line.take_head(self.QUEUE) is not None:
+            pass
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+
+class WaitingLineSyncTests(QueueStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.master = self.create_queue_type(QueueType.MASTER)
+        self.phd = self.create_queue_type(QueueType.PHD)
+        self.seed_waiting(self.master, 2)
+        self.seed_waiting(self.phd, 2)
+        waiting_line.load()
+
+    def other_process_advance(self, *queue_types):
+        """Версию увеличил другой процесс: своя версия этого процесса не обновляется"""
+        with mock.patch.object(waiting_line, 'note_version'):
+            return snapshot.advance(*queue_types)
+
+    def other_process_join(self, queue_type):
+        queue_type.issue_ticket('Other process')
+        self.other_process_advance(queue_type.name)
+
+    def test_reloads_only_changed_line(self):
+        self.other_process_join(self.master)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(waiting_line.count(QueueType.MASTER), 3)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"queue_qr_queuetype"."name" = ', queries[0]['sql'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(waiting_line.count(QueueType.PHD), 2)
+            self.assertEqual(waiting_line.count(QueueType.MASTER), 3)
+
+    def test_several_versions_reload_each_changed_line_once(self):
+        self.other_process_join(self.master)
+        self.other_process_join(self.master)
+        self.other_process_join(self.phd)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(waiting_line.count(QueueType.MASTER), 4)
+        self.assertEqual(waiting_line.count(QueueType.PHD), 3)
+
+    def test_unknown_change_reloads_everything(self):
+        self.other_process_join(self.master)
+        # Изменение без типов очередей (например, правка типа в админке)
+        self.other_process_advance()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(waiting_line.count(QueueType.MASTER), 3)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"queue_qr_queuetype"."name" = ', queries[0]['sql'])
+
+    def test_expired_change_record_reloads_everything(self):
+        version = self.other_process_advance(QueueType.PHD)
+        cache.delete(snapshot.CHANGES_KEY.format(version))
+        QueueTicket.objects.filter(queue_type=self.master).update(served=True)
+
+        self.assertEqual(waiting_line.count(QueueType.MASTER), 0)
+
+    def test_own_changes_need_no_reload(self):
+        self.master.issue_ticket('This process')
+        waiting_line.reload(QueueType.MASTER)
+        snapshot.advance(QueueType.MASTER)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(waiting_line.count(QueueType.MASTER), 3)
+
+
+class QueueTypeAdminTests(QueueStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue_type = QueueType.objects.create(name=QueueType.MASTER, min_ticket_number=1, max_ticket_number=10)
+        self.model_admin = QueueTypeAdmin(QueueType, AdminSite())
+        self.request = RequestFactory().post('/admin/')
+        self.request.user = CustomUser.objects.create(username='admin', is_staff=True, is_superuser=True)
+
+    def save_from_form(self, instance, **changes):
+        form_class = self.model_admin.get_form(self.request, instance, change=True)
+        data = {'name': instance.name, 'min_ticket_number': instance.min_ticket_number,
+                'max_ticket_number': instance.max_ticket_number, **changes}
+        form = form_class(data=data, instance=instance)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.model_admin.save_model(self.request, form.save(commit=False), form, change=True)
+
+    def test_counter_is_read_only(self):
+        form_class = self.model_admin.get_form(self.request, self.queue_type, change=True)
+        self.assertNotIn('last_ticket_number', form_class.base_fields)
+
+    def test_stale_form_keeps_counter_and_bitmap(self):
+        self.queue_type.issue_ticket('First')
+        # Страница админки открыта до выдачи второго и третьего талонов
+        stale = QueueType.objects.get(pk=self.queue_type.pk)
+        self.queue_type.issue_ticket('Second')
+        self.queue_type.issue_ticket('Third')
+
+        self.save_from_form(stale)
+
+        fresh = QueueType.objects.get(pk=self.queue_type.pk)
+        self.assertEqual(fresh.last_ticket_number, 3)
+        bitmap = TicketBitmap(1, 10, bytes(fresh.ticket_bitmap))
+        self.assertEqual(bitmap.next_free(0), 4)
+        self.assertEqual(self.queue_type.issue_ticket('Fourth').number, 4)
+
+    def test_range_change_rebuilds_bitmap(self):
+        self.queue_type.issue_ticket('First')
+        self.queue_type.issue_ticket('Second')
+
+        self.save_from_form(QueueType.objects.get(pk=self.queue_type.pk), max_ticket_number=20)
+
+        fresh = QueueType.objects.get(pk=self.queue_type.pk)
+        self.assertEqual(fresh.max_ticket_number, 20)
+        self.assertEqual(fresh.last_ticket_number, 2)
+        self.assertEqual(len(bytes(fresh.ticket_bitmap)), TicketBitmap.byte_length(1, 20))
+
+
+class TicketNumberingTests(QueueStateTestCase):
+    def test_numbers_are_unique_and_contiguous(self):
+        queue_type = self.create_queue_type(min_ticket_number=100, max_ticket_number=999)
+        numbers = [queue_type.issue_ticket(f'Ticket {i}').number for i in range(50)]
+
+        self.assertEqual(numbers, list(range(100, 150)))
+        fresh = QueueType.objects.get(pk=queue_type.pk)
+        self.assertEqual(fresh.last_ticket_number, 149)
+
+    def test_counter_survives_stale_instances(self):
+        queue_type = self.create_queue_type()
+        stale = QueueType.objects.get(pk=queue_type.pk)
+        queue_type.issue_ticket('First')
+        queue_type.issue_ticket('Second')
+
+        # Номер берется из строки в БД, а не из устаревшего экземпляра
+        self.assertEqual(stale.issue_ticket('Third').number, 3)
+
+    def test_missing_bitmap_is_rebuilt_from_waiting_tickets(self):
+        queue_type = self.create_queue_type(max_ticket_number=5)
+        for i in range(3):
+            queue_type.issue_ticket(f'Ticket {i}')
+        QueueType.objects.filter(pk=queue_type.pk).update(ticket_bitmap=None, last_ticket_number=0)
+
+        self.assertEqual(queue_type.issue_ticket('Next').number, 4)
+
+    def create_legacy_tickets(self, queue_type, numbers):
+        """Талоны, выданные до появления счетчика: счетчик 0, карты нет"""
+        for number in numbers:
+            QueueTicket.objects.create(queue_type=queue_type, number=number, full_name=f'Legacy {number}', served=True)
+        QueueType.objects.filter(pk=queue_type.pk).update(last_ticket_number=0, ticket_bitmap=None)
+
+    def test_counter_continues_after_existing_tickets(self):
+        queue_type = self.create_queue_type(min_ticket_number=100, max_ticket_number=199)
+        self.create_legacy_tickets(queue_type, [100, 101, 102])
+
+        numbers = [queue_type.issue_ticket(f'Ticket {i}').number for i in range(2)]
+
+        self.assertEqual(numbers, [103, 104])
+
+    def test_rebuild_command_seeds_counter_from_newest_ticket(self):
+        queue_type = self.create_queue_type(min_ticket_number=1, max_ticket_number=9)
+        # Нумерация уже перешла через конец диапазона: последний талон - 2, а не 9
+        self.create_legacy_tickets(queue_type, [8, 9, 1, 2])
+
+        call_command('rebuild_ticket_bitmaps', stdout=StringIO())
+
+        self.assertEqual(QueueType.objects.get(pk=queue_type.pk).last_ticket_number, 2)
+        self.assertEqual(queue_type.issue_ticket('Next').number, 3)
+
+    def test_rebuild_keeps_counter_that_is_set(self):
+        queue_type = self.create_queue_type()
+        for i in range(3):
+            queue_type.issue_ticket(f'Ticket {i}')
+        QueueTicket.objects.filter(number=3).delete()
+
+        queue_type.rebuild_ticket_bitmap()
+
+        self.assertEqual(QueueType.objects.get(pk=queue_type.pk).last_ticket_number, 3)
+
+
+class TicketBitmapTests(SimpleTestCase):
+    def test_next_free_wraps_and_skips_taken(self):
+        bitmap = TicketBitmap.from_numbers(1, 5, [1, 2, 5])
+        self.assertEqual(bitmap.next_free(2), 3)
+        bitmap.take(3)
+        bitmap.take(4)
+        self.assertIsNone(bitmap.next_free(4))
+
+    def test_round_trip_through_bytes(self):
+        bitmap = TicketBitmap.from_numbers(100, 199, [100, 150, 199])
+        restored = TicketBitmap(100, 199, bitmap.to_bytes())
+        self.assertEqual(restored.next_free(99), 101)
+        self.assertEqual(restored.next_free(149), 151)
+
+
+class TicketWrapAroundTests(QueueStateTestCase):
+    def test_wrap_skips_numbers_still_waiting(self):
+        queue_type = self.create_queue_type(max_ticket_number=5)
+        tickets = [queue_type.issue_ticket(f'Ticket {i}') for i in range(5)]
+        # Обслужены 1 и 3, талоны 2, 4 и 5 еще ждут
+        QueueTicket.objects.filter(pk__in=[tickets[0].pk, tickets[2].pk]).update(served=True)
+
+        numbers = [queue_type.issue_ticket(f'Wrapped {i}').number for i in range(2)]
+
+        self.assertEqual(numbers, [1, 3])
+        waiting = QueueTicket.objects.filter(queue_type=queue_type, served=False).values_list('number', flat=True)
+        self.assertEqual(len(waiting), len(set(waiting)))
+
+    def test_full_range_raises(self):
+        queue_type = self.create_queue_type(max_ticket_number=3)
+        for i in range(3):
+            queue_type.issue_ticket(f'Ticket {i}')
+
+        with self.assertRaises(QueueFullError):
+            queue_type.issue_ticket('Overflow')
+        self.assertEqual(QueueTicket.objects.filter(queue_type=queue_type).count(), 3)
+
+    def test_full_range_is_rejected_by_join_queue(self):
+        queue_type = self.create_queue_type(max_ticket_number=1)
+        queue_type.issue_ticket('Only')
+
+        response = self.client.post(
+            '/api/v2/queue/join-queue/', {'type': queue_type.name, 'full_name': 'Overflow'},
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 409)
+
+
+class TicketIndexTests(TestCase):
+    """Горячие запросы к талонам идут по частичным индексам, без сортировки во временном B-дереве"""
+
+    ROWS = 20_000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.queue_types = [
+            QueueType.objects.create(name=name, min_ticket_number=1, max_ticket_number=999)
+            for name, _ in QueueType.QUEUE_TYPE_CHOICES
+        ]
+        manager = CustomUser.objects.create(username='indexes')
+        now = timezone.now()
+        QueueTicket.objects.bulk_create([
+            QueueTicket(
+                queue_type=cls.queue_types[i % len(cls.queue_types)],
+                number=i % 999 + 1,
+                full_name='Index',
+                # ~2% ожидающих, остальные обслужены
+                served=i % 50 != 0,
+                serving_manager=manager if i % 50 else None,
+            )
+            for i in range(cls.ROWS)
+        ], batch_size=5000)
+        # auto_now_add ставит одинаковое время - раскладываем талоны по 30 дням
+        per_day = cls.ROWS // 30
+        first_id = QueueTicket.objects.order_by('id').values_list('id', flat=True).first()
+        for day in range(30):
+            QueueTicket.objects.filter(
+                id__gte=first_id + day * per_day, id__lt=first_id + (day + 1) * per_day
+            ).update(created_at=now - timedelta(days=29 - day))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_waiting_tickets_in_order(self):
+        self.assertUsesIndex(
+            QueueTicket.objects.filter(queue_type=self.queue_types[0], served=False).order_by('created_at', 'id'),
+            'ticket_waiting_type_created',
+        )
+
+    def test_waiting_line_reload_by_type_name(self):
+        self.assertUsesIndex(
+            QueueTicket.objects.filter(
+                served=False, queue_type__name=self.queue_types[0].name
+            ).order_by('created_at', 'id'),
+            'ticket_waiting_type_created',
+        )
+
+    def test_last_served_today(self):
+        day_start, day_end = service_day_range()
+        self.assertUsesIndex(
+            QueueTicket.objects.filter(
+                queue_type=self.queue_types[0], served=True, created_at__gte=day_start, created_at__lt=day_end
+            ).order_by('-created_at', '-id')[:1],
+            'ticket_served_type_created',
+        )
+
+
+class ClaimNextTicketTests(QueueStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue_type = self.create_queue_type()
+        self.manager = self.create_manager(self.queue_type.name)
+        self.tickets = self.seed_waiting(self.queue_type, 3)
+
+    def test_claims_head_once(self):
+        entry = claim_next_ticket(self.queue_type, self.manager)
+
+        self.assertEqual(entry['id'], self.tickets[0].id)
+        ticket = QueueTicket.objects.get(pk=entry['id'])
+        self.assertTrue(ticket.served)
+        self.assertEqual(ticket.serving_manager, self.manager)
+        self.assertEqual(waiting_line.count(self.queue_type.name), 2)
+
+    def test_skips_ticket_claimed_by_another_process(self):
+        # Менеджер из другого процесса уже забрал голову, а очередь в памяти об этом не знает
+        QueueTicket.objects.filter(pk=self.tickets[0].pk).update(served=True)
+
+        entry = claim_next_ticket(self.queue_type, self.manager)
+
+        self.assertEqual(entry['id'], self.tickets[1].id)
+        self.assertIsNone(QueueTicket.objects.get(pk=self.tickets[0].pk).serving_manager)
+
+    def test_empty_queue(self):
+        QueueTicket.objects.filter(queue_type=self.queue_type).update(served=True)
+        self.assertIsNone(claim_next_ticket(self.queue_type, self.manager))
+        self.assertEqual(waiting_line.count(self.queue_type.name), 0)
+
+    def test_failed_claim_returns_ticket_to_head(self):
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                claim_next_ticket(self.queue_type, self.manager)
+
+        self.assertEqual(waiting_line.head(self.queue_type.name)['id'], self.tickets[0].id)
+        self.assertEqual(waiting_line.count(self.queue_type.name), 3)
+
+    def test_call_next_serves_distinct_tickets(self):
+        other = self.create_manager(self.queue_type.name, username='other')
+        numbers = []
+        for manager in (self.manager, other, self.manager):
+            client = APIClient()
+            client.force_authenticate(manager)
+            response = client.post('/api/v2/queue/call-next/', {'type': self.queue_type.name}, format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+            numbers.append(response.json()['ticket_number'])
+
+        self.assertEqual(numbers, [ticket.number for ticket in self.tickets])
+        self.assertFalse(QueueTicket.objects.filter(queue_type=self.queue_type, served=False).exists())
+
+
+@override_settings(**QUEUE_TEST_SETTINGS)
+class ConcurrentClaimTests(QueueStateMixin, TransactionTestCase):
+    """Менеджеры забирают талоны из нескольких потоков: каждый талон обслужен ровно один раз"""
+
+    THREADS = 4
+    TICKETS = 40
+
+    def setUp(self):
+        super().setUp()
+        self.queue_type = self.create_queue_type()
+        self.managers = [self.create_manager(self.queue_type.name, username=f'manager{i}')
+                         for i in range(self.THREADS)]
+        self.tickets = self.seed_waiting(self.queue_type, self.TICKETS)
+
+    @staticmethod
+    def retry_locked(claim):
+        # SQLite тестов держит базу в общей памяти: занятая таблица сразу дает ошибку, а не ожидание
+        while True:
+            try:
+                return claim()
+            except DatabaseError:
+                time.sleep(0.001)
+
+    def run_threads(self, workers):
+        """Запустить workers одновременно; каждый возвращает id забранных им талонов"""
+        start = threading.Barrier(len(workers))
+        results = [None] * len(workers)
+        errors = []
+
+        def run(index, worker):
+            try:
+                start.wait(timeout=5)
+                results[index] = worker()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(i, worker)) for i, worker in enumerate(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        self.assertEqual(errors, [])
+        return results
+
+    def claim_all(self, manager):
+        claimed = []
+        while True:
+            entry = self.retry_locked(lambda: claim_next_ticket(self.queue_type, manager))
+            if entry is None:
+                return claimed
+            claimed.append(entry['id'])
+
+    def claim_as_other_process(self, manager):
+        """Другой процесс со своей очередью в памяти: те же талоны по порядку тем же условным UPDATE"""
+        claimed = []
+        for ticket in self.tickets:
+            if self.retry_locked(lambda: QueueTicket.objects.filter(pk=ticket.pk, served=False).update(
+                    served=True, serving_manager=manager)):
+                claimed.append(ticket.pk)
+        return claimed
+
+    def assert_served_once(self, managers, results):
+        claimed = [ticket_id for result in results for ticket_id in result]
+        self.assertEqual(sorted(claimed), sorted(ticket.pk for ticket in self.tickets))
+        served_by = dict(QueueTicket.objects.filter(served=True).values_list('pk', 'serving_manager_id'))
+        for manager, result in zip(managers, results):
+            self.assertEqual({served_by[ticket_id] for ticket_id in result} - {manager.pk}, set())
+        self.assertEqual(waiting_line.count(self.queue_type.name), 0)
+
+    def test_threads_claim_distinct_tickets(self):
+        results = self.run_threads([lambda manager=manager: self.claim_all(manager) for manager in self.managers])
+        self.assert_served_once(self.managers, results)
+
+    def test_claims_from_two_processes_do_not_overlap(self):
+        in_process, other_process = self.managers[:-1], self.managers[-1]
+        workers = [lambda manager=manager: self.claim_all(manager) for manager in in_process]
+        workers.append(lambda: self.claim_as_other_process(other_process))
+
+        results = self.run_threads(workers)
+
+        self.assert_served_once(self.managers, results)
+
+
+def data_statements(queries):
+    """SQL запросов без управления транзакцией (BEGIN, SAVEPOINT...)"""
+    return [query['sql'] for query in queries.captured_queries if not TRANSACTION_SQL.match(query['sql'])]
+
+
+# Рабочие места перечитываются раз в ETA_CAPACITY_TTL - не в каждом запросе
+@override_settings(ETA_CAPACITY_TTL=3600)
+class CallNextQueryTests(QueueStateTestCase):
+    # Закрепление талона, счетчик отчета за день, почасовая сводка, текущее назначение;
+    # журнал пишется в фоне (accounts.audit)
+    EXPECTED_STATEMENTS = 4
+
+    def test_steady_call_next_statements(self):
+        queue_type = self.create_queue_type()
+        manager = self.create_manager(queue_type.name)
+        tickets = self.seed_waiting(queue_type, 3)
+
+        calls = []
+        with mock.patch('accounts.audit.log_action') as log_action:
+            for _ in tickets:
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertIsNotNone(serve_next_ticket(manager, queue_type, '/media/'))
+                calls.append(data_statements(queries))
+
+        # Первый вызов за день создает строки отчета и сводки, следующие только обновляют
+        for statements in calls[1:]:
+            self.assertEqual(len(statements), self.EXPECTED_STATEMENTS, '\n'.join(statements))
+        self.assertEqual(log_action.call_count, 3)
+
+        report = DailyTicketReport.objects.get(manager=manager)
+        self.assertEqual(report.ticket_count, 3)
+        self.assertEqual(report.queue_type_stats, {queue_type.name: 3})
+        hourly = HourlyQueueStats.summarize(HourlyQueueStats.objects.filter(manager=manager))
+        self.assertEqual(hourly['calls'], 3)
+        self.assertIsNotNone(hourly['avg_wait_seconds'])
+        self.assertEqual(ManagerWorkplace.objects.get(manager=manager).current_ticket_id, tickets[-1].id)
+
+    def test_call_next_is_logged(self):
+        queue_type = self.create_queue_type()
+        manager = self.create_manager(queue_type.name)
+        self.seed_waiting(queue_type, 1)
+
+        serve_next_ticket(manager, queue_type, '/media/')
+
+        log = ManagerActionLog.objects.get(manager=manager)
+        self.assertEqual(log.action_type, ManagerActionLog.TICKET_CALLED)
+        self.assertEqual(log.queue_type, queue_type.name)
+
+
+class SnapshotETagTests(QueueStateTestCase):
+    URLS = ['/api/v2/queue/queues/', '/api/v2/queue/current-serving/']
+
+    def setUp(self):
+        super().setUp()
+        self.queue_type = self.create_queue_type()
+        self.manager = self.create_manager(self.queue_type.name)
+        self.api = APIClient()
+        self.api.force_authenticate(self.manager)
+
+    def get(self, url, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(url, headers=headers)
+
+    def etags(self):
+        return [self.get(url)['ETag'] for url in self.URLS]
+
+    def test_unchanged_state_returns_not_modified(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                etag = self.get(url)['ETag']
+                response = self.get(url, etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+    def test_join_and_call_change_etag(self):
+        before = self.etags()
+        response = self.client.post('/api/v2/queue/join-queue/',
+                                    {'type': self.queue_type.name, 'full_name': 'Студент'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        after_join = self.etags()
+
+        response = self.api.post('/api/v2/queue/call-next/', {'type': self.queue_type.name}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        after_call = self.etags()
+
+        for url, old, joined, called in zip(self.URLS, before, after_join, after_call):
+            with self.subTest(url=url):
+                self.assertEqual(len({old, joined, called}), 3)
+                self.assertEqual(self.get(url, old).status_code, 200)
+                self.assertEqual(self.get(url, called).status_code, 304)
+
+    def test_new_day_changes_etag(self):
+        today = timezone.localdate()
+        etags = self.etags()
+
+        # Версия после полуночи та же, а снимок уже за другой день
+        with mock.patch('django.utils.timezone.localdate', return_value=today + timedelta(days=1)):
+            for url, etag in zip(self.URLS, etags):
+                with self.subTest(url=url):
+                    response = self.get(url, etag)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotEqual(response['ETag'], etag)
+
+
+class AsyncViewTests(QueueStateTestCase):
+    JOIN_URL = '/api/v2/queue/async/join-queue/'
+    CALL_URL = '/api/v2/queue/async/call-next/'
+
+    def setUp(self):
+        super().setUp()
+        self.queue_type = self.create_queue_type(QueueType.MASTER)
+        self.manager = self.create_manager(QueueType.MASTER)
+        self.token = Token.objects.create(user=self.manager)
+        # Представления без CSRF-токена: клиенты - телефоны и пульты менеджеров
+        self.async_client = AsyncClient(enforce_csrf_checks=True)
+
+    async def call(self, authorization=None, queue_type=QueueType.MASTER):
+        headers = {'Authorization': authorization} if authorization else {}
+        return await self.async_client.post(self.CALL_URL, {'type': queue_type},
+                                            content_type='application/json', headers=headers)
+
+    async def test_join_queue(self):
+        response = await self.async_client.post(self.JOIN_URL, {'type': QueueType.MASTER, 'full_name': 'Студент'},
+                                                content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['ticket'], data['queue_type'], data['ahead']), (1, QueueType.MASTER, 0))
+        self.assertTrue(await QueueTicket.objects.filter(token=data['token']).aexists())
+
+    async def test_join_queue_rejects_unknown_type(self):
+        response = await self.async_client.post(self.JOIN_URL, {'type': 'UNKNOWN', 'full_name': 'Студент'},
+                                                content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('type', response.json()['errors'])
+
+    async def test_call_next_requires_token(self):
+        await sync_to_async(self.seed_waiting)(self.queue_type, 1)
+        for authorization in (None, 'Token', 'Token wrong-key', f'Bearer {self.token.key}'):
+            with self.subTest(authorization=authorization):
+                response = await self.call(authorization)
+                self.assertEqual(response.status_code, 401)
+        self.assertEqual(await QueueTicket.objects.filter(served=True).acount(), 0)
+
+    async def test_call_next_rejects_inactive_manager(self):
+        await CustomUser.objects.filter(pk=self.manager.pk).aupdate(is_active=False)
+
+        response = await self.call(f'Token {self.token.key}')
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_call_next_checks_queue_permission(self):
+        response = await self.call(f'Token {self.token.key}', queue_type=QueueType.PHD)
+
+        self.assertEqual(response.status_code, 403)
+
+    async def test_call_next(self):
+        tickets = await sync_to_async(self.seed_waiting)(self.queue_type, 2)
+
+        response = await self.call(f'Token {self.token.key}')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['ticket_id'], data['ticket_number']), (tickets[0].id, tickets[0].number))
+        ticket = await QueueTicket.objects.aget(pk=tickets[0].pk)
+        self.assertTrue(ticket.served)
+        self.assertEqual(ticket.serving_manager_id, self.manager.pk)
+
+    async def test_call_next_on_empty_queue(self):
+        response = await self.call(f'Token {self.token.key}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'message': 'Queue is empty.'})
+
+
+@override_settings(ETA_EWMA_ALPHA=0.5)
+class EtaTests(QueueStateTestCase):
+    QUEUE = QueueType.MASTER
+
+    def setUp(self):
+        super().setUp()
+        shared = WorkplaceType.objects.create(
+            name='Стол 1', workplace_type='TABLE', number=1, allowed_queue_types=[self.QUEUE, QueueType.PHD]
+        )
+        dedicated = WorkplaceType.objects.create(
+            name='Стол 2', workplace_type='TABLE', number=2, allowed_queue_types=[self.QUEUE]
+        )
+        self.first = self.create_manager(username='first')
+        self.first.workplace = shared
+        self.first.save(update_fields=['workplace'])
+        self.second = self.create_manager(username='second')
+        self.second.workplace = dedicated
+        self.second.save(update_fields=['workplace'])
+
+    def test_capacity_weights_shared_workplaces(self):
+        # Полтора рабочих места: общее отдает типу половину
+        self.assertEqual(eta.capacity(self.QUEUE), 1.5)
+        self.assertEqual(eta.capacity(QueueType.PHD), 0.5)
+
+    def test_service_time_and_estimate(self):
+        started = timezone.now()
+        # Вызовы через 100 и 300 секунд: EWMA(0.5) = 0.5 * 300 + 0.5 * 100
+        for offset in (0, 100, 400):
+            eta.record_call(self.first, self.QUEUE, started + timedelta(seconds=offset))
+        # Перерыв длиннее ETA_MAX_SERVICE_SECONDS не считается обслуживанием
+        eta.record_call(self.second, self.QUEUE, started)
+        eta.record_call(self.second, self.QUEUE, started + timedelta(hours=2))
+
+        self.assertEqual(round(eta.service_seconds(self.QUEUE)), 200)
+        # 3 талона (2 впереди и сам талон) * 200 / 1.5 рабочих места
+        self.assertEqual(eta.estimate(self.QUEUE, 2), 400)
+
+    def test_default_service_time_without_samples(self):
+        self.assertEqual(eta.service_seconds(self.QUEUE), settings.ETA_DEFAULT_SERVICE_SECONDS)
+
+
+# Рабочие места перечитываются раз в ETA_CAPACITY_TTL - опрос позиции не ходит в БД
+@override_settings(ETA_CAPACITY_TTL=3600)
+class TicketPositionTests(QueueStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue_type = self.create_queue_type()
+        self.manager = self.create_manager(self.queue_type.name)
+        self.tickets = self.seed_waiting(self.queue_type, 4)
+
+    def get_position(self, token):
+        return self.client.get(f'/api/v2/queue/position/{token}/')
+
+    def test_unknown_ticket(self):
+        response = self.get_position(uuid.uuid4())
+        self.assertEqual(response.status_code, 404)
+
+    def test_served_ticket(self):
+        serve_next_ticket(self.manager, self.queue_type, '/media/')
+
+        response = self.get_position(self.tickets[0].token)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['status'], 'served')
+        self.assertIsNone(data['position'])
+        self.assertIsNone(data['eta_seconds'])
+        self.assertEqual(data['current_serving_number'], self.tickets[0].number)
+
+    def test_waiting_ticket_position_and_eta(self):
+        serve_next_ticket(self.manager, self.queue_type, '/media/')
+
+        data = self.get_position(self.tickets[2].token).json()
+
+        self.assertEqual(data['status'], 'waiting')
+        self.assertEqual((data['position'], data['ahead']), (2, 1))
+        self.assertEqual(data['eta_seconds'], eta.estimate(self.queue_type.name, 1))
+        self.assertEqual(data['current_serving_number'], self.tickets[0].number)
+
+    def test_positions_agree_with_waiting_line(self):
+        serve_next_ticket(self.manager, self.queue_type, '/media/')
+        waiting = self.tickets[1:]
+        # Прогрев: снимок current_serving и рабочие места для ETA
+        self.get_position(waiting[0].token)
+
+        with self.assertNumQueries(0):
+            positions = [self.get_position(ticket.token).json() for ticket in waiting]
+
+        for ticket, data in zip(waiting, positions):
+            ahead = waiting_line.ahead_of(self.queue_type.name, ticket.id)
+            self.assertEqual((data['ahead'], data['position']), (ahead, ahead + 1))
+        self.assertEqual([data['ahead'] for data in positions], [0, 1, 2])
+
+
+async def listen_to_groups(*groups):
+    """Канал в группах channel layer (как у консьюмера) - для проверки рассылки"""
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    for group in groups:
+        await channel_layer.group_add(group, channel)
+    return channel
+
+
+async def received_frames(channel, timeout=0.1):
+    """Кадры, пришедшие в канал (готовые кадры queue_qr.fanout)"""
+    channel_layer = get_channel_layer()
+    result = []
+    while True:
+        try:
+            event = await asyncio.wait_for(channel_layer.receive(channel), timeout)
+        except asyncio.TimeoutError:
+            return result
+        result.append(json.loads(event['text']))
+
+
+@override_settings(TICKET_COUNT_BROADCAST_WINDOW=0.05)
+class TicketCountBroadcastTests(QueueStateTestCase):
+    def test_changes_within_window_are_sent_once(self):
+        master = self.create_queue_type(QueueType.MASTER)
+        phd = self.create_queue_type(QueueType.PHD)
+        self.seed_waiting(master, 1)
+        self.seed_waiting(phd, 2)
+        all_types = async_to_sync(listen_to_groups)(fanout.ALL_GROUP)
+        master_only = async_to_sync(listen_to_groups)(fanout.type_group(QueueType.MASTER))
+
+        for i in range(3):
+            waiting_line.add_ticket(master.issue_ticket(f'Ticket {i}'))
+            ticket_counts.mark_changed(QueueType.MASTER)
+        waiting_line.take_head(QueueType.PHD)
+        ticket_counts.mark_changed(QueueType.PHD)
+
+        timer = ticket_counts._timer
+        self.assertIsNotNone(timer)
+        timer.join()
+
+        self.assertEqual(async_to_sync(received_frames)(all_types), [{
+            'type': 'ticket_count_update',
+            'data': {'ticket_counts': {QueueType.MASTER: 4, QueueType.PHD: 1}},
+        }])
+        self.assertEqual(async_to_sync(received_frames)(master_only), [{
+            'type': 'ticket_count_update',
+            'data': {'ticket_counts': {QueueType.MASTER: 4}},
+        }])
+
+    def test_next_window_starts_after_flush(self):
+        self.create_queue_type(QueueType.MASTER)
+        # Поток таймера не видит транзакцию теста: очереди загружаются здесь
+        waiting_line.load()
+        channel = async_to_sync(listen_to_groups)(fanout.ALL_GROUP)
+
+        for _ in range(2):
+            ticket_counts.mark_changed(QueueType.MASTER)
+            ticket_counts._timer.join()
+
+        self.assertEqual(len(async_to_sync(received_frames)(channel)), 2)
+
+
+@override_settings(**QUEUE_TEST_SETTINGS)
+class TicketChannelTests(QueueStateMixin, TransactionTestCase):
+    """Личный канал талона; потребитель читает БД из своего потока, поэтому данные коммитятся"""
+
+    def test_positions_then_call(self):
+        queue_type = self.create_queue_type(max_ticket_number=10)
+        manager = self.create_manager(queue_type.name)
+        ticket = self.seed_waiting(queue_type, 3)[-1]
+
+        frames = async_to_sync(self.listen)(queue_type, manager, ticket)
+
+        positions = [frame['data']['ahead'] for frame in frames if frame['type'] == 'ticket_position']
+        self.assertEqual(positions, [2, 1, 0])
+        self.assertEqual(frames[-1]['type'], 'ticket_called')
+        self.assertEqual(frames[-1]['data']['ticket_id'], ticket.id)
+
+    def test_unknown_token_is_rejected(self):
+        self.assertFalse(async_to_sync(self.connects)(uuid.uuid4()))
+
+    def test_served_ticket_gets_its_call(self):
+        queue_type = self.create_queue_type()
+        manager = self.create_manager(queue_type.name)
+        ticket = self.seed_waiting(queue_type, 1)[0]
+        serve_next_ticket(manager, queue_type, '/media/')
+
+        frame = async_to_sync(self.first_frame)(ticket.token)
+
+        self.assertEqual(frame['type'], 'ticket_called')
+        self.assertEqual(frame['data']['manager_username'], manager.username)
+
+    def test_admin_changes_reset_positions(self):
+        queue_type = self.create_queue_type(max_ticket_number=10)
+        first, second, _, ticket = self.seed_waiting(queue_type, 4)
+        model_admin = QueueTicketAdmin(QueueTicket, AdminSite())
+        request = RequestFactory().post('/admin/')
+
+        def edits():
+            yield lambda: model_admin.delete_model(request, first)
+            yield lambda: model_admin.mark_as_served(request, QueueTicket.objects.filter(pk=second.pk))
+            yield lambda: model_admin.mark_as_unserved(request, QueueTicket.objects.filter(pk=second.pk))
+
+        with mock.patch.object(model_admin, 'message_user'):
+            frames = async_to_sync(self.listen_to_changes)(ticket, edits())
+
+        self.assertEqual([frame['data']['ahead'] for frame in frames], [3, 2, 1, 2])
+
+    def test_skipped_ticket_resets_positions(self):
+        queue_type = self.create_queue_type(max_ticket_number=10)
+        manager = self.create_manager(queue_type.name)
+        first, _, _, ticket = self.seed_waiting(queue_type, 4)
+
+        def changes():
+            # Первый талон вызван в другом процессе, очередь этого процесса о нем не знает
+            yield lambda: QueueTicket.objects.filter(pk=first.pk).update(served=True)
+            yield lambda: self.call_next(queue_type, manager)
+
+        frames = async_to_sync(self.listen_to_changes)(ticket, changes())
+
+        # Вызван второй талон: впереди остался только третий
+        self.assertEqual([frame['data']['ahead'] for frame in frames], [3, 1])
+
+    async def listen_to_changes(self, ticket, changes):
+        """Кадры канала талона: при подключении и после изменений, на которые он ответил"""
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/tickets/{ticket.token}/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        frames = [await communicator.receive_json_from()]
+        for change in changes:
+            await sync_to_async(change)()
+            if not await communicator.receive_nothing(timeout=0.2):
+                frames.append(await communicator.receive_json_from())
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+        return frames
+
+    async def listen(self, queue_type, manager, ticket):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/tickets/{ticket.token}/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        frames = [await communicator.receive_json_from()]
+        for _ in range(3):
+            await sync_to_async(self.call_next)(queue_type, manager)
+            frames.append(await communicator.receive_json_from())
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+        return frames
+
+    async def connects(self, token):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/tickets/{token}/')
+        connected, _ = await communicator.connect()
+        await communicator.disconnect()
+        return connected
+
+    async def first_frame(self, token):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/tickets/{token}/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        frame = await communicator.receive_json_from()
+        await communicator.disconnect()
+        return frame
+
+    @staticmethod
+    def call_next(queue_type, manager):
+        ticket_message, audio_url, _ = serve_next_ticket(manager, queue_type, '/media/')
+        fanout.send_positions(queue_type.name, ticket_positions_event(ticket_message, audio_url))
+
+
+class QueueTypeRegistryTests(QueueStateTestCase):
+    def test_lookups_are_served_from_memory(self):
+        queue_type = self.create_queue_type()
+        registry.all()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.get(queue_type.name).pk, queue_type.pk)
+            self.assertTrue(registry.exists(queue_type.name))
+            self.assertFalse(registry.exists(QueueType.PHD))
+            self.assertEqual([item.name for item in registry.all()], [queue_type.name])
+
+    def test_save_and_delete_invalidate_after_commit(self):
+        self.assertIsNone(registry.get(QueueType.PHD))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_type = QueueType.objects.create(name=QueueType.PHD, min_ticket_number=1, max_ticket_number=99)
+        self.assertEqual(registry.get(QueueType.PHD).pk, queue_type.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            QueueType.objects.filter(pk=queue_type.pk).update(max_ticket_number=50)
+            queue_type.refresh_from_db()
+            queue_type.save()
+        self.assertEqual(registry.get(QueueType.PHD).max_ticket_number, 50)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_type.delete()
+        self.assertIsNone(registry.get(QueueType.PHD))
+
+    def test_version_bump_from_another_process_reloads(self):
+        queue_type = self.create_queue_type()
+        registry.all()
+        QueueType.objects.filter(pk=queue_type.pk).update(max_ticket_number=500)
+
+        # Другой процесс сохранил тип и увеличил версию в общем кэше
+        cache.incr(registry.VERSION_KEY)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(registry.get(queue_type.name).max_ticket_number, 500)
+
+    def test_serializer_uses_registry(self):
+        self.create_queue_type(QueueType.MASTER)
+        registry.all()
+
+        with self.assertNumQueries(0):
+            valid = JoinQueueSerializer(data={'type': QueueType.MASTER, 'full_name': 'Студент'})
+            self.assertTrue(valid.is_valid(), valid.errors)
+            missing = JoinQueueSerializer(data={'type': QueueType.PHD, 'full_name': 'Студент'})
+            self.assertFalse(missing.is_valid())
+        self.assertIn('type', missing.errors)
+
+
+# Рабочие места перечитываются раз в ETA_CAPACITY_TTL - не в каждом запросе
+@override_settings(ETA_CAPACITY_TTL=3600)
+class JoinQueueQueryTests(QueueStateTestCase):
+    # Блокировка строки типа, чтение счетчика и карты номеров, запись номера,
+    # INSERT талона, почасовая сводка. Тип очереди берется из реестра, без запросов.
+    EXPECTED_STATEMENTS = 5
+
+    def join(self, queue_type):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/v2/queue/join-queue/', {'type': queue_type.name, 'full_name': 'Студент'},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201, response.content)
+        return data_statements(queries)
+
+    def test_steady_join_queue_statements(self):
+        queue_type = self.create_queue_type()
+        # Первый запрос загружает реестр, очереди и рабочие места, создает строку сводки
+        self.join(queue_type)
+
+        for _ in range(3):
+            statements = self.join(queue_type)
+            self.assertEqual(len(statements), self.EXPECTED_STATEMENTS, '\n'.join(statements))
+            # Тип очереди не ищется по имени в БД
+            self.assertFalse(any('"queue_qr_queuetype"."name"' in sql for sql in statements), statements)
+
+
+class MediaSweeperTests(SimpleTestCase):
+    TTL = 3600
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        self.now = time.time()
+
+    def write(self, relative_path, size=10, age=0):
+        path = os.path.join(self.media_root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (self.now - age, self.now - age))
+        return path
+
+    def remaining(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.media_root)
+            for directory, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def sweeper(self, max_bytes=10 ** 6):
+        return media_gc.MediaSweeper(self.media_root, 'announcements', self.TTL, max_bytes, batch_size=2,
+                                     batch_pause=0)
+
+    def test_removes_only_expired_generated_audio(self):
+        old = 2 * self.TTL
+        self.write('announcements/expired.mp3', age=old)
+        self.write('announcements/recent.mp3')
+        self.write('ticket_5_table1.mp3', age=old)
+        self.write('ticket_6_table1.mp3')
+        # Чужие файлы MEDIA_ROOT сборщик не трогает, даже старые
+        self.write('logo.mp3', age=old)
+        self.write('announcements/notes.txt', age=old)
+        self.write('uploads/ticket_7_table1.mp3', age=old)
+
+        result = self.sweeper().sweep()
+
+        self.assertEqual((result['expired'], result['over_limit'], result['deleted_files']), (2, 0, 2))
+        self.assertEqual(self.remaining(), [
+            'announcements/notes.txt', 'announcements/recent.mp3', 'logo.mp3',
+            'ticket_6_table1.mp3', 'uploads/ticket_7_table1.mp3',
+        ])
+
+    def test_clip_used_from_cache_is_kept(self):
+        cache = AudioCache(self.media_root, 'announcements', max_bytes=10 ** 6, max_files=100)
+        used = cache.put('used', b'audio')
+        cache.put('unused', b'audio')
+        for name in ('used', 'unused'):
+            old = self.now - 2 * self.TTL
+            os.utime(os.path.join(self.media_root, 'announcements', f'{name}.mp3'), (old, old))
+
+        # Дисплей снова запросил объявление - файл отмечен использованным
+        self.assertEqual(cache.get('used'), used)
+        self.sweeper().sweep()
+
+        self.assertEqual(self.remaining(), ['announcements/used.mp3'])
+        self.assertIsNone(cache.get('unused'))
+
+    def test_over_limit_removes_oldest_first(self):
+        for age, name in enumerate(['newest', 'middle', 'oldest', 'ancient']):
+            self.write(f'announcements/{name}.mp3', size=10, age=age * 60)
+
+        result = self.sweeper(max_bytes=25).sweep()
+
+        self.assertEqual((result['expired'], result['over_limit']), (0, 2))
+        self.assertEqual(self.remaining(), ['announcements/middle.mp3', 'announcements/newest.mp3'])
+        self.assertEqual((result['remaining_files'], result['remaining_bytes']), (2, 20))
+
+
+@override_settings(**QUEUE_TEST_SETTINGS)
+class AudioCacheTests(QueueStateMixin, SimpleTestCase):
+    def audio_cache(self, max_bytes=10 ** 6, max_files=100):
+        return AudioCache(settings.MEDIA_ROOT, 'announcements', max_bytes, max_files)
+
+    def cached_files(self):
+        return sorted(name[:-4] for name in os.listdir(os.path.join(settings.MEDIA_ROOT, 'announcements')))
+
+    def test_evicts_least_recently_used(self):
+        audio_cache = self.audio_cache(max_files=3)
+        for key in ('first', 'second', 'third'):
+            audio_cache.put(key, b'audio')
+
+        # Попадание переносит файл в конец очереди вытеснения
+        self.assertIsNotNone(audio_cache.get('first'))
+        audio_cache.put('fourth', b'audio')
+        audio_cache.put('fifth', b'audio')
+
+        self.assertEqual(self.cached_files(), ['fifth', 'first', 'fourth'])
+        self.assertIsNone(audio_cache.get('second'))
+        self.assertEqual(audio_cache.stats(), {'files': 3, 'bytes': 15, 'hits': 1, 'misses': 1, 'evictions': 2})
+
+    def test_evicts_over_byte_limit(self):
+        audio_cache = self.audio_cache(max_bytes=25)
+        for key in ('first', 'second', 'third'):
+            audio_cache.put(key, b'x' * 10)
+
+        self.assertEqual(self.cached_files(), ['second', 'third'])
+        self.assertEqual(audio_cache.stats()['bytes'], 20)
+
+    def test_order_restored_from_file_times(self):
+        audio_cache = self.audio_cache()
+        now = time.time()
+        for age, key in enumerate(['newest', 'middle', 'oldest']):
+            audio_cache.put(key, b'audio')
+            path = os.path.join(settings.MEDIA_ROOT, 'announcements', f'{key}.mp3')
+            os.utime(path, (now - age * 60, now - age * 60))
+
+        # Новый процесс восстанавливает порядок по времени изменения файлов
+        restarted = self.audio_cache(max_files=3)
+        restarted.put('fresh', b'audio')
+
+        self.assertEqual(self.cached_files(), ['fresh', 'middle', 'newest'])
+
+    def test_cache_hit_does_not_call_backend(self):
+        with mock.patch.object(SilentTTSBackend, 'synthesize', autospec=True, return_value=b'audio') as synthesize:
+            first = announcements.instant_audio(7, 'Стол 1')
+            again = announcements.instant_audio(7, 'Стол 1')
+            other = announcements.instant_audio(8, 'Стол 1')
+
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+        self.assertEqual([c.args[1:] for c in synthesize.call_args_list], [(7, 'Стол 1'), (8, 'Стол 1')])
+        self.assertEqual(announcements.get_cache().stats()['hits'], 1)
+
+
+@override_settings(ANNOUNCEMENT_TTS_BACKENDS=['queue_qr.tests.SlowTTSBackend'])
+class BackgroundAnnouncementTests(QueueStateTestCase):
+    """Медленный движок не задерживает call_next: аудио приходит дисплеям отдельным событием"""
+
+    def setUp(self):
+        super().setUp()
+        SlowTTSBackend.calls = []
+        SlowTTSBackend.release = threading.Event()
+        # Поток пула не должен остаться ждать после теста
+        self.addCleanup(SlowTTSBackend.release.set)
+        self.queue_type = self.create_queue_type()
+        self.manager = self.create_manager(self.queue_type.name)
+        self.tickets = self.seed_waiting(self.queue_type, 2)
+        self.api = APIClient()
+        self.api.force_authenticate(self.manager)
+
+    def call_next(self):
+        futures = []
+        announce = announcements.announce
+
+        def capture(*args):
+            futures.append(announce(*args))
+            return futures[-1]
+
+        with mock.patch.object(announcements, 'announce', side_effect=capture):
+            response = self.api.post('/api/v2/queue/call-next/', {'type': self.queue_type.name}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), futures
+
+    def test_synthesis_runs_after_response(self):
+        displays = async_to_sync(listen_to_groups)(fanout.display_group(self.queue_type.name))
+
+        # Синтез еще заблокирован, а ответ уже получен
+        data, futures = self.call_next()
+        self.assertIsNone(data['audio_url'])
+        self.assertEqual(len(futures), 1)
+        self.assertFalse(futures[0].done())
+
+        SlowTTSBackend.release.set()
+        self.assertIsNotNone(futures[0].result(timeout=5))
+
+        number, thread_name = SlowTTSBackend.calls[0]
+        self.assertEqual(number, self.tickets[0].number)
+        self.assertTrue(thread_name.startswith('announcements'), thread_name)
+        frames = async_to_sync(received_frames)(displays)
+        self.assertEqual([frame['type'] for frame in frames], ['display_ticket_called', 'display_ticket_audio_ready'])
+        audio_url = frames[1]['data']['audio_url']
+        self.assertTrue(audio_url.endswith('.mp3'), audio_url)
+
+    def test_cached_announcement_is_returned_in_response(self):
+        SlowTTSBackend.release.set()
+        location = self.manager.get_manager_location()
+        audio_name = announcements.render(self.tickets[0].number, location)
+
+        data, futures = self.call_next()
+
+        self.assertTrue(data['audio_url'].endswith(audio_name), data['audio_url'])
+        self.assertEqual(futures, [])
+        self.assertEqual(len(SlowTTSBackend.calls), 1)
+
+
+class ConcatenativeBackendTests(SimpleTestCase):
+    def write_clips(self, clips_dir, clips):
+        for name, data in clips.items():
+            with open(os.path.join(clips_dir, f'{name}.mp3'), 'wb') as f:
+                f.write(data)
+
+    def test_empty_clip_counts_as_missing(self):
+        location = 'Кабинет 101'
+        segments = ConcatenativeBackend().segments(7, location)
+        with tempfile.TemporaryDirectory() as clips_dir:
+            self.write_clips(clips_dir, {segment: b'clip' for segment in segments})
+            self.assertTrue(ConcatenativeBackend(clips_dir).supports(7, location))
+
+            # Прерванный рендер оставил пустой файл
+            self.write_clips(clips_dir, {ConcatenativeBackend.TICKET_CLIP: b''})
+            backend = ConcatenativeBackend(clips_dir)
+            self.assertFalse(backend.supports(7, location))
+            with self.assertRaises(TTSError):
+                backend.synthesize(7, location)
+
+
+@override_settings(**QUEUE_TEST_SETTINGS)
+class QueueTopicTests(QueueStateMixin, TransactionTestCase):
+    """Темы рассылки: подписчик типа получает только свой тип, общая тема - все"""
+
+    def setUp(self):
+        super().setUp()
+        self.master = self.create_queue_type(QueueType.MASTER, max_ticket_number=99)
+        self.phd = self.create_queue_type(QueueType.PHD, min_ticket_number=100, max_ticket_number=199)
+        self.manager = self.create_manager(QueueType.MASTER, QueueType.PHD)
+        self.master_ticket = self.seed_waiting(self.master, 2)[-1]
+        self.phd_ticket = self.seed_waiting(self.phd, 2)[-1]
+
+    def join_and_call(self, queue_type, ticket):
+        fanout.broadcast(queue_type.name, new_ticket_event(ticket))
+        ticket_message, audio_url, _ = serve_next_ticket(self.manager, queue_type, '/media/')
+        fanout.broadcast(queue_type.name, ticket_called_event(ticket_message, audio_url), displays=True)
+        fanout.send_positions(queue_type.name, ticket_positions_event(ticket_message, audio_url))
+
+    async def connect(self, path):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def frame_types(self, communicator):
+        types = []
+        while not await communicator.receive_nothing(timeout=0.1):
+            types.append((await communicator.receive_json_from())['type'])
+        return types
+
+    def test_type_subscribers_get_only_their_type(self):
+        async def scenario():
+            queue_master = await self.connect('/ws/queues/MASTER/')
+            display_master = await self.connect('/ws/displays/MASTER/')
+            ticket_master = await self.connect(f'/ws/tickets/{self.master_ticket.token}/')
+            queue_all = await self.connect('/ws/queues/')
+            display_all = await self.connect('/ws/displays/')
+            connected = [await self.frame_types(communicator)
+                         for communicator in (queue_master, display_master, ticket_master, queue_all, display_all)]
+            self.assertEqual(connected, [[], [], ['ticket_position'], ['state_snapshot'], []])
+
+            await sync_to_async(self.join_and_call)(self.phd, self.phd_ticket)
+            phd = [await self.frame_types(communicator)
+                   for communicator in (queue_master, display_master, ticket_master, queue_all, display_all)]
+
+            await sync_to_async(self.join_and_call)(self.master, self.master_ticket)
+            master = [await self.frame_types(communicator)
+                      for communicator in (queue_master, display_master, ticket_master, queue_all, display_all)]
+
+            for communicator in (queue_master, display_master, ticket_master, queue_all, display_all):
+                await communicator.disconnect()
+            return phd, master
+
+        phd, master = async_to_sync(scenario)()
+
+        # call_next рассылает и счетчик ожидающих своего типа
+        queue_events = ['new_ticket', 'ticket_count_update', 'ticket_called']
+        self.assertEqual(phd, [[], [], [], queue_events, ['display_ticket_called']])
+        self.assertEqual(master, [
+            queue_events,
+            ['display_ticket_called'],
+            ['ticket_position'],
+            queue_events,
+            ['display_ticket_called'],
+        ])
+
+    def test_subscribe_switches_from_all_to_type(self):
+        async def scenario():
+            communicator = await self.connect('/ws/queues/')
+            self.assertEqual(await self.frame_types(communicator), ['state_snapshot'])
+            await communicator.send_json_to({'action': 'subscribe_queue', 'queue_type': QueueType.MASTER})
+            self.assertEqual(await self.frame_types(communicator), ['subscribed'])
+
+            await sync_to_async(fanout.broadcast)(QueueType.PHD, new_ticket_event(self.phd_ticket))
+            phd = await self.frame_types(communicator)
+            await sync_to_async(fanout.broadcast)(QueueType.MASTER, new_ticket_event(self.master_ticket))
+            master = await self.frame_types(communicator)
+            await communicator.disconnect()
+            return phd, master
+
+        self.assertEqual(async_to_sync(scenario)(), ([], ['new_ticket']))
+
+
+@override_settings(**QUEUE_TEST_SETTINGS)
+class QueueStateStreamTests(QueueStateMixin, TransactionTestCase):
+    """Поток состояния общей темы: снимок, затем изменения с номерами подряд"""
+
+    def setUp(self):
+        super().setUp()
+        self.queue_type = self.create_queue_type(QueueType.MASTER)
+
+    def join(self, full_name):
+        response = self.client.post('/api/v2/queue/join-queue/',
+                                    {'type': self.queue_type.name, 'full_name': full_name},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    @staticmethod
+    def waiting_names(snapshot_frame):
+        queues = {item['queue_type_code']: item for item in snapshot_frame['data'] if 'queue_type_code' in item}
+        return [ticket['full_name'] for ticket in queues[QueueType.MASTER]['Зарегестрированные талоны']]
+
+    def test_snapshot_then_deltas_then_resync_after_gap(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/queues/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            frames = []
+
+            async def drain():
+                while not await communicator.receive_nothing(timeout=0.1):
+                    frames.append(await communicator.receive_json_from())
+
+            await drain()
+            await sync_to_async(self.join)('Первый')
+            await drain()
+            # Изменение, сообщение о котором до клиента не дошло
+            await sync_to_async(snapshot.advance)()
+            await sync_to_async(self.join)('Второй')
+            await drain()
+
+            # Клиент видит пропуск номера и просит снимок заново
+            await communicator.send_json_to({'action': 'resync'})
+            await drain()
+            await communicator.disconnect()
+            return frames
+
+        first, delta, after_gap, resync = [
+            frame for frame in async_to_sync(scenario)() if frame['type'] in ('state_snapshot', 'state_delta')
+        ]
+
+        self.assertEqual(first['type'], 'state_snapshot')
+        self.assertEqual(self.waiting_names(first), [])
+        self.assertEqual(delta['type'], 'state_delta')
+        self.assertEqual(delta['seq'], first['seq'] + 1)
+        self.assertEqual([(op['op'], op['full_name']) for op in delta['ops']], [('ticket_added', 'Первый')])
+
+        self.assertEqual(after_gap['seq'], delta['seq'] + 2)
+        self.assertEqual(resync['type'], 'state_snapshot')
+        self.assertEqual(resync['seq'], after_gap['seq'])
+        self.assertEqual(self.waiting_names(resync), ['Первый', 'Второй'])
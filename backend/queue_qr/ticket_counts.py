@@ -0,0 +1,92 @@
+"""Объединенная рассылка количества ожидающих талонов.
+
+join_queue и call_next только отмечают тип очереди как измененный. Первая
+отметка запускает таймер на TICKET_COUNT_BROADCAST_WINDOW секунд; по его
+истечении подписчикам всех типов уходит одно событие со счетчиками всех
+измененных типов, а подписчикам типа - его счетчик. В утренний наплыв
+дисплеи получают несколько событий в секунду вместо сотен.
+
+Счетчики берутся из очередей в памяти (queue_qr.waiting_line), без
+COUNT-запросов к БД.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+from . import fanout, waiting_line
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending = set()
+_timer = None
+_stats = {'changes': 0, 'broadcasts': 0}
+
+
+def mark_changed(queue_type):
+    """Количество талонов типа изменилось - разослать его с ближайшей пачкой"""
+    global _timer
+    window = settings.TICKET_COUNT_BROADCAST_WINDOW
+
+    with _lock:
+        _stats['changes'] += 1
+        _pending.add(queue_type)
+        if window <= 0:
+            start_timer = False
+        elif _timer is None:
+            _timer = threading.Timer(window, _flush_from_timer)
+            _timer.daemon = True
+            start_timer = True
+        else:
+            return
+
+    if start_timer:
+        _timer.start()
+    else:
+        flush()
+
+
+def flush():
+    """Разослать накопленные счетчики"""
+    global _timer
+    with _lock:
+        queue_types = sorted(_pending)
+        _pending.clear()
+        _timer = None
+        if queue_types:
+            _stats['broadcasts'] += 1
+
+    if not queue_types:
+        return
+
+    try:
+        ticket_counts = {queue_type: waiting_line.count(queue_type) for queue_type in queue_types}
+
+        messages = [(fanout.ALL_GROUP, {
+            "type": "queue_ticket_count_update",
+            "message": {"ticket_counts": ticket_counts}
+        })]
+        for queue_type, count in ticket_counts.items():
+            messages.append((fanout.type_group(queue_type), {
+                "type": "queue_ticket_count_update",
+                "message": {"ticket_counts": {queue_type: count}}
+            }))
+        fanout.send_many(messages)
+    except Exception:
+        logger.exception("Error broadcasting ticket counts")
+
+
+def _flush_from_timer():
+    try:
+        flush()
+    finally:
+        # Очередь могла перечитываться из БД в потоке таймера
+        connections.close_all()
+
+
+def stats():
+    """Сколько изменений счетчиков пришло и сколько событий разослано"""
+    with _lock:
+        return dict(_stats)
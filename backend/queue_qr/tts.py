@@ -0,0 +1,159 @@
+"""Движки синтеза голосовых объявлений.
+
+Движок получает номер талона и место обслуживания и возвращает MP3.
+Список движков задается настройкой ANNOUNCEMENT_TTS_BACKENDS: для
+объявления берется первый движок, который может его озвучить.
+"""
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+
+LANGUAGE = 'ru'
+
+
+class TTSError(Exception):
+    """Объявление не удалось синтезировать"""
+
+
+def announcement_text(ticket_number, location):
+    return f"Талон номер {ticket_number}, подойдите к {location}."
+
+
+class TTSBackend:
+    """Базовый класс движка синтеза"""
+
+    # Имя движка, входит в ключ кэша аудио
+    name = None
+    # Синтез без сети и быстрее миллисекунды - можно выполнять прямо в запросе
+    instant = False
+
+    def supports(self, ticket_number, location):
+        return True
+
+    def synthesize(self, ticket_number, location):
+        """Вернуть MP3 объявления в виде bytes"""
+        raise NotImplementedError
+
+
+class GTTSBackend(TTSBackend):
+    """Google Translate TTS (нужны пакет gTTS и доступ к сети)"""
+
+    name = 'gtts'
+
+    def __init__(self):
+        try:
+            from gtts import gTTS
+        except ImportError:
+            gTTS = None
+        self._gtts = gTTS
+
+    def supports(self, ticket_number, location):
+        return self._gtts is not None
+
+    def synthesize(self, ticket_number, location):
+        buffer = BytesIO()
+        self._gtts(announcement_text(ticket_number, location), lang=LANGUAGE).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+def strip_id3(data):
+    """Убрать ID3 теги, чтобы MP3 фрагменты можно было склеить в один поток"""
+    if data[:3] == b'ID3' and len(data) >= 10:
+        # Размер тега - syncsafe integer (по 7 бит в байте), плюс 10 байт заголовка
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        data = data[10 + size + footer:]
+    if len(data) >= 128 and data[-128:-125] == b'TAG':
+        data = data[:-128]
+    return data
+
+
+def number_segments(number):
+    """Разложить номер 1-999 на озвучиваемые части: 347 -> 300, 40, 7; 512 -> 500, 12"""
+    if not 1 <= number <= 999:
+        return None
+
+    segments = []
+    hundreds, rest = divmod(number, 100)
+    if hundreds:
+        segments.append(hundreds * 100)
+    if 10 <= rest <= 19:
+        segments.append(rest)
+    else:
+        tens, units = divmod(rest, 10)
+        if tens:
+            segments.append(tens * 10)
+        if units:
+            segments.append(units)
+    return segments
+
+
+class ConcatenativeBackend(TTSBackend):
+    """Офлайн движок: склеивает заранее записанные фрагменты в памяти.
+
+    Фрагменты ("Талон номер", числа, "подойдите к", названия рабочих мест)
+    создает команда render_announcement_clips и загружаются в память при
+    создании движка, поэтому синтез - это только склейка байтов.
+    """
+
+    name = 'concat'
+    instant = True
+
+    TICKET_CLIP = 'phrase_ticket'
+    GO_TO_CLIP = 'phrase_go_to'
+
+    def __init__(self, clips_dir=None):
+        self.clips_dir = clips_dir or settings.ANNOUNCEMENT_CLIPS_DIR
+        self._clips = {}
+        if os.path.isdir(self.clips_dir):
+            for filename in os.listdir(self.clips_dir):
+                if filename.endswith('.mp3'):
+                    with open(os.path.join(self.clips_dir, filename), 'rb') as f:
+                        data = strip_id3(f.read())
+                    # Пустой файл - след прерванного рендера, такого фрагмента нет
+                    if data:
+                        self._clips[filename[:-4]] = data
+
+    @staticmethod
+    def number_clip(number):
+        return f'number_{number}'
+
+    @staticmethod
+    def location_clip(location):
+        return 'location_' + hashlib.sha1(location.encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def required_clips(cls, locations):
+        """Все фрагменты для номеров 1-999 и указанных мест: имя фрагмента -> текст"""
+        clips = {cls.TICKET_CLIP: 'Талон номер', cls.GO_TO_CLIP: 'подойдите к'}
+        for number in list(range(1, 20)) + list(range(20, 100, 10)) + list(range(100, 1000, 100)):
+            clips[cls.number_clip(number)] = str(number)
+        for location in locations:
+            clips[cls.location_clip(location)] = location
+        return clips
+
+    def segments(self, ticket_number, location):
+        numbers = number_segments(ticket_number)
+        if numbers is None:
+            return None
+        return [
+            self.TICKET_CLIP,
+            *[self.number_clip(number) for number in numbers],
+            self.GO_TO_CLIP,
+            self.location_clip(location),
+        ]
+
+    def supports(self, ticket_number, location):
+        segments = self.segments(ticket_number, location)
+        return segments is not None and all(segment in self._clips for segment in segments)
+
+    def synthesize(self, ticket_number, location):
+        segments = self.segments(ticket_number, location)
+        if segments is None:
+            raise TTSError(f'Номер {ticket_number} нельзя озвучить фрагментами')
+        try:
+            return b''.join(self._clips[segment] for segment in segments)
+        except KeyError as e:
+            raise TTSError(f'Нет фрагмента {e.args[0]} для "{announcement_text(ticket_number, location)}"')
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('join-queue/', views.join_queue, name='join_queue'),
@@ -7,7 +7,11 @@ urlpatterns = [
     path('queue-types/', views.get_queue_types, name='get_queue_types'),  # Новый endpoint
     path('generate-qr/', views.generate_qr, name='generate_qr'),
     path('current-serving/', views.current_serving, name='current_serving'),
+    path('position/<uuid:token>/', views.ticket_position, name='ticket_position'),
     path('reset-queue/', views.reset_queue, name='reset_queue'),
     path('call-next/', views.call_next, name='call_next'),
     path('delete-audio/', views.delete_audio, name='delete_audio'),
+    # Асинхронные версии для daphne (см. queue_qr.async_views)
+    path('async/join-queue/', async_views.join_queue, name='async_join_queue'),
+    path('async/call-next/', async_views.call_next, name='async_call_next'),
 ]
\ No newline at end of file
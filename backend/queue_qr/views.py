@@ -1,22 +1,22 @@
 from datetime import datetime, time
+from django.db import transaction
 from django.db.models import Count, Q
 import json
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
-from .models import Queue, QueueTicket, ApiStatus, QueueType
+from .models import Queue, QueueTicket, ApiStatus, QueueType, QueueFullError, service_day_range
 from .serializers import JoinQueueSerializer, QueueTypeSerializer
+from . import announcements, eta, fanout, registry, snapshot, ticket_counts, waiting_line
 import qrcode
 from django.http import HttpResponse, JsonResponse
 from io import BytesIO
 from rest_framework.authtoken.models import Token
-from accounts.models import ManagerActionLog, DailyTicketReport, Table
-from gtts import gTTS
+from accounts.models import ManagerActionLog, DailyTicketReport, HourlyQueueStats, ManagerWorkplace, Table
+from accounts import audit
 from django.conf import settings
-import os
+from django.utils import timezone
 import logging
 from accounts.models import CustomUser
 
@@ -24,25 +24,18 @@ logger = logging.getLogger(__name__)
 
 
 def broadcast_ticket_count_update(manager_type):
-    try:
-        queue_type = QueueType.objects.get(name=manager_type)
-        tickets_count = QueueTicket.objects.filter(
-            queue_type=queue_type,
-            served=False
-        ).count()
+    # Счетчики рассылаются пачкой раз в TICKET_COUNT_BROADCAST_WINDOW
+    ticket_counts.mark_changed(manager_type)
 
-        ticket_counts = {manager_type: tickets_count}
 
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            "queues",
-            {
-                "type": "queue_ticket_count_update",
-                "message": {"ticket_counts": ticket_counts}
-            }
-        )
-    except QueueType.DoesNotExist:
-        print(f"QueueType {manager_type} not found")
+def snapshot_response(request, kind, build):
+    """Ответ со снимком состояния для текущей версии и поддержкой If-None-Match"""
+    version, payload = snapshot.get_snapshot(kind, build)
+    # kind содержит день: после полуночи версия та же, а снимок уже другой
+    etag = f'"{kind}-{version}"'
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return Response(payload, headers={'ETag': etag})
 
 
 def is_within_restricted_hours():
@@ -83,40 +76,28 @@ def join_queue(request):
 
     print(f"Queue type: {queue_type_name}, Full name: {full_name}")
 
-    try:
-        queue_type = QueueType.objects.get(name=queue_type_name)
-        print(f"Queue type found: {queue_type}")
-    except QueueType.DoesNotExist:
+    queue_type = registry.get(queue_type_name)
+    if queue_type is None:
         print("Queue type not found")
         return Response({"error": "Queue type not found"}, status=status.HTTP_400_BAD_REQUEST)
+    print(f"Queue type found: {queue_type}")
 
     try:
-        # Используем новый метод для получения следующего номера
-        new_ticket_number = queue_type.get_next_ticket_number()
-        print(f"New ticket number: {new_ticket_number}")
-
-        # Создаем талон
-        ticket = QueueTicket.objects.create(
-            queue_type=queue_type,
-            number=new_ticket_number,
-            full_name=full_name
-        )
+        # Номер выдается и талон создается в одной транзакции
+        try:
+            ticket, version = issue_queue_ticket(queue_type, full_name)
+        except QueueFullError as e:
+            print(str(e))
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
         print(f"New ticket created: Ticket {ticket.number} for {ticket.full_name}")
 
         # Отправляем WebSocket уведомления
+        snapshot.publish(version, [ticket_added_op(ticket)])
         broadcast_new_ticket(ticket)
-        broadcast_ticket_count_update(queue_type_name)
 
         print("WebSocket notifications sent")
 
-        return Response({
-            "ticket": ticket.number,
-            "ticket_id": ticket.id,
-            "full_name": ticket.full_name,
-            "queue_type": queue_type_name,
-            "queue_type_display": queue_type.get_name_display(),
-            "token": ticket.token
-        }, status=status.HTTP_201_CREATED)
+        return Response(join_queue_response_data(ticket), status=status.HTTP_201_CREATED)
     except Exception as e:
         print(f"Error creating queue ticket: {str(e)}")
         logger.error(f"Error creating queue ticket: {str(e)}")
@@ -124,77 +105,114 @@ def join_queue(request):
                         status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def issue_queue_ticket(queue_type, full_name):
+    """Выдать талон и обновить состояние очередей (общая часть sync и async join_queue).
+
+    Возвращает талон и новую версию состояния; поток состояния и
+    уведомления публикует вызывающий.
+    """
+    ticket = queue_type.issue_ticket(full_name)
+    HourlyQueueStats.record_arrival(queue_type.name, ticket.created_at)
+    waiting_line.add_ticket(ticket)
+    version = snapshot.advance(queue_type.name)
+    broadcast_ticket_count_update(queue_type.name)
+    return ticket, version
+
+
+def ticket_added_op(ticket):
+    return {
+        'op': 'ticket_added',
+        'queue_type': ticket.queue_type.name,
+        'ticket_number': ticket.number,
+        'full_name': ticket.full_name,
+    }
+
+
+def join_queue_response_data(ticket):
+    ahead = waiting_line.ahead_of(ticket.queue_type.name, ticket.id)
+    return {
+        "ticket": ticket.number,
+        "ticket_id": ticket.id,
+        "full_name": ticket.full_name,
+        "queue_type": ticket.queue_type.name,
+        "queue_type_display": ticket.queue_type.get_name_display(),
+        "token": ticket.token,
+        "ahead": ahead,
+        "eta_seconds": eta.estimate(ticket.queue_type.name, ahead) if ahead is not None else None
+    }
+
+
 def broadcast_new_ticket(ticket):
     """Уведомление о создании нового талона"""
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        "queues",
-        {
-            "type": "new_ticket_created",
-            "message": {
-                "queue_type": ticket.queue_type.name,
-                "queue_type_display": ticket.queue_type.get_name_display(),
-                "ticket_number": ticket.number,
-                "full_name": ticket.full_name,
-                "timestamp": ticket.created_at.isoformat()
-            }
+    fanout.broadcast(ticket.queue_type.name, new_ticket_event(ticket))
+
+
+def new_ticket_event(ticket):
+    return {
+        "type": "new_ticket_created",
+        "message": {
+            "queue_type": ticket.queue_type.name,
+            "queue_type_display": ticket.queue_type.get_name_display(),
+            "ticket_number": ticket.number,
+            "full_name": ticket.full_name,
+            "timestamp": ticket.created_at.isoformat()
         }
-    )
+    }
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_queues(request):
+    return snapshot_response(request, *queues_snapshot_source())
+
+
+def queues_snapshot_source():
+    """Ключ и сборщик снимка get_queues (его же получают подписчики QueueConsumer)"""
     from django.utils import timezone
-    from datetime import date
 
-    queue_types = QueueType.objects.all()
+    # Список обслуживаемых зависит от дня, поэтому день входит в ключ снимка
+    today = timezone.localdate()
+    return f'queues:{today}', lambda: build_queues(today)
+
+
+def build_queues(today):
+    queue_types = registry.all()
     result = []
 
     # Сначала собираем данные по каждому типу очереди
     for queue_type in queue_types:
-        # Получаем необслуженные талоны для этого типа очереди
-        waiting_tickets = QueueTicket.objects.filter(
-            queue_type=queue_type,
-            served=False
-        ).order_by('created_at').values('number', 'full_name')
+        # Необслуженные талоны этого типа берем из очереди в памяти
+        waiting_tickets = waiting_line.tickets(queue_type.name)
 
         ticket_info = [{"number": ticket['number'], "full_name": ticket['full_name']} for ticket in waiting_tickets]
 
+        # Время на талон меняется только при вызовах, а они увеличивают версию снимка;
+        # ETA талона на позиции i = (i + 1) * eta_seconds_per_ticket
+        per_ticket = eta.seconds_per_ticket(queue_type.name)
+
         result.append({
             'Очередь': queue_type.get_name_display(),
             'queue_type_code': queue_type.name,
             'Зарегестрированные талоны': ticket_info,
+            'eta_seconds_per_ticket': round(per_ticket) if per_ticket is not None else None,
         })
 
-    # ИСПРАВЛЕННАЯ ЛОГИКА: Получаем последний обслуженный талон каждого менеджера
-    # ТОЛЬКО за сегодняшний день
-    from django.db.models import Max
-
-    # Получаем сегодняшнюю дату
-    today = timezone.now().date()
-
-    # Получаем ID последнего талона для каждого менеджера ЗА СЕГОДНЯ
-    latest_ticket_subquery = QueueTicket.objects.filter(
-        served=True,
-        serving_manager__isnull=False,
-        created_at__date=today  # Добавляем фильтр по сегодняшней дате
-    ).values('serving_manager').annotate(
-        latest_id=Max('id')
-    ).values_list('latest_id', flat=True)
-
-    # Получаем актуальные последние талоны каждого менеджера за сегодня
-    latest_served_tickets = QueueTicket.objects.filter(
-        id__in=latest_ticket_subquery
-    ).select_related('serving_manager', 'queue_type').order_by('-id')
+    # Последний вызванный талон каждого менеджера ЗА СЕГОДНЯ - из таблицы текущих
+    # назначений (ManagerWorkplace, строка на менеджера), без группировки талонов за день
+    day_start, day_end = service_day_range(today)
+    assignments = ManagerWorkplace.objects.filter(
+        current_ticket__created_at__gte=day_start,
+        current_ticket__created_at__lt=day_end
+    ).select_related('manager', 'current_ticket__queue_type').order_by('-current_ticket_id')
 
     # Формируем список обслуживаемых талонов
     served_tickets_data = []
-    for ticket in latest_served_tickets:
+    for assignment in assignments:
+        ticket = assignment.current_ticket
         served_tickets_data.append({
             'ticket_number': ticket.number,
             'full_name': ticket.full_name,
-            'manager_username': ticket.serving_manager.username,
+            'manager_username': assignment.manager.username,
             'queue_type': ticket.queue_type.name,
             'queue_type_display': ticket.queue_type.get_name_display()
         })
@@ -209,14 +227,14 @@ def get_queues(request):
         print(
             f"  - Менеджер {ticket['manager_username']}: Талон {ticket['ticket_number']} ({ticket['queue_type_display']})")
 
-    return Response(result)
+    return result
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_queue_types(request):
     """Новый endpoint для получения всех типов очередей"""
-    queue_types = QueueType.objects.all()
+    queue_types = registry.all()
     serializer = QueueTypeSerializer(queue_types, many=True)
     return Response(serializer.data)
 
@@ -235,69 +253,151 @@ def generate_qr(request):
 @permission_classes([AllowAny])
 @api_enabled_required
 def current_serving(request):
-    from django.utils import timezone
+    return snapshot_response(request, *current_serving_snapshot_source())
+
+
+def current_serving_snapshot_source():
+    """Ключ и сборщик снимка current_serving (его же читает ticket_position)"""
+    today = timezone.localdate()
+    return f'current_serving:{today}', lambda: build_current_serving(today)
 
-    queue_types = QueueType.objects.all()
+
+def build_current_serving(today):
+    queue_types = registry.all()
     data = {}
 
-    # Получаем сегодняшнюю дату
-    today = timezone.now().date()
+    # Границы сегодняшнего дня
+    day_start, day_end = service_day_range(today)
 
     for queue_type in queue_types:
         # Находим последний обслуженный талон для этого типа ЗА СЕГОДНЯ
         last_served = QueueTicket.objects.filter(
             queue_type=queue_type,
             served=True,
-            created_at__date=today  # Добавляем фильтр по сегодняшней дате
-        ).order_by('-id').first()
+            created_at__gte=day_start,
+            created_at__lt=day_end
+        ).order_by('-created_at', '-id').first()
 
         data[queue_type.name] = {
             'last_served_number': last_served.number if last_served else 0,
             'queue_type_display': queue_type.get_name_display()
         }
-    return Response(data)
+    return data
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def ticket_position(request, token):
+    """Позиция талона среди ожидающих того же типа, сколько талонов впереди и текущий номер.
+
+    Ожидающий талон ищется в очереди в памяти, позиция берется из дерева
+    Фенвика (queue_qr.waiting_line), текущий номер - из снимка
+    current_serving, поэтому частые опросы не ходят в БД. В БД ищется
+    только талон, которого нет среди ожидающих.
+    """
+    _, serving = snapshot.get_snapshot(*current_serving_snapshot_source())
+
+    found = waiting_line.find_token(str(token))
+    if found is not None:
+        queue_type_name, entry, ahead = found
+        return Response({
+            "ticket": entry['number'],
+            "queue_type": queue_type_name,
+            "status": "waiting",
+            "position": ahead + 1,
+            "ahead": ahead,
+            "eta_seconds": eta.estimate(queue_type_name, ahead),
+            "current_serving_number": serving.get(queue_type_name, {}).get('last_served_number', 0),
+        }, status=status.HTTP_200_OK)
+
+    ticket = QueueTicket.objects.select_related('queue_type').filter(token=token).first()
+    if ticket is None:
+        return Response({"error": "Ticket not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        "ticket": ticket.number,
+        "queue_type": ticket.queue_type.name,
+        "status": "served" if ticket.served else "not_waiting",
+        "position": None,
+        "ahead": None,
+        "eta_seconds": None,
+        "current_serving_number": serving.get(ticket.queue_type.name, {}).get('last_served_number', 0),
+    }, status=status.HTTP_200_OK)
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def reset_queue(request):
     queue_type_name = request.data.get('type')
-    try:
-        queue_type = QueueType.objects.get(name=queue_type_name)
+    queue_type = registry.get(queue_type_name)
+    if queue_type is None:
+        return Response({"error": "Queue type not found"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Удаляем все талоны этого типа
-        deleted_count = QueueTicket.objects.filter(queue_type=queue_type).count()
-        QueueTicket.objects.filter(queue_type=queue_type).delete()
+    # Удаляем все талоны этого типа и сбрасываем счетчик номеров
+    deleted_count = QueueTicket.objects.filter(queue_type=queue_type).count()
+    QueueTicket.objects.filter(queue_type=queue_type).delete()
+    QueueType.objects.filter(pk=queue_type.pk).update(last_ticket_number=0, ticket_bitmap=None)
+    waiting_line.clear(queue_type.name)
+    snapshot.bump({'op': 'queue_reset', 'queue_type': queue_type.name})
+    fanout.send_positions(queue_type.name, ticket_positions_reset_event())
 
-        return Response({
-            "message": f"Очередь '{queue_type.get_name_display()}' сброшена. Удалено талонов: {deleted_count}"
-        }, status=status.HTTP_200_OK)
-    except QueueType.DoesNotExist:
-        return Response({"error": "Queue type not found"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        "message": f"Очередь '{queue_type.get_name_display()}' сброшена. Удалено талонов: {deleted_count}"
+    }, status=status.HTTP_200_OK)
 
 
-def increment_ticket_count(manager):
-    report, created = DailyTicketReport.objects.get_or_create(
-        manager=manager, date=datetime.today(), defaults={'ticket_count': 0}
-    )
-    report.ticket_count += 1
-    report.save()
+def increment_ticket_count(manager, queue_type_name):
+    """Учесть вызов в отчете менеджера за сегодня (атомарный счетчик, см. DailyTicketReport.count_ticket)"""
+    DailyTicketReport.count_ticket(manager, queue_type_name)
+
+
+def claim_next_ticket(queue_type, manager):
+    """Взять первый ожидающий талон типа очереди и отметить его обслуженным.
+
+    Кандидат забирается из очереди в памяти, а в БД талон закрепляется одним
+    условным UPDATE (served=False -> True). Если талон уже забрал менеджер
+    из другого процесса, UPDATE не затронет строку и берется следующий -
+    менеджеры не ждут друг друга и не получают один талон.
+    Возвращает данные талона из очереди или None, если очередь пуста.
+    """
+    return _claim_next_ticket(queue_type, manager)[0]
 
 
-def log_manager_action(manager, action_description, ticket_number=None, full_name=None, queue_type=None):
-    from accounts.models import ManagerActionLog
+def _claim_next_ticket(queue_type, manager):
+    """claim_next_ticket и количество пропущенных талонов, уже обслуженных в другом процессе"""
+    skipped = 0
+    while True:
+        entry = waiting_line.take_head(queue_type.name)
+        if entry is None:
+            return None, skipped
 
+        try:
+            claimed = QueueTicket.objects.filter(
+                pk=entry['id'],
+                served=False
+            ).update(served=True, serving_manager=manager)
+        except Exception:
+            waiting_line.return_to_head(queue_type.name, entry)
+            raise
+
+        if claimed:
+            return entry, skipped
+        skipped += 1
+
+
+def log_manager_action(manager, action_description, ticket_number=None, full_name=None, queue_type=None,
+                       action_type=ManagerActionLog.OTHER):
     action_text = action_description
     if full_name:
         action_text += f" ({full_name})"
     if queue_type:
         action_text += f" - {queue_type}"
 
-    ManagerActionLog.objects.create(
+    # Запись уходит в буфер журнала, запрос не ждет INSERT
+    audit.log_action(
         manager=manager,
         action=action_text,
+        action_type=action_type,
         ticket_number=ticket_number,
         queue_type=queue_type,
-        timestamp=datetime.now()
     )
 
 
@@ -313,95 +413,164 @@ def call_next(request):
                      f"Разрешенные типы: {', '.join(request.user.get_allowed_queue_types())}"
         }, status=status.HTTP_403_FORBIDDEN)
 
-    try:
-        queue_type = QueueType.objects.get(name=queue_type_name)
+    queue_type = registry.get(queue_type_name)
+    if queue_type is None:
+        return Response({"error": "Queue type not found"}, status=status.HTTP_400_BAD_REQUEST)
 
-        ticket = QueueTicket.objects.filter(
-            queue_type=queue_type,
-            served=False
-        ).order_by('created_at').first()
+    try:
+        media_url = request.build_absolute_uri(settings.MEDIA_URL)
 
-        if ticket is None:
+        called = serve_next_ticket(request.user, queue_type, media_url)
+        if called is None:
             return Response({"message": "Queue is empty."}, status=status.HTTP_200_OK)
+        ticket_message, audio_url, version = called
 
-        ticket.served = True
-        ticket.serving_manager = request.user
-        ticket.save()
-
-        ticket_number = ticket.number
-        full_name = ticket.full_name
-        manager_location = request.user.get_manager_location()
-
-        # Создаем TTS для объявления
-        tts_text = f"Талон номер {ticket_number}, подойдите к {manager_location}."
-
-        tts = gTTS(tts_text, lang='ru')
-
-        audio_filename = f"ticket_{ticket_number}_{request.user.username}.mp3"
-        audio_path = os.path.join(settings.MEDIA_ROOT, audio_filename)
-        tts.save(audio_path)
-
-        audio_url = request.build_absolute_uri(settings.MEDIA_URL + audio_filename)
-
-        # Отправляем WebSocket уведомление
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            "queues",
-            {
-                "type": "queue.ticket_called",
-                "message": {
-                    "queue_type": queue_type_name,
-                    "queue_type_display": queue_type.get_name_display(),
-                    "ticket_id": ticket.id,
-                    "ticket_number": ticket.number,
-                    "full_name": full_name,
-                    "manager_username": request.user.username,
-                    "manager_location": manager_location,
-                    "audio_url": audio_url
-                }
-            }
-        )
-
-        broadcast_ticket_count_update(queue_type_name)
-        increment_ticket_count(request.user)
-
-        # Обновленное логирование с типом очереди
-        log_manager_action(
-            request.user,
-            f"Вызван талон: {ticket.number}",
-            ticket.number,
-            full_name,
-            queue_type_name
-        )
+        # Отправляем WebSocket уведомление подписчикам очереди и дисплеям
+        snapshot.publish(version, [ticket_called_op(ticket_message)])
+        fanout.broadcast(queue_type_name, ticket_called_event(ticket_message, audio_url), displays=True)
+        fanout.send_positions(queue_type_name, ticket_positions_event(ticket_message, audio_url))
 
-        return Response({
-            "ticket_id": ticket.id,
-            "ticket_number": ticket.number,
-            "full_name": full_name,
-            "queue_type": queue_type_name,
-            "queue_type_display": queue_type.get_name_display(),
-            "manager_location": manager_location,
-            "audio_url": audio_url
-        }, status=status.HTTP_200_OK)
+        if audio_url is None:
+            announce_ticket(ticket_message, media_url)
+
+        return Response(call_next_response_data(ticket_message, audio_url), status=status.HTTP_200_OK)
 
-    except QueueType.DoesNotExist:
-        return Response({"error": "Queue type not found"}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         print(f"Error in call_next: {str(e)}")
         return Response({"error": "An error occurred"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def serve_next_ticket(manager, queue_type, media_url):
+    """Вызвать следующий талон (общая часть sync и async call_next).
+
+    Закрепляет талон за менеджером, готовит аудио и записывает статистику.
+    Возвращает данные вызова, ссылку на аудио (None - синтезируется в фоне)
+    и новую версию состояния, или None, если очередь пуста. Уведомления
+    отправляет вызывающий.
+    """
+    ticket = None
+    try:
+        # Закрепление талона, счетчики и текущее назначение - одна транзакция (на SQLite один коммит)
+        with transaction.atomic():
+            ticket, skipped = _claim_next_ticket(queue_type, manager)
+            if ticket is None:
+                return None
+            ticket_number = ticket['number']
+            increment_ticket_count(manager, queue_type.name)
+            called_at = timezone.now()
+            HourlyQueueStats.record_call(
+                manager, queue_type.name, (called_at - ticket['created_at']).total_seconds(), called_at
+            )
+            ManagerWorkplace.assign(manager, ticket['id'], ticket_number, called_at)
+    except Exception:
+        if ticket is not None:
+            waiting_line.return_to_head(queue_type.name, ticket)
+        raise
+    eta.record_call(manager, queue_type.name, called_at)
+    log_manager_action(
+        manager,
+        f"Вызван талон: {ticket_number}",
+        ticket_number,
+        ticket['full_name'],
+        queue_type.name,
+        action_type=ManagerActionLog.TICKET_CALLED
+    )
+    version = snapshot.advance(queue_type.name)
+
+    full_name = ticket['full_name']
+    manager_location = manager.get_manager_location()
+
+    # Аудио берется из кэша или мгновенного офлайн движка, иначе
+    # синтезируется в фоне и ссылка придет дисплеям событием ticket_audio_ready
+    audio_name = announcements.instant_audio(ticket_number, manager_location)
+    audio_url = media_url + audio_name if audio_name else None
+
+    ticket_message = {
+        "queue_type": queue_type.name,
+        "queue_type_display": queue_type.get_name_display(),
+        "ticket_id": ticket['id'],
+        "ticket_number": ticket_number,
+        "full_name": full_name,
+        "manager_username": manager.username,
+        "manager_location": manager_location,
+        "eta_seconds_per_ticket": eta.seconds_per_ticket(queue_type.name),
+        # Пропущенные талоны ушли из очереди не с головы - позиции нужно перечитать
+        "positions_reset": skipped > 0,
+    }
+
+    broadcast_ticket_count_update(queue_type.name)
+
+    return ticket_message, audio_url, version
+
+
+def ticket_called_op(ticket_message):
+    return {
+        'op': 'ticket_called',
+        'queue_type': ticket_message['queue_type'],
+        'queue_type_display': ticket_message['queue_type_display'],
+        'ticket_number': ticket_message['ticket_number'],
+        'full_name': ticket_message['full_name'],
+        'manager_username': ticket_message['manager_username'],
+    }
+
+
+def ticket_called_event(ticket_message, audio_url):
+    return {
+        "type": "queue.ticket_called",
+        "message": {**ticket_message, "audio_url": audio_url}
+    }
+
+
+def ticket_positions_event(ticket_message, audio_url):
+    """Событие личным каналам талонов типа (TicketConsumer).
+
+    Вызывается всегда голова очереди, поэтому талоны за ней сдвигаются на
+    одну позицию, а ETA считается по новому времени на талон. Если при
+    вызове были пропущены талоны, уже обслуженные в другом процессе,
+    событие несет reset и каналы перечитывают позицию.
+    """
+    return {
+        "type": "ticket.positions",
+        "reset": ticket_message.get('positions_reset', False),
+        "removed_ahead": 0,
+        "eta_seconds_per_ticket": ticket_message['eta_seconds_per_ticket'],
+        "called": {**ticket_message, "audio_url": audio_url},
+    }
+
+
+def ticket_positions_reset_event():
+    """Очередь сброшена или изменена вручную - личные каналы перечитывают позицию"""
+    return {"type": "ticket.positions", "reset": True}
+
+
+def announce_ticket(ticket_message, media_url):
+    """Синтезировать объявление в фоне"""
+    announcements.announce(
+        ticket_message['ticket_number'],
+        ticket_message['manager_location'],
+        media_url,
+        ticket_message
+    )
+
+
+def call_next_response_data(ticket_message, audio_url):
+    return {
+        "ticket_id": ticket_message['ticket_id'],
+        "ticket_number": ticket_message['ticket_number'],
+        "full_name": ticket_message['full_name'],
+        "queue_type": ticket_message['queue_type'],
+        "queue_type_display": ticket_message['queue_type_display'],
+        "manager_location": ticket_message['manager_location'],
+        "audio_url": audio_url
+    }
+
+
 @api_view(['POST'])
 def delete_audio(request):
+    """Оставлен для старых клиентов: аудио удаляет сборщик queue_qr.media_gc"""
     audio_filename = request.data.get('audio_filename')
 
     if not audio_filename:
         return JsonResponse({"error": "Filename not provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-    audio_path = os.path.join(settings.MEDIA_ROOT, audio_filename)
-
-    if os.path.exists(audio_path):
-        os.remove(audio_path)
-        return JsonResponse({"message": "Audio deleted successfully"}, status=status.HTTP_200_OK)
-    else:
-        return JsonResponse({"error": "File not found"}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+    return JsonResponse({"message": "Audio is removed automatically"}, status=status.HTTP_200_OK)
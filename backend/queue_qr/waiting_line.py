@@ -0,0 +1,329 @@
+"""Очереди ожидающих талонов в памяти процесса.
+
+Для каждого типа очереди хранится упорядоченный список необслуженных
+талонов. join_queue добавляет талон в конец, call_next забирает первый,
+поэтому голова очереди, количество и список ожидающих отдаются без
+запросов к БД. Объекты очередей изменяются только под блокировкой модуля,
+наружу отдаются количества и копии талонов. При первом обращении (после старта процесса) очереди
+загружаются из БД.
+
+Очереди согласованы с общей версией состояния (queue_qr.snapshot): если
+версию увеличил другой процесс, при следующем обращении из БД
+перечитываются очереди измененных им типов, а если это неизвестно - все.
+"""
+import threading
+from collections import OrderedDict
+
+from . import snapshot
+
+_lock = threading.RLock()
+_lines = {}
+_loaded = False
+_version = None
+
+
+class _Fenwick:
+    """Дерево Фенвика над слотами очереди: сколько занятых слотов левее слота, за O(log n)"""
+
+    def __init__(self, size):
+        self._tree = [0] * (size + 1)
+
+    @property
+    def size(self):
+        return len(self._tree) - 1
+
+    def add(self, slot, delta):
+        index = slot + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def count_before(self, slot):
+        index = slot
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+
+class WaitingLine:
+    """Ожидающие талоны одного типа очереди в порядке создания.
+
+    Каждый талон занимает слот - возрастающий номер в порядке очереди, а
+    дерево Фенвика над слотами дает позицию талона за O(log n): вызов
+    головы и добавление в конец не сдвигают остальные слоты.
+    """
+
+    _MIN_SLOTS = 64
+    # Свободные слоты перед головой для возврата талонов (return_to_head)
+    _FRONT_SLOTS = 16
+
+    def __init__(self):
+        self._tickets = OrderedDict()
+        self._by_token = {}
+        self._rebuild(0)
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def __contains__(self, ticket_id):
+        return ticket_id in self._tickets
+
+    def append(self, entry):
+        """Поставить талон на его место по (created_at, id) - почти всегда в конец.
+
+        Талоны добавляются после коммита, и два параллельных join_queue могут
+        прийти не в порядке выдачи: тогда более поздние талоны хвоста
+        снимаются и ставятся обратно после нового.
+        """
+        if entry['id'] in self._tickets:
+            return
+        later = []
+        while self._tickets:
+            tail = next(reversed(self._tickets.values()))
+            if _order_key(tail) <= _order_key(entry):
+                break
+            later.append(self.remove(tail['id']))
+        self._append(entry)
+        for tail in reversed(later):
+            self._append(tail)
+
+    def _append(self, entry):
+        if self._next_slot >= self._fenwick.size:
+            self._rebuild(self._FRONT_SLOTS)
+        self._tickets[entry['id']] = entry
+        self._by_token[entry['token']] = entry['id']
+        self._take_slot(entry['id'], self._next_slot)
+        self._next_slot += 1
+
+    def remove(self, ticket_id):
+        entry = self._tickets.pop(ticket_id, None)
+        if entry is not None:
+            self._by_token.pop(entry['token'], None)
+            self._release_slot(ticket_id)
+        return entry
+
+    def head(self):
+        return next(iter(self._tickets.values()), None)
+
+    def pop_head(self):
+        if not self._tickets:
+            return None
+        ticket_id, entry = self._tickets.popitem(last=False)
+        self._by_token.pop(entry['token'], None)
+        self._release_slot(ticket_id)
+        return entry
+
+    def push_front(self, entry):
+        self.remove(entry['id'])
+        head = next(iter(self._tickets), None)
+        if head is None:
+            self._append(entry)
+            return
+        # Слоты перед головой всегда свободны
+        if self._slots[head] == 0:
+            self._rebuild(self._FRONT_SLOTS)
+        self._tickets[entry['id']] = entry
+        self._tickets.move_to_end(entry['id'], last=False)
+        self._by_token[entry['token']] = entry['id']
+        self._take_slot(entry['id'], self._slots[head] - 1)
+
+    def index(self, ticket_id):
+        """Сколько талонов стоит перед талоном (None - талона нет в очереди)"""
+        slot = self._slots.get(ticket_id)
+        if slot is None:
+            return None
+        return self._fenwick.count_before(slot)
+
+    def by_token(self, token):
+        ticket_id = self._by_token.get(token)
+        return self._tickets.get(ticket_id) if ticket_id is not None else None
+
+    def tickets(self, limit=None):
+        if limit is None:
+            return list(self._tickets.values())
+        result = []
+        for entry in self._tickets.values():
+            if len(result) >= limit:
+                break
+            result.append(entry)
+        return result
+
+    def clear(self):
+        self._tickets.clear()
+        self._by_token.clear()
+        self._rebuild(0)
+
+    def _take_slot(self, ticket_id, slot):
+        self._slots[ticket_id] = slot
+        self._fenwick.add(slot, 1)
+
+    def _release_slot(self, ticket_id):
+        self._fenwick.add(self._slots.pop(ticket_id), -1)
+
+    def _rebuild(self, first_slot):
+        """Переложить талоны в слоты подряд с first_slot (рост или нехватка слотов у головы)"""
+        self._fenwick = _Fenwick(max(self._MIN_SLOTS, 2 * (first_slot + len(self._tickets))))
+        self._slots = {}
+        self._next_slot = first_slot
+        for ticket_id in self._tickets:
+            self._take_slot(ticket_id, self._next_slot)
+            self._next_slot += 1
+
+
+def _order_key(entry):
+    return entry['created_at'], entry['id']
+
+
+def ticket_entry(ticket):
+    """Данные талона, которые хранятся в очереди"""
+    return {
+        'id': ticket.id,
+        'number': ticket.number,
+        'full_name': ticket.full_name,
+        'token': str(ticket.token),
+        'created_at': ticket.created_at,
+    }
+
+
+def _ticket_rows(queue_type_name=None):
+    from .models import QueueTicket
+
+    tickets = QueueTicket.objects.filter(served=False)
+    if queue_type_name is not None:
+        tickets = tickets.filter(queue_type__name=queue_type_name)
+    return tickets.order_by('created_at', 'id').values(
+        'id', 'number', 'full_name', 'token', 'created_at', 'queue_type__name'
+    )
+
+
+def _fill(lines, rows):
+    for row in rows:
+        line = lines.setdefault(row.pop('queue_type__name'), WaitingLine())
+        row['token'] = str(row['token'])
+        line.append(row)
+
+
+def load():
+    """Загрузить все очереди из БД (при старте процесса или после чужих изменений)"""
+    global _loaded, _version
+    with _lock:
+        # Версию берем до чтения, чтобы изменения во время загрузки вызвали повторную
+        _version = snapshot.get_version()
+        _lines.clear()
+        _fill(_lines, _ticket_rows())
+        _loaded = True
+
+
+def reload(queue_type_name):
+    """Перечитать из БД очередь одного типа (после ручных правок талонов)"""
+    with _lock:
+        if not _loaded:
+            load()
+            return
+        line = _lines.setdefault(queue_type_name, WaitingLine())
+        line.clear()
+        _fill({queue_type_name: line}, _ticket_rows(queue_type_name))
+
+
+def note_version(version):
+    """Версия состояния увеличена после изменения в этом процессе"""
+    global _version
+    with _lock:
+        # Пропущенная версия означает чужое изменение - очереди перечитаются
+        if _version is not None and version == _version + 1:
+            _version = version
+
+
+def _ensure_current():
+    global _version
+    if not _loaded:
+        load()
+        return
+    version = snapshot.get_version()
+    if version == _version:
+        return
+    changed = snapshot.changed_queue_types(_version, version)
+    if changed is None:
+        load()
+        return
+    # Версию запоминаем до чтения, как в load()
+    _version = version
+    for queue_type_name in changed:
+        reload(queue_type_name)
+
+
+def _get_line(queue_type_name):
+    """Очередь типа; вызывать под _lock - наружу объект очереди не отдается"""
+    _ensure_current()
+    return _lines.setdefault(queue_type_name, WaitingLine())
+
+
+def count(queue_type_name):
+    """Количество ожидающих талонов типа"""
+    with _lock:
+        return len(_get_line(queue_type_name))
+
+
+def head(queue_type_name):
+    """Копия первого талона очереди или None"""
+    with _lock:
+        entry = _get_line(queue_type_name).head()
+        return dict(entry) if entry is not None else None
+
+
+def tickets(queue_type_name, limit=None):
+    """Копии ожидающих талонов типа в порядке очереди (первые limit)"""
+    with _lock:
+        return [dict(entry) for entry in _get_line(queue_type_name).tickets(limit)]
+
+
+def add_ticket(ticket):
+    """Талон создан (вызывать после коммита)"""
+    with _lock:
+        _get_line(ticket.queue_type.name).append(ticket_entry(ticket))
+
+
+def remove_ticket(queue_type_name, ticket_id):
+    """Талон обслужен или удален"""
+    with _lock:
+        return _get_line(queue_type_name).remove(ticket_id)
+
+
+def ahead_of(queue_type_name, ticket_id):
+    """Количество талонов перед талоном в его очереди (None - талон не ожидает)"""
+    with _lock:
+        return _get_line(queue_type_name).index(ticket_id)
+
+
+def find_token(token):
+    """Ожидающий талон по токену: (тип очереди, данные талона, талонов впереди) или None"""
+    with _lock:
+        _ensure_current()
+        for queue_type_name, line in _lines.items():
+            entry = line.by_token(token)
+            if entry is not None:
+                return queue_type_name, entry, line.index(entry['id'])
+        return None
+
+
+def take_head(queue_type_name):
+    """Забрать первый талон из очереди.
+
+    Взятие и удаление происходят под одной блокировкой, поэтому два менеджера
+    в одном процессе никогда не получат один и тот же талон.
+    """
+    with _lock:
+        return _get_line(queue_type_name).pop_head()
+
+
+def return_to_head(queue_type_name, entry):
+    """Вернуть талон в начало очереди (если вызов не удалось записать в БД)"""
+    with _lock:
+        _get_line(queue_type_name).push_front(entry)
+
+
+def clear(queue_type_name):
+    with _lock:
+        _get_line(queue_type_name).clear()
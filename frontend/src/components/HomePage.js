@@ -1,10 +1,54 @@
-import React, { useState, useEffect, useCallback, useMemo } from 'react';
+import React, { useState, useEffect, useCallback, useMemo, useRef } from 'react';
 import { Link } from 'react-router-dom';
 import ReconnectingWebSocket from 'reconnecting-websocket';
 import logo from '../static/logo.png';
 import { config } from "../config";
 import axiosInstance from "../axiosInstance";
 import '../styles/homePage.css'
+
+const WAITING_KEY = 'Зарегестрированные талоны';
+const SERVED_KEY = 'Все обслуживаемые талоны';
+
+// Apply state_delta operations to the /queues/ snapshot (operations are idempotent)
+function applyStateOps(queues, ops) {
+    return ops.reduce((current, op) => current.map(queue => {
+        if (!queue || typeof queue !== 'object') return queue;
+
+        if (Array.isArray(queue[SERVED_KEY])) {
+            if (op.op === 'ticket_called') {
+                const served = queue[SERVED_KEY].filter(ticket => ticket?.manager_username !== op.manager_username);
+                served.unshift({
+                    ticket_number: op.ticket_number,
+                    full_name: op.full_name,
+                    manager_username: op.manager_username,
+                    queue_type: op.queue_type,
+                    queue_type_display: op.queue_type_display
+                });
+                return { ...queue, [SERVED_KEY]: served };
+            }
+            if (op.op === 'queue_reset') {
+                return { ...queue, [SERVED_KEY]: queue[SERVED_KEY].filter(ticket => ticket?.queue_type !== op.queue_type) };
+            }
+            return queue;
+        }
+
+        if (queue.queue_type_code !== op.queue_type) return queue;
+        const waiting = Array.isArray(queue[WAITING_KEY]) ? queue[WAITING_KEY] : [];
+
+        if (op.op === 'ticket_added') {
+            if (waiting.some(ticket => ticket?.number === op.ticket_number)) return queue;
+            return { ...queue, [WAITING_KEY]: [...waiting, { number: op.ticket_number, full_name: op.full_name }] };
+        }
+        if (op.op === 'ticket_called') {
+            return { ...queue, [WAITING_KEY]: waiting.filter(ticket => ticket?.number !== op.ticket_number) };
+        }
+        if (op.op === 'queue_reset') {
+            return { ...queue, [WAITING_KEY]: [] };
+        }
+        return queue;
+    }), queues);
+}
+
 function HomePage() {
     document.title = "Электронная очередь - IITU";
 
@@ -18,6 +62,9 @@ function HomePage() {
     const [isLoading, setIsLoading] = useState(true);
     const [error, setError] = useState(null);
     const [connectionStatus, setConnectionStatus] = useState('connecting');
+    const wsRef = useRef(null);
+    // Sequence number of the last applied state stream message
+    const seqRef = useRef(null);
 
     // Get served tickets
     const servedTickets = useMemo(() => {
@@ -74,64 +121,28 @@ function HomePage() {
     // Handle WebSocket messages
     const handleWebSocketMessage = useCallback((data) => {
         try {
-            if (data.type === 'ticket_called' && data.data) {
+            if (data.type === 'state_snapshot') {
+                seqRef.current = data.seq;
+                setQueues(data.data);
+                setIsLoading(false);
+                setError(null);
+            } else if (data.type === 'state_delta') {
+                // Deltas before the snapshot or already included in it are skipped
+                if (seqRef.current === null || data.seq <= seqRef.current) return;
+
+                const resync = data.seq !== seqRef.current + 1 || data.ops.some(op => op.op === 'resync');
+                if (resync) {
+                    seqRef.current = null;
+                    wsRef.current?.send(JSON.stringify({ action: 'resync' }));
+                    return;
+                }
+                seqRef.current = data.seq;
+                setQueues(prevQueues => applyStateOps(Array.isArray(prevQueues) ? prevQueues : [], data.ops));
+            } else if (data.type === 'ticket_called' && data.data) {
                 if (!data.data.queue_type || !data.data.ticket_number || !data.data.manager_username) {
                     return;
                 }
 
-                // Update queues
-                setQueues(prevQueues => {
-                    if (!Array.isArray(prevQueues)) return [];
-
-                    return prevQueues.map(queue => {
-                        if (!queue || typeof queue !== 'object') return queue;
-
-                        // Remove from registered tickets
-                        if (queue['queue_type_code'] === data.data.queue_type) {
-                            const registeredTickets = Array.isArray(queue['Зарегестрированные талоны'])
-                                ? queue['Зарегестрированные талоны']
-                                : [];
-
-                            const updatedRegisteredTickets = registeredTickets.filter(ticket =>
-                                String(ticket?.number || '') !== String(data.data.ticket_number)
-                            );
-
-                            return {
-                                ...queue,
-                                'Зарегестрированные талоны': updatedRegisteredTickets,
-                            };
-                        }
-
-                        // Update served tickets
-                        if (queue['Все обслуживаемые талоны'] && Array.isArray(queue['Все обслуживаемые талоны'])) {
-                            const servedTickets = [...queue['Все обслуживаемые талоны']];
-
-                            // Remove previous ticket from this manager
-                            const filteredTickets = servedTickets.filter(ticket =>
-                                ticket?.manager_username !== data.data.manager_username
-                            );
-
-                            // Add new ticket
-                            const newTicket = {
-                                ticket_number: data.data.ticket_number || 'N/A',
-                                full_name: data.data.full_name || 'Неизвестно',
-                                manager_username: data.data.manager_username || 'Неизвестно',
-                                queue_type: data.data.queue_type || 'UNKNOWN',
-                                queue_type_display: data.data.queue_type_display || data.data.queue_type || 'Неизвестная очередь'
-                            };
-
-                            filteredTickets.push(newTicket);
-
-                            return {
-                                ...queue,
-                                'Все обслуживаемые талоны': filteredTickets
-                            };
-                        }
-
-                        return queue;
-                    });
-                });
-
                 // Add to popup queue
                 const popupTicket = {
                     ticket_number: data.data.ticket_number || 'N/A',
@@ -153,15 +164,16 @@ function HomePage() {
                     navigator.vibrate([200, 100, 200]);
                 }
 
-            } else if (data.message?.includes("New ticket") ||
-                       data.type === "ticket_count_update" ||
-                       data.type === "new_ticket") {
-                fetchQueues();
+            } else if (data.type === 'ticket_audio_ready' && data.data) {
+                // Audio is synthesized after the call and arrives separately
+                if (data.data.audio_url) {
+                    setAudioQueue(prevQueue => [...prevQueue, data.data.audio_url]);
+                }
             }
         } catch (error) {
             console.error('Error handling WebSocket message:', error);
         }
-    }, [fetchQueues]);
+    }, []);
 
     // WebSocket setup
     useEffect(() => {
@@ -171,9 +183,9 @@ function HomePage() {
             setAudioAllowed(true);
         }
 
-        fetchQueues();
-
+        // The board comes from the state stream: a snapshot on connect, then deltas
         const ws = new ReconnectingWebSocket(config.queuesSocketUrl);
+        wsRef.current = ws;
 
         ws.onopen = () => {
             console.log("WebSocket connected");
@@ -182,10 +194,16 @@ function HomePage() {
 
         ws.onerror = () => {
             setConnectionStatus('error');
+            // Without the stream fall back to a one-off fetch
+            if (seqRef.current === null) {
+                fetchQueues();
+            }
         };
 
         ws.onclose = () => {
             setConnectionStatus('disconnected');
+            // A reconnect sends a fresh snapshot
+            seqRef.current = null;
         };
 
         ws.onmessage = (event) => {
@@ -184,12 +184,15 @@ function TicketDisplayPage() {
             notificationService.setUserTicketInfo(ticketInfo);
         }
 
-        // WebSocket connection
-        const ws = new ReconnectingWebSocket(config.queuesSocketUrl);
+        // WebSocket connection: личный канал талона присылает только его позицию,
+        // ETA и вызов; без токена - общий канал и опрос списка очередей
+        const ws = new ReconnectingWebSocket(token ? `${config.ticketsSocketUrl}${token}/` : config.queuesSocketUrl);
 
         ws.onopen = () => {
             console.log('WebSocket connected for ticket tracking');
-            updateQueuePosition();
+            if (!token) {
+                updateQueuePosition();
+            }
         };
 
         ws.onerror = (error) => {
@@ -201,14 +204,28 @@ function TicketDisplayPage() {
                 const data = JSON.parse(event.data);
                 console.log('WebSocket message on ticket page:', data);
 
+                if (data.type === "ticket_position" && data.data) {
+                    setQueuePosition(data.data.position);
+                    setEstimatedWaitTime(data.data.eta_seconds != null ? data.data.eta_seconds / 60 : null);
+                }
+
+                if (data.type === "ticket_not_waiting") {
+                    // Талон ушел из очереди без вызова (например, очередь сброшена)
+                    const savedStatus = localStorage.getItem(`ticket_${ticketId}_status`);
+                    if (!savedStatus || !['called', 'missed'].includes(JSON.parse(savedStatus).status)) {
+                        setQueueStatus('completed');
+                    }
+                }
+
                 if (data.type === "ticket_called" && data.data) {
                     const isOurTicket = data.data.ticket_id === ticketId ||
                         (data.data.ticket_number === ticketNumber && data.data.full_name === fullName);
 
                     if (isOurTicket) {
-                        // Our ticket was called
+                        // Our ticket was called (личный канал не присылает ФИО)
+                        const calledData = { ...data.data, full_name: data.data.full_name || fullName };
                         const currentlyServingData = {
-                            full_name: data.data.full_name,
+                            full_name: calledData.full_name,
                             ticket_number: data.data.ticket_number,
                             manager_username: data.data.manager_username,
                             queue_type_display: data.data.queue_type_display
@@ -226,7 +243,7 @@ function TicketDisplayPage() {
                         localStorage.setItem(`ticket_${ticketId}_status`, JSON.stringify(ticketStatus));
 
                         // Show notification
-                        notificationService.showTicketCalledNotification(data.data);
+                        notificationService.showTicketCalledNotification(calledData);
 
                         // Play audio
                         if (data.data.audio_url) {
@@ -374,7 +391,11 @@ const getManagerLocation = (managerUsername) => {
         if (navigator.vibrate) {
             navigator.vibrate(100);
         }
-        updateQueuePosition();
+        if (token && socket) {
+            socket.send(JSON.stringify({ action: 'refresh' }));
+        } else {
+            updateQueuePosition();
+        }
     };
 
     const handleGoHome = () => {
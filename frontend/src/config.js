@@ -33,6 +33,7 @@ export const config = {
 
     // WebSocket URLs
     queuesSocketUrl: `${WS_BASE_URL}/queues/`,
+    ticketsSocketUrl: `${WS_BASE_URL}/tickets/`, // + token + '/': личный канал талона
     wsCallNextUrl: `${WS_BASE_URL}/call-next/`,
     displaySocketUrl: `${WS_BASE_URL}/displays/`,
     accountsSocketUrl: `${WS_BASE_URL}/accounts/`,